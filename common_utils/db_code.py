@@ -0,0 +1,246 @@
+import hashlib
+import os
+import re
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+
+# A materialized view X reads the plain view of the db code, renamed to X_live
+LIVE_SUFFIX = '_live'
+# The name of a materialized view X while db code is compiled, when X names its live view
+COMPILING_SUFFIX = '_materialized'
+
+# The names of the views a db code file creates
+VIEW_DEFINITION = re.compile(
+    r'^\s*create\s+(?:or\s+replace\s+)?(?:materialized\s+)?view\s+(?:if\s+not\s+exists\s+)?([\w."]+)',
+    re.IGNORECASE | re.MULTILINE)
+
+# Views and materialized views reading the given relations, directly or through other views
+DEPENDENT_VIEWS = """
+    WITH RECURSIVE dependents(oid) AS (
+        SELECT oid FROM pg_class
+        WHERE relnamespace = current_schema()::regnamespace AND relname = ANY(%s)
+        UNION
+        SELECT rewrite.ev_class
+        FROM pg_depend depend
+        JOIN pg_rewrite rewrite ON rewrite.oid = depend.objid
+        JOIN dependents ON depend.refobjid = dependents.oid
+        WHERE depend.classid = 'pg_rewrite'::regclass AND depend.refclassid = 'pg_class'::regclass
+    )
+    SELECT relname FROM pg_class WHERE oid IN (SELECT oid FROM dependents)"""
+
+
+def sql_files(app_config):
+    """Paths of the .sql files in the app's db_code directory, in the order they are compiled."""
+    # Assuming you have a standardized directory structure for SQL files
+    sql_dir = os.path.join(app_config.path, 'db_code')
+    if not os.path.exists(sql_dir):
+        return []
+    return [os.path.join(sql_dir, file_name) for file_name in sorted(os.listdir(sql_dir))
+            if file_name.endswith('.sql')]
+
+
+def compile_sql_file(file_path):
+    with open(file_path, 'r') as f:
+        sql_content = f.read()
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql_content)
+
+
+def defined_views(sql_content):
+    """Names of the views created by a db code file."""
+    return [name.rpartition('.')[2].strip('"') for name in VIEW_DEFINITION.findall(sql_content)]
+
+
+def materialized_views(app_config):
+    """The app's `materialized_views`: {view name: (unique key column, other indexed columns...)}."""
+    return getattr(app_config, 'materialized_views', {})
+
+
+def views_to_materialize(app_config):
+    """The app's materialized_views if settings.MATERIALIZE_DB_VIEWS is on, none otherwise."""
+    return materialized_views(app_config) if getattr(settings, 'MATERIALIZE_DB_VIEWS', False) else {}
+
+
+def existing_materialized_views(app_config):
+    """Names of the app's materialized_views that are materialized views in the database now."""
+    views = list(materialized_views(app_config))
+    if not views:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT matviewname FROM pg_matviews '
+                       'WHERE schemaname = current_schema() AND matviewname = ANY(%s)', [views])
+        existing = {view for view, in cursor.fetchall()}
+    return [view for view in views if view in existing]
+
+
+def drop_materialized_views(app_config, views=None):
+    """Drop the app's materialized views (or those of them in `views`) and the live views they read, so its
+    db code can recreate the plain views (a DROP VIEW of a materialized view fails).
+    """
+    with connection.cursor() as cursor:
+        for view in existing_materialized_views(app_config):
+            if views is not None and view not in views:
+                continue
+            # IF EXISTS: dropping an earlier live view may have cascaded to this one already
+            cursor.execute(f'DROP MATERIALIZED VIEW IF EXISTS {view} CASCADE')
+            cursor.execute(f'DROP VIEW IF EXISTS {view}{LIVE_SUFFIX} CASCADE')
+
+
+@contextmanager
+def live_view_names(app_configs):
+    """Swap the names of the apps' materialized views and their live views while db code is compiled, so
+    the views it creates read the live views, as they do when compiled together with the views they read,
+    rather than the materialized ones.
+    """
+    renamed = [view for app_config in app_configs for view in existing_materialized_views(app_config)]
+    with connection.cursor() as cursor:
+        for view in renamed:
+            cursor.execute(f'ALTER MATERIALIZED VIEW {view} RENAME TO {view}{COMPILING_SUFFIX}')
+            cursor.execute(f'ALTER VIEW {view}{LIVE_SUFFIX} RENAME TO {view}')
+    yield
+    with connection.cursor() as cursor:
+        for view in renamed:
+            cursor.execute(f'ALTER VIEW {view} RENAME TO {view}{LIVE_SUFFIX}')
+            cursor.execute(f'ALTER MATERIALIZED VIEW {view}{COMPILING_SUFFIX} RENAME TO {view}')
+
+
+def materialize_views(app_config, views=None, with_data=True):
+    """Replace the app's plain views that are to be materialized (see views_to_materialize), or those of them
+    in `views`, by materialized views of the same name.
+
+    Each plain view is kept as X_live for the materialized view to read, and the materialized view gets a
+    unique index on its key column, which REFRESH ... CONCURRENTLY needs, and an index on every other column.
+    Without `with_data` the materialized views are left unpopulated until refresh_materialized_views runs.
+    """
+    with connection.cursor() as cursor:
+        for view, (key, *indexed) in views_to_materialize(app_config).items():
+            if views is not None and view not in views:
+                continue
+            cursor.execute(f'ALTER VIEW {view} RENAME TO {view}{LIVE_SUFFIX}')
+            cursor.execute(f'CREATE MATERIALIZED VIEW {view} AS SELECT * FROM {view}{LIVE_SUFFIX}'
+                           f'{"" if with_data else " WITH NO DATA"}')
+            cursor.execute(f'CREATE UNIQUE INDEX {view}_{key}_uniq ON {view} ({key})')
+            for column in indexed:
+                cursor.execute(f'CREATE INDEX {view}_{column}_idx ON {view} ({column})')
+
+
+def db_code_files(app_configs):
+    """The db code files of the given apps in compile order, as dicts of the app config, file name, SQL,
+    its checksum and the views it creates.
+    """
+    files = []
+    for app_config in app_configs:
+        for file_path in sql_files(app_config):
+            with open(file_path, 'r') as f:
+                sql_content = f.read()
+            files.append({
+                'app_config': app_config,
+                'path': file_path,
+                'name': os.path.basename(file_path),
+                'sql': sql_content,
+                'checksum': hashlib.sha256(sql_content.encode()).hexdigest(),
+                'views': defined_views(sql_content),
+            })
+    return files
+
+
+def stale_files(files, force=False):
+    """The files to compile: those changed since they were last compiled, those whose views are missing or
+    not (or no longer) materialized as views_to_materialize says, and the files of the views depending on any
+    of them, which compiling them drops with CASCADE.
+    """
+    from common_utils.models import CompiledSqlFile
+
+    recorded = {(record.app_label, record.file_name): record.checksum for record in CompiledSqlFile.objects.filter(
+        app_label__in={file['app_config'].label for file in files})}
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT relname, relkind FROM pg_class '
+                       'WHERE relnamespace = current_schema()::regnamespace AND relname = ANY(%s)',
+                       [[view for file in files for view in file['views']]])
+        kinds = dict(cursor.fetchall())
+
+    def is_stale(file):
+        if force or recorded.get((file['app_config'].label, file['name'])) != file['checksum']:
+            return True
+        mviews = views_to_materialize(file['app_config'])
+        return any(kinds.get(view) != ('m' if view in mviews else 'v') for view in file['views'])
+
+    stale = {number for number, file in enumerate(files) if is_stale(file)}
+    checked = set()
+    with connection.cursor() as cursor:
+        while stale - checked:
+            views = {view for number in stale - checked for view in files[number]['views']}
+            checked |= stale
+            cursor.execute(DEPENDENT_VIEWS, [sorted(views | {view + LIVE_SUFFIX for view in views})])
+            dependents = {name.removesuffix(LIVE_SUFFIX) for name, in cursor.fetchall()}
+            stale |= {number for number, file in enumerate(files) if dependents.intersection(file['views'])}
+    return [files[number] for number in sorted(stale)]
+
+
+def compile_db_code(app_configs, force=False, with_data=True):
+    """Compile the stale db code files of the given apps (see stale_files) in one transaction and record
+    their checksums; returns the compiled files, none if the database is up to date.
+
+    The views to materialize (see views_to_materialize) are created as materialized views, populated unless
+    `with_data` is false (see materialize_views). Views already materialized that aren't compiled again are
+    kept, and the compiled views read their live views (see live_view_names).
+    """
+    from common_utils.models import CompiledSqlFile
+
+    stale = stale_files(db_code_files(app_configs), force)
+    if not stale:
+        return []
+
+    with transaction.atomic():
+        for app_config in app_configs:
+            views = {view for file in stale if file['app_config'] is app_config for view in file['views']}
+            if views:
+                drop_materialized_views(app_config, views)
+        with live_view_names(app_configs):
+            for file in stale:
+                with connection.cursor() as cursor:
+                    cursor.execute(file['sql'])
+                CompiledSqlFile.objects.update_or_create(
+                    app_label=file['app_config'].label, file_name=file['name'],
+                    defaults={'checksum': file['checksum']})
+        for app_config in app_configs:
+            views = {view for file in stale if file['app_config'] is app_config for view in file['views']}
+            if views:
+                materialize_views(app_config, views, with_data)
+    return stale
+
+
+def compile_app(app_label, with_data=True):
+    """Compile the stale db code of an app, e.g. to recreate its views after a table they read was replaced.
+
+    Views are materialized as views_to_materialize says, and left unpopulated without `with_data`.
+    """
+    return compile_db_code([apps.get_app_config(app_label)], with_data=with_data)
+
+
+def refresh_materialized_views(app_labels=None):
+    """REFRESH MATERIALIZED VIEW CONCURRENTLY the materialized views of the given apps (all by default), so
+    readers keep reading the old rows meanwhile. Views that are not materialized are skipped; returns the
+    names of the refreshed views.
+
+    Views created WITH NO DATA can't be refreshed concurrently and are populated with a plain REFRESH.
+    """
+    app_configs = [apps.get_app_config(label) for label in app_labels] if app_labels else apps.get_app_configs()
+    refreshed = []
+    with connection.cursor() as cursor:
+        for app_config in app_configs:
+            views = list(materialized_views(app_config))
+            if not views:
+                continue
+            cursor.execute('SELECT matviewname, ispopulated FROM pg_matviews '
+                           'WHERE schemaname = current_schema() AND matviewname = ANY(%s)', [views])
+            populated = dict(cursor.fetchall())
+            for view in views:
+                if view in populated:
+                    cursor.execute(f'REFRESH MATERIALIZED VIEW {"CONCURRENTLY " if populated[view] else ""}{view}')
+                    refreshed.append(view)
+    return refreshed
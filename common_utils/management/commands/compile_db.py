@@ -1,42 +1,46 @@
-import os
+import time
 
 from django.core.management.base import BaseCommand, CommandError
 from django.apps import apps
-from django.db import connection
+
+from common_utils.db_code import compile_db_code, db_code_files, views_to_materialize
 
 
 class Command(BaseCommand):
-    help = 'Compiles all database db code in specified or all applications.'
+    help = ('Compiles the database db code in specified or all applications. Files unchanged since they were '
+            'last compiled are skipped, unless a view they create is missing or depends on a recompiled one. '
+            "With settings.MATERIALIZE_DB_VIEWS, the views listed in an app config's materialized_views are "
+            'created as materialized views.')
 
     def add_arguments(self, parser):
         parser.add_argument('--apps', '-a', nargs='+', type=str, default=None,
                             help='List of app names to compile db code for. If not provided, will compile for all apps.')
+        parser.add_argument('--force', action='store_true',
+                            help='Compile every file, even the ones whose checksum has not changed.')
 
     def handle(self, *args, **options):
-        app_names = options['apps'] or apps.get_app_configs()
-
-        for app_config in app_names:
+        app_configs = []
+        for app_config in options['apps'] or apps.get_app_configs():
             if isinstance(app_config, str):  # If it's a string, get AppConfig instance
                 try:
                     app_config = apps.get_app_config(app_config)
                 except LookupError:
                     raise CommandError(f"App '{app_config}' does not exist.")
-
-            # Assuming you have a standardized directory structure for SQL files
-            sql_dir = os.path.join(app_config.path, 'db_code')
-            # self.stdout.write(f'{sql_dir}')
-
-            if os.path.exists(sql_dir):
-                for file_name in sorted(os.listdir(sql_dir)):
-                    if file_name.endswith('.sql'):
-                        file_path = os.path.join(sql_dir, file_name)
-                        self.stdout.write(self.style.SUCCESS(f'{file_path} execution starts.'))
-
-                        with open(file_path, 'r') as f:
-                            sql_content = f.read()
-
-                        with connection.cursor() as cursor:
-                            cursor.execute(sql_content)
-                        self.stdout.write(self.style.SUCCESS(f'{file_path} have been compiled successfully.'))
-
-        self.stdout.write(self.style.SUCCESS('All db code have been compiled successfully.'))
+            app_configs.append(app_config)
+
+        started = time.perf_counter()
+        compiled = compile_db_code(app_configs, force=options['force'])
+        seconds = time.perf_counter() - started
+
+        for file in compiled:
+            self.stdout.write(self.style.SUCCESS(f'{file["path"]} have been compiled successfully.'))
+        for app_config in app_configs:
+            views = [view for view in views_to_materialize(app_config)
+                     if any(file['app_config'] is app_config and view in file['views'] for file in compiled)]
+            if views:
+                self.stdout.write(self.style.SUCCESS(f'Materialized {", ".join(views)} of {app_config.label}.'))
+
+        unchanged = len(db_code_files(app_configs)) - len(compiled)
+        self.stdout.write(self.style.SUCCESS(
+            f'All db code have been compiled successfully in {seconds:.3f}s: {len(compiled)} files compiled, '
+            f'{unchanged} unchanged.'))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.apps import apps
+
+from common_utils.db_code import refresh_materialized_views
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the materialized views created by compile_db, without blocking readers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apps', '-a', nargs='+', type=str, default=None,
+                            help='List of app names to refresh the views of. If not provided, will refresh all apps.')
+
+    def handle(self, *args, **options):
+        for app_label in options['apps'] or []:
+            try:
+                apps.get_app_config(app_label)
+            except LookupError:
+                raise CommandError(f"App '{app_label}' does not exist.")
+
+        started = time.perf_counter()
+        refreshed = refresh_materialized_views(options['apps'])
+        if refreshed:
+            self.stdout.write(self.style.SUCCESS(
+                f'Refreshed {", ".join(refreshed)} in {time.perf_counter() - started:.2f}s.'))
+        else:
+            self.stdout.write('No materialized views to refresh.')
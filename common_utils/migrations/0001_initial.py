@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompiledSqlFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app_label', models.CharField(max_length=100)),
+                ('file_name', models.CharField(max_length=255)),
+                ('checksum', models.CharField(help_text='SHA-256 of the file content', max_length=64)),
+                ('compiled_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('app_label', 'file_name')},
+            },
+        ),
+    ]
@@ -1,3 +1,15 @@
 from django.db import models
 
-# Create your models here.
+
+class CompiledSqlFile(models.Model):
+    """A db code file as compile_db last ran it; the file is skipped while its checksum doesn't change."""
+    app_label = models.CharField(max_length=100)
+    file_name = models.CharField(max_length=255)
+    checksum = models.CharField(max_length=64, help_text='SHA-256 of the file content')
+    compiled_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('app_label', 'file_name')
+
+    def __str__(self):
+        return f'{self.app_label}/db_code/{self.file_name}'
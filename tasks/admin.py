@@ -1,10 +1,10 @@
 from django.contrib import admin
 from simple_history.admin import SimpleHistoryAdmin
-from django.utils import timezone
-from datetime import timedelta, date
 from .models import TeamMember, Task, Assignment, TaskPredecessor, Holiday, WorkCalendar, VeriiiDefects, \
     VeriiiTaskAssignments, \
-    AllCompletionWork
+    AllCompletionWork, RescheduleRequest
+from .services.scheduling_service import QUEUE_FILTER
+from .utils import DATE_RANGE_CHOICES, filter_by_date_range
 
 # 更改站点标题和头部标题
 admin.site.site_title = 'veriii'
@@ -12,9 +12,8 @@ admin.site.site_header = 'Task Tracker'
 admin.site.index_title = 'Welcome to Task Tracker'
 
 
-class LastMonthFilter(admin.SimpleListFilter):
-    title = 'planed end time'
-    parameter_name = 'planed_end_time'
+class DateRangeListFilter(admin.SimpleListFilter):
+    """List filter for the date ranges of tasks.utils.filter_by_date_range on the `parameter_name` field."""
 
     def lookups(self, request, model_admin):
         """
@@ -24,15 +23,7 @@ class LastMonthFilter(admin.SimpleListFilter):
         human-readable name for the option that will appear
         in the right sidebar.
         """
-        return (
-            ('last_month', 'Last month'),
-            ('this_month', 'This month'),
-            ('this_year', 'This year'),
-            ('past_7_days', 'Past 7 days'),
-            ('today', 'Today'),
-            ('any_date', 'Any date'),
-            ('no_date', 'No date'),
-        )
+        return DATE_RANGE_CHOICES
 
     def queryset(self, request, queryset):
         """
@@ -40,33 +31,12 @@ class LastMonthFilter(admin.SimpleListFilter):
         provided in the query string and retrievable via
         `self.value()`.
         """
-        now = timezone.now()
-        if self.value() == 'last_month':
-            # Calculate the start and end of last month
-            this_month_start = date(now.year, now.month, 1)
-            last_month_end = this_month_start - timedelta(days=1)
-            last_month_start = date(last_month_end.year, last_month_end.month, 1)
-            return queryset.filter(planed_end_time__gte=last_month_start, planed_end_time__lte=last_month_end)
-        elif self.value() == 'this_month':
-            this_month_start = date(now.year, now.month, 1)
-            next_month = this_month_start.replace(day=28) + timedelta(days=4)  # this will never fail
-            this_month_end = next_month - timedelta(days=next_month.day)
-            return queryset.filter(planed_end_time__gte=this_month_start, planed_end_time__lte=this_month_end)
-        elif self.value() == 'this_year':
-            this_year_start = date(now.year, 1, 1)
-            this_year_end = date(now.year, 12, 31)
-            return queryset.filter(planed_end_time__gte=this_year_start, planed_end_time__lte=this_year_end)
-        elif self.value() == 'past_7_days':
-            seven_days_ago = now - timedelta(days=7)
-            return queryset.filter(planed_end_time__gte=seven_days_ago)
-        elif self.value() == 'today':
-            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-            return queryset.filter(planed_end_time__gte=today_start, planed_end_time__lte=today_end)
-        elif self.value() == 'any_date':
-            return queryset.exclude(planed_end_time__isnull=True)
-        elif self.value() == 'no_date':
-            return queryset.filter(planed_end_time__isnull=True)
+        return filter_by_date_range(queryset, self.parameter_name, self.value())
+
+
+class LastMonthFilter(DateRangeListFilter):
+    title = 'planed end time'
+    parameter_name = 'planed_end_time'
 
 
 # Define an inline admin class for Assignment
@@ -82,9 +52,34 @@ class TaskPredecessorInline(admin.TabularInline):
     extra = 1
 
 
+class RescheduleOnChangeMixin:
+    """Queue a background reschedule of the affected team members after every admin edit,
+    instead of rescheduling inside the request (see the process_reschedule_queue command)."""
+
+    def get_affected_team_member_ids(self, obj, form=None):
+        return [obj.team_member_id]
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        RescheduleRequest.enqueue(self.get_affected_team_member_ids(obj, form))
+
+    def delete_model(self, request, obj):
+        team_member_ids = self.get_affected_team_member_ids(obj)
+        super().delete_model(request, obj)
+        RescheduleRequest.enqueue(team_member_ids)
+
+    def delete_queryset(self, request, queryset):
+        team_member_ids = [team_member_id for obj in queryset for team_member_id in
+                           self.get_affected_team_member_ids(obj)]
+        super().delete_queryset(request, queryset)
+        RescheduleRequest.enqueue(team_member_ids)
+
+
 # Define a custom admin class for Task
 class TaskAdmin(SimpleHistoryAdmin):
-    list_display = ('task_name', 'priority', 'level', 'parent_task', 'created_at', 'updated_at')
+    list_display = ('task_name', 'priority', 'level', 'parent_task', 'subtree_effort_estimation',
+                    'percent_completed', 'earliest_planned_start_time', 'latest_planned_end_time', 'created_at',
+                    'updated_at')
     search_fields = ('task_name',)
     list_filter = ('level', 'priority', 'created_at', 'updated_at')
     date_hierarchy = 'created_at'
@@ -94,7 +89,8 @@ class TaskAdmin(SimpleHistoryAdmin):
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
-        return qs.prefetch_related('assignments', 'sub_tasks')  # 提高查询效率
+        # 汇总字段已存储在任务上，列表页无需再计算子树
+        return qs.select_related('parent_task')
 
 
 # Define a custom admin class for TeamMember
@@ -105,7 +101,7 @@ class TeamMemberAdmin(SimpleHistoryAdmin):
 
 
 # Define a custom admin class for Assignment
-class AssignmentAdmin(SimpleHistoryAdmin):
+class AssignmentAdmin(RescheduleOnChangeMixin, SimpleHistoryAdmin):
     list_display = (
         'task', 'task__parent_task', 'team_member', 'effort_estimation', 'planned_start_time', 'planned_end_time',
         'completed', 'actual_start_time',
@@ -117,21 +113,35 @@ class AssignmentAdmin(SimpleHistoryAdmin):
     )
     date_hierarchy = 'assigned_at'
 
+    def get_affected_team_member_ids(self, obj, form=None):
+        team_member_ids = [obj.team_member_id]
+        # Moving an assignment to someone else frees up the previous member's queue too
+        if form is not None and form.initial.get('team_member'):
+            team_member_ids.append(form.initial['team_member'])
+        return team_member_ids
+
 
 # Define a custom admin class for Holiday
-class HolidayAdmin(SimpleHistoryAdmin):
+class HolidayAdmin(RescheduleOnChangeMixin, SimpleHistoryAdmin):
     list_display = ('date', 'name')
     search_fields = ('name',)
     date_hierarchy = 'date'
 
+    def get_affected_team_member_ids(self, obj, form=None):
+        # Holidays apply to everyone with queued work
+        return Assignment.objects.filter(QUEUE_FILTER).values_list('team_member_id', flat=True).distinct()
+
 
 # Define a custom admin class for WorkCalendar
-class WorkCalendarAdmin(SimpleHistoryAdmin):
+class WorkCalendarAdmin(RescheduleOnChangeMixin, SimpleHistoryAdmin):
     list_display = ('team_member', 'date', 'status', 'hours_worked')
     list_filter = ('status', 'team_member__department', 'team_member__position')
     date_hierarchy = 'date'
     search_fields = ('team_member__user__username',)
 
+    # An entry moved to someone else gives the previous member the day back
+    get_affected_team_member_ids = AssignmentAdmin.get_affected_team_member_ids
+
 
 @admin.register(VeriiiDefects)
 class VeriiiDefectsAdmin(admin.ModelAdmin):
@@ -181,62 +191,10 @@ class VeriiiTasksAdmin(admin.ModelAdmin):
     # date_hierarchy = 'planed_end_time'
 
 
-class CompleteTimeLastMonthFilter(admin.SimpleListFilter):
+class CompleteTimeLastMonthFilter(DateRangeListFilter):
     title = 'complete time'
     parameter_name = 'complete_time'
 
-    def lookups(self, request, model_admin):
-        """
-        Returns a list of tuples. The first element in each
-        tuple is the coded value for the option that will
-        appear in the URL query. The second element is the
-        human-readable name for the option that will appear
-        in the right sidebar.
-        """
-        return (
-            ('last_month', 'Last month'),
-            ('this_month', 'This month'),
-            ('this_year', 'This year'),
-            ('past_7_days', 'Past 7 days'),
-            ('today', 'Today'),
-            ('any_date', 'Any date'),
-            ('no_date', 'No date'),
-        )
-
-    def queryset(self, request, queryset):
-        """
-        Returns the filtered queryset based on the value
-        provided in the query string and retrievable via
-        `self.value()`.
-        """
-        now = timezone.now()
-        if self.value() == 'last_month':
-            # Calculate the start and end of last month
-            this_month_start = date(now.year, now.month, 1)
-            last_month_end = this_month_start - timedelta(days=1)
-            last_month_start = date(last_month_end.year, last_month_end.month, 1)
-            return queryset.filter(complete_time__gte=last_month_start, complete_time__lte=last_month_end)
-        elif self.value() == 'this_month':
-            this_month_start = date(now.year, now.month, 1)
-            next_month = this_month_start.replace(day=28) + timedelta(days=4)  # this will never fail
-            this_month_end = next_month - timedelta(days=next_month.day)
-            return queryset.filter(complete_time__gte=this_month_start, complete_time__lte=this_month_end)
-        elif self.value() == 'this_year':
-            this_year_start = date(now.year, 1, 1)
-            this_year_end = date(now.year, 12, 31)
-            return queryset.filter(complete_time__gte=this_year_start, complete_time__lte=this_year_end)
-        elif self.value() == 'past_7_days':
-            seven_days_ago = now - timedelta(days=7)
-            return queryset.filter(complete_time__gte=seven_days_ago)
-        elif self.value() == 'today':
-            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-            return queryset.filter(complete_time__gte=today_start, complete_time__lte=today_end)
-        elif self.value() == 'any_date':
-            return queryset.exclude(complete_time__isnull=True)
-        elif self.value() == 'no_date':
-            return queryset.filter(complete_time__isnull=True)
-
 
 @admin.register(AllCompletionWork)
 class AllCompletionWorkAdmin(admin.ModelAdmin):
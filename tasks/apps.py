@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class TasksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tasks'
+
+    # Reporting views that compile_db creates as materialized views with settings.MATERIALIZE_DB_VIEWS: the
+    # unique key that refresh_materialized_views needs, then the columns the admin filters and orders them by
+    materialized_views = {
+        'veriii_task_assignments': ('id', 'planed_start_time', 'planed_end_time'),
+        'all_completion_work': ('id', 'complete_time', 'owner'),
+    }
+
+    def ready(self):
+        from . import signals  # noqa: F401  Connect the incremental rescheduling receivers
@@ -1,4 +1,6 @@
 drop view if exists veriii_defects CASCADE;
+-- priority_no, workflow_status and the dates are typed columns computed by upload_defects
+-- (tasks/services/defect_ingest.py TYPED_COLUMNS), so filters and ordering can use their indexes
 create view veriii_defects as
 select  id,
     content                                                                  as issue_description,
@@ -10,19 +12,11 @@ select  id,
        系统名                                                                   as sys_name,
        模块                                                                     as module_name,
        "Priority"                                                               as priority,
-       case "Priority"
-           when '非常紧急' then 1
-           when '紧急' then 2
-           when '普通' then 3
-           when '较低'
-               then 4 end                                                       as priority_no,
-       case
-           when "Workflow Status" in ('待部署生产环境', 'Verified(生产问题则代表已发版)') then 'Closed'
-           else 'WIP' end                                                       as workflow_status,
-       to_date("Creation Time", 'yyyy-mm-dd')                                   as creation_time,
-       extract(day from now() -
-                        to_timestamp("Creation Time", 'yyyy-mm-dd hh24:mi:ss')) as days_since_creation,
-       to_date("complete time", 'yyyy-mm-dd')                                   as complete_time
+       priority_no,
+       workflow_status,
+       creation_date                                                            as creation_time,
+       extract(day from now() - creation_timestamp)                             as days_since_creation,
+       complete_date                                                            as complete_time
 from all_veriii_defects
 where "Workflow Status" not in
       ('Suspended[暂停]', 'Discarded[丢弃]', 'To Be Developed[待开发]', 'To Be Discussed(待讨论）');
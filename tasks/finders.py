@@ -0,0 +1,38 @@
+from pathlib import Path
+
+from django.contrib.staticfiles import utils
+from django.contrib.staticfiles.finders import BaseFinder
+from django.core.files.storage import FileSystemStorage
+
+# The Gantt page loads plotly.js as static/plotly/plotly.min.js (see gantt_chart.html)
+PLOTLY_PREFIX = 'plotly'
+PLOTLY_JS = 'plotly.min.js'
+
+
+class PlotlyFinder(BaseFinder):
+    """Finds plotly/plotly.min.js in the installed plotly package, so the Gantt page loads the plotly.js bundle
+    its figures are built for. No other file of the package is published.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._storage = None
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            import plotly  # only needed once static files are looked up or collected
+
+            self._storage = FileSystemStorage(location=Path(plotly.__file__).resolve().parent / 'package_data')
+            self._storage.prefix = PLOTLY_PREFIX
+        return self._storage
+
+    def find(self, path, all=False):
+        if path != f'{PLOTLY_PREFIX}/{PLOTLY_JS}' or not self.storage.exists(PLOTLY_JS):
+            return []
+        match = self.storage.path(PLOTLY_JS)
+        return [match] if all else match
+
+    def list(self, ignore_patterns):
+        if not utils.matches_patterns(PLOTLY_JS, ignore_patterns or []):
+            yield PLOTLY_JS, self.storage
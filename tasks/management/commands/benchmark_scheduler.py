@@ -0,0 +1,163 @@
+import json
+import logging
+import platform
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+
+from tasks.models import Assignment, TeamMember, WorkCalendar
+from tasks.services.business_hours import WORK_START_TIME, BusinessHoursEngine
+from tasks.services.instrumentation import QueryCounter
+from tasks.services.scheduling_service import QUEUE_FILTER, ScheduleService
+
+logger = logging.getLogger('management.commands')  # 使用管理命令日志记录器
+
+DEFAULT_SCALES = '10x1000,100x1000,100x100000,1000x100000'
+
+
+class Command(BaseCommand):
+    help = ('Time the scheduler on synthetic data at several scales and write the results as JSON. '
+            'Run it against a dedicated database: recalculate_schedules reschedules every team member.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default=DEFAULT_SCALES,
+                            help='Comma-separated MEMBERSxASSIGNMENTS pairs, e.g. "10x1000,100x100000".')
+        parser.add_argument('--samples', type=int, default=200,
+                            help='Number of add_working_hours calls timed per scale.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the data and the samples.')
+        parser.add_argument('--skip-memory', action='store_true',
+                            help='Skip the second, traced run of every benchmark that measures peak memory.')
+        parser.add_argument('--output', help='Write the results to this JSON file.')
+        parser.add_argument('--baseline', help='JSON file of an earlier run to compare the results against.')
+        parser.add_argument('--keep-data', action='store_true',
+                            help='Leave the synthetic data of the last scale in the database.')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [tuple(int(number) for number in scale.split('x')) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError(f'Invalid --scales {options["scales"]!r}, expected e.g. "10x1000,100x100000".')
+
+        results = []
+        for members, assignments in scales:
+            logger.info(f'Generating {members} team members with {assignments} assignments...')
+            # One assignment per task, so the number of tasks is the number of assignments
+            call_command('generate_schedule_data', members=members, tasks=assignments,
+                         max_assignments_per_task=1, seed=options['seed'])
+            for benchmark, seconds, queries, peak_memory in self.run_scale(options):
+                results.append({
+                    'scale': f'{members}x{assignments}',
+                    'benchmark': benchmark,
+                    'seconds': round(seconds, 4),
+                    'queries': queries,
+                    'peak_memory_bytes': peak_memory,
+                })
+                logger.info(self.style.SUCCESS(
+                    f'{members}x{assignments} {benchmark}: {seconds:.3f}s, {queries} queries'
+                    + ('' if peak_memory is None else f', peak memory {peak_memory / 2 ** 20:.1f} MiB')))
+
+        if not options['keep_data']:
+            call_command('generate_schedule_data', clear=True)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            logger.info(self.style.SUCCESS(f'Results written to {options["output"]}.'))
+        if options['baseline']:
+            self.compare(results, options['baseline'])
+
+    def run_scale(self, options):
+        rng = random.Random(options['seed'])
+        today = timezone.localdate()
+        team_members = list(TeamMember.objects.filter(user__username__startswith='synthetic_').select_related('user'))
+
+        # The member with the longest queue, so reschedule_team_member has the most work to do
+        busiest_id = Assignment.objects.filter(
+            QUEUE_FILTER,
+            effort_estimation__isnull=False,
+            team_member__in=team_members
+        ).values('team_member').annotate(queued=Count('pk')).order_by('-queued', 'team_member').values_list(
+            'team_member', flat=True).first()
+        busiest = next((team_member for team_member in team_members if team_member.pk == busiest_id), None)
+
+        starts = [timezone.make_aware(datetime.combine(today + timedelta(days=rng.randint(0, 180)), WORK_START_TIME))
+                  for _ in range(options['samples'])]
+        sample_members = [rng.choice(team_members) for _ in range(options['samples'])]
+        hours = [rng.choice([4, 8, 16, 40, 80]) for _ in range(options['samples'])]
+
+        def work_calendar_add_working_hours():
+            for team_member, start, hours_to_add in zip(sample_members, starts, hours):
+                WorkCalendar.add_working_hours(team_member, start, hours_to_add)
+
+        def engine_add_working_hours():
+            engine = BusinessHoursEngine.load(team_members, today)
+            engine.add_working_hours(sample_members, starts, hours)
+
+        benchmarks = [
+            ('WorkCalendar.add_working_hours', work_calendar_add_working_hours),
+            ('BusinessHoursEngine.add_working_hours', engine_add_working_hours),
+            ('reschedule_team_member', lambda: ScheduleService.reschedule_team_member(busiest)),
+            ('reschedule_team_member_batch', lambda: ScheduleService.reschedule_team_member_batch(busiest)),
+            ('recalculate_schedules', lambda: call_command('recalculate_schedules')),
+        ]
+        if busiest is None:
+            logger.warning(self.style.WARNING(
+                'No team member has queued work, skipping reschedule_team_member and reschedule_team_member_batch.'))
+            benchmarks = [benchmark for benchmark in benchmarks if not benchmark[0].startswith('reschedule_')]
+        for benchmark, function in benchmarks:
+            yield (benchmark, *self.measure(function, options['skip_memory']))
+
+    @staticmethod
+    def reset_schedule():
+        """Forget all plans, so every scheduling run does the full amount of work."""
+        Assignment.objects.update(planned_start_time=None, planned_end_time=None, need_update=False)
+
+    def measure(self, function, skip_memory):
+        self.reset_schedule()
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - started
+
+        # Tracing slows allocations down, so memory is measured in a separate run that isn't timed
+        peak_memory = None
+        if not skip_memory:
+            self.reset_schedule()
+            tracemalloc.start()
+            try:
+                function()
+                peak_memory = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        return seconds, counter.count, peak_memory
+
+    def compare(self, results, baseline_path):
+        with open(baseline_path) as baseline_file:
+            baseline = {(result['scale'], result['benchmark']): result
+                        for result in json.load(baseline_file)['results']}
+
+        for result in results:
+            previous = baseline.get((result['scale'], result['benchmark']))
+            if previous is None:
+                continue
+            ratio = result['seconds'] / previous['seconds'] if previous['seconds'] else float('inf')
+            message = (f'{result["scale"]} {result["benchmark"]}: {previous["seconds"]:.3f}s -> '
+                       f'{result["seconds"]:.3f}s ({ratio:.2f}x), '
+                       f'{previous["queries"]} -> {result["queries"]} queries')
+            if ratio > 1.1 or result['queries'] > previous['queries']:
+                logger.warning(self.style.WARNING(message))
+            else:
+                logger.info(message)
@@ -0,0 +1,142 @@
+import logging
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from tasks.models import Assignment, Holiday, RescheduleRequest, Task, TaskPredecessor, TeamMember, WorkCalendar
+from tasks.services.task_rollups import TaskRollups
+
+logger = logging.getLogger('management.commands')  # 使用管理命令日志记录器
+
+SYNTHETIC_PREFIX = 'synthetic_'
+BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic team members, tasks, assignments and calendars for scheduler benchmarks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=10, help='Number of team members.')
+        parser.add_argument('--tasks', type=int, default=1000, help='Number of tasks, over all hierarchy levels.')
+        parser.add_argument('--depth', type=int, default=3, help='Number of levels in the parent_task hierarchy.')
+        parser.add_argument('--max-assignments-per-task', type=int, default=2,
+                            help='Each task is assigned to between one and this many team members.')
+        parser.add_argument('--predecessor-ratio', type=float, default=0.3,
+                            help='Average number of predecessors per level-1 task.')
+        parser.add_argument('--holidays', type=int, default=10, help='Number of holidays over the next year.')
+        parser.add_argument('--calendar-entries', type=int, default=20,
+                            help='Number of leave/overtime days per team member over the next year.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible data sets.')
+        parser.add_argument('--clear', action='store_true', help='Only delete previously generated data.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.clear()
+            if not options['clear']:
+                self.generate(random.Random(options['seed']), options)
+
+    def clear(self):
+        """Delete earlier synthetic data with plain SQL, so no per-row signals or cascades run."""
+        synthetic_members = (f'SELECT tm.id FROM {TeamMember._meta.db_table} tm '
+                             f'JOIN {User._meta.db_table} u ON u.id = tm.user_id WHERE u.username LIKE %s')
+        synthetic_tasks = f'SELECT id FROM {Task._meta.db_table} WHERE task_name LIKE %s'
+        member_pattern, task_pattern = SYNTHETIC_PREFIX + '%', 'Synthetic task %'
+
+        with connection.cursor() as cursor:
+            for model, column, subquery, pattern in [
+                (Assignment, 'team_member_id', synthetic_members, member_pattern),
+                (Assignment, 'task_id', synthetic_tasks, task_pattern),
+                (WorkCalendar, 'team_member_id', synthetic_members, member_pattern),
+                (RescheduleRequest, 'team_member_id', synthetic_members, member_pattern),
+                (TaskPredecessor, 'from_task_id', synthetic_tasks, task_pattern),
+                (TaskPredecessor, 'to_task_id', synthetic_tasks, task_pattern),
+            ]:
+                cursor.execute(f'DELETE FROM {model._meta.db_table} WHERE {column} IN ({subquery})', [pattern])
+
+            cursor.execute(f'DELETE FROM {Task._meta.db_table} WHERE task_name LIKE %s', [task_pattern])
+            cursor.execute(f'DELETE FROM {TeamMember._meta.db_table} WHERE id IN ({synthetic_members})',
+                           [member_pattern])
+            cursor.execute(f'DELETE FROM {User._meta.db_table} WHERE username LIKE %s', [member_pattern])
+            cursor.execute(f'DELETE FROM {Holiday._meta.db_table} WHERE name = %s', ['Synthetic holiday'])
+
+    def generate(self, rng, options):
+        today = timezone.localdate()
+        now = timezone.now()
+
+        users = User.objects.bulk_create(
+            [User(username=f'{SYNTHETIC_PREFIX}{number}', first_name='Synthetic', last_name=str(number),
+                  password=make_password(None)) for number in range(options['members'])],
+            batch_size=BATCH_SIZE)
+        members = TeamMember.objects.bulk_create(
+            [TeamMember(user=user, department='tech_team',
+                        position=rng.choice(TeamMember.POSITION_CHOICES)[0]) for user in users],
+            batch_size=BATCH_SIZE)
+
+        # Level-1 tasks first, then each deeper level gets parents from the level above
+        depth = max(options['depth'], 1)
+        level_sizes = [max(options['tasks'] * 2 // 5, 1)] if depth > 1 else [options['tasks']]
+        remaining = options['tasks'] - level_sizes[0]
+        for level in range(2, depth + 1):
+            size = remaining if level == depth else remaining // 2
+            level_sizes.append(size)
+            remaining -= size
+
+        tasks_by_level = []
+        task_number = 0
+        for level, size in enumerate(level_sizes, start=1):
+            parents = tasks_by_level[-1] if tasks_by_level else [None]
+            level_tasks = []
+            for _ in range(size):
+                level_tasks.append(Task(task_name=f'Synthetic task {task_number}', priority=rng.randint(0, 9),
+                                        level=level, parent_task=rng.choice(parents)))
+                task_number += 1
+            tasks_by_level.append(Task.objects.bulk_create(level_tasks, batch_size=BATCH_SIZE))
+        tasks = [task for level_tasks in tasks_by_level for task in level_tasks]
+
+        assignments = []
+        for task in tasks:
+            for member in rng.sample(members, rng.randint(1, min(options['max_assignments_per_task'], len(members)))):
+                assignment = Assignment(task=task, team_member=member,
+                                        effort_estimation=Decimal(rng.choice(['0.5', '1', '2', '3', '5', '8'])))
+                if rng.random() < 0.1:
+                    assignment.actual_start_time = now - timedelta(days=rng.randint(10, 60))
+                    assignment.actual_end_time = assignment.actual_start_time + timedelta(days=rng.randint(1, 9))
+                assignments.append(assignment)
+        Assignment.objects.bulk_create(assignments, batch_size=BATCH_SIZE)
+
+        # A predecessor is always created earlier than its successor, so the graph stays acyclic
+        level_1_tasks = tasks_by_level[0]
+        edges = set()
+        for _ in range(int(len(level_1_tasks) * options['predecessor_ratio'])):
+            if len(level_1_tasks) < 2:
+                break
+            predecessor_index, successor_index = sorted(rng.sample(range(len(level_1_tasks)), 2))
+            edges.add((level_1_tasks[successor_index], level_1_tasks[predecessor_index]))
+        TaskPredecessor.objects.bulk_create([TaskPredecessor(from_task=successor, to_task=predecessor)
+                                             for successor, predecessor in edges], batch_size=BATCH_SIZE)
+
+        existing_holidays = set(Holiday.objects.filter(date__gte=today).values_list('date', flat=True))
+        holiday_dates = {today + timedelta(days=rng.randint(0, 365)) for _ in range(options['holidays'])}
+        Holiday.objects.bulk_create([Holiday(date=date, name='Synthetic holiday')
+                                     for date in holiday_dates - existing_holidays])
+
+        calendar_entries = []
+        for member in members:
+            for offset in rng.sample(range(366), min(options['calendar_entries'], 366)):
+                status = rng.choice(['leave', 'overtime'])
+                calendar_entries.append(WorkCalendar(
+                    team_member=member, date=today + timedelta(days=offset), status=status,
+                    hours_worked=rng.choice([None, Decimal('4'), Decimal('10')]) if status == 'overtime' else None))
+        WorkCalendar.objects.bulk_create(calendar_entries, batch_size=BATCH_SIZE)
+        # bulk_create skips the signals that keep the task rollups up to date
+        TaskRollups.rebuild()
+
+        logger.info(self.style.SUCCESS(
+            f'Generated {len(members)} team members, {len(tasks)} tasks, {len(assignments)} assignments, '
+            f'{len(edges)} predecessor edges and {len(calendar_entries)} calendar entries.'))
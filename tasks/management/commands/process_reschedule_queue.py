@@ -0,0 +1,65 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from common_utils.db_code import refresh_materialized_views
+from tasks.models import RescheduleRequest, TeamMember
+from tasks.services.scheduling_service import ScheduleService
+
+logger = logging.getLogger('management.commands')  # 使用管理命令日志记录器
+
+
+class Command(BaseCommand):
+    help = 'Drain the reschedule request queue, merging repeated requests for the same team member.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--debounce', type=float, default=5,
+                            help='Seconds a team member must go without new requests before being rescheduled.')
+        parser.add_argument('--poll-interval', type=float, default=1,
+                            help='Seconds to sleep when there is nothing to do.')
+        parser.add_argument('--once', action='store_true',
+                            help='Process the requests that are due now and exit instead of polling forever.')
+
+    def handle(self, *args, **options):
+        logger.info('Starting reschedule queue worker...')
+        while True:
+            processed = self.drain(options['debounce'])
+            if processed:
+                refreshed = refresh_materialized_views(['tasks'])
+                if refreshed:
+                    logger.info(f'Refreshed {", ".join(refreshed)}.')
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['poll_interval'])
+
+        logger.info(self.style.SUCCESS('Reschedule queue drained successfully.'))
+
+    def drain(self, debounce):
+        """Reschedule every team member whose latest request is older than the debounce window."""
+        cutoff = timezone.now() - timedelta(seconds=debounce)
+        due_team_member_ids = RescheduleRequest.objects.values('team_member').annotate(
+            latest_requested_at=Max('requested_at')
+        ).filter(latest_requested_at__lte=cutoff).values_list('team_member', flat=True)
+
+        processed = 0
+        for team_member in TeamMember.objects.filter(id__in=list(due_team_member_ids)).select_related('user'):
+            with transaction.atomic():
+                # Requests locked by another worker are skipped, that worker already handles the member
+                request_ids = list(RescheduleRequest.objects.select_for_update(skip_locked=True).filter(
+                    team_member=team_member, requested_at__lte=cutoff).values_list('pk', flat=True))
+                if not request_ids:
+                    continue
+
+                ScheduleService.reschedule_team_member_batch(team_member, incremental=True)
+                RescheduleRequest.objects.filter(pk__in=request_ids).delete()
+
+            processed += 1
+            logger.info(f'Rescheduled {team_member}, merging {len(request_ids)} request(s).')
+
+        return processed
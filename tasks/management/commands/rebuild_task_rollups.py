@@ -0,0 +1,28 @@
+import logging
+
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from tasks.services.task_rollups import TaskRollups
+
+logger = logging.getLogger('management.commands')  # 使用管理命令日志记录器
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the subtree rollups stored on every task from the assignments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only compare the stored rollups with freshly computed ones and fail on differences.')
+
+    def handle(self, *args, **options):
+        if options.get('check'):
+            mismatches = TaskRollups.check()
+            if mismatches:
+                raise CommandError(f'{len(mismatches)} tasks have stale rollups, e.g. task ids {mismatches[:20]}.')
+            logger.info(self.style.SUCCESS('All task rollups are up to date.'))
+            return
+
+        with transaction.atomic():
+            updated = TaskRollups.rebuild()
+        logger.info(self.style.SUCCESS(f'Rebuilt the rollups of {updated} tasks.'))
@@ -1,8 +1,14 @@
+import json
 import logging
+import time
+from contextlib import nullcontext
 
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Q
 
+from common_utils.db_code import refresh_materialized_views
 from tasks.models import Assignment, TeamMember
+from tasks.services.instrumentation import PHASES, profiling
 from tasks.services.scheduling_service import ScheduleService
 
 logger = logging.getLogger('management.commands')  # 使用管理命令日志记录器
@@ -11,26 +17,101 @@ logger = logging.getLogger('management.commands')  # 使用管理命令日志记
 class Command(BaseCommand):
     help = 'Recalculate schedules for all team members based on dependency order.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--legacy', action='store_true',
+                            help='Use the per-assignment scheduling path instead of the batch one, for comparison.')
+        parser.add_argument('--with-dependencies', action='store_true',
+                            help='Schedule all team members together so tasks start after their predecessors.')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only recompute the queue tails flagged with need_update since the last run.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of team members rescheduled in parallel, each on its own DB connection.')
+        parser.add_argument('--profile', action='store_true',
+                            help='Log the time and query count of every scheduler phase, per team member and in total.')
+        parser.add_argument('--profile-output', help='Also write the profile summary to this JSON file.')
+
     def handle(self, *args, **options):
+        workers = options.get('workers') or 1
+        if options.get('legacy') and options.get('with_dependencies'):
+            raise CommandError('--legacy and --with-dependencies cannot be combined.')
+        batch_only = workers > 1 or options.get('incremental')
+        if batch_only and (options.get('legacy') or options.get('with_dependencies')):
+            raise CommandError('--workers and --incremental only apply to the default batch scheduling.')
+
+        profiled = options.get('profile') or options.get('profile_output')
+        with profiling() if profiled else nullcontext() as profile:
+            self.recalculate(workers, options)
+        if profiled:
+            self.report_profile(profile.summary(), options.get('profile_output'))
+
+        refreshed = refresh_materialized_views(['tasks'])
+        if refreshed:
+            logger.info(f'Refreshed {", ".join(refreshed)}.')
+
+    def recalculate(self, workers, options):
         logger.info('Starting schedule recalculation...')
+        started = time.perf_counter()
+
+        if options.get('with_dependencies'):
+            ScheduleService.reschedule_with_dependencies()
+            logger.info(self.style.SUCCESS(
+                f'Schedule recalculation completed successfully in {time.perf_counter() - started:.3f}s.'))
+            return
 
 
         # 获取所有唯一且符合条件的team_member ID
-        team_member_ids = Assignment.objects.filter(
+        queued_assignments = Assignment.objects.filter(
             actual_start_time__isnull=True,
             actual_end_time__isnull=True,
             effort_estimation__isnull=False
-        ).values_list('team_member', flat=True).distinct()
+        )
+        if options.get('incremental'):
+            queued_assignments = queued_assignments.filter(Q(need_update=True) | Q(planned_end_time__isnull=True))
+        team_member_ids = queued_assignments.values_list('team_member', flat=True).distinct()
 
         # 使用这些ID来获取对应的team_member对象
         unique_team_members = TeamMember.objects.filter(id__in=team_member_ids)
 
-        # Reschedule each team member in dependency order
-        for team_member in unique_team_members:
-            ScheduleService.reschedule_team_member(team_member)
-            logger.info(self.style.SUCCESS(f'reschedule_team_member for {team_member} successfully.'))
+        if options.get('legacy'):
+            timings = []
+            # Reschedule each team member in dependency order
+            for team_member in unique_team_members:
+                member_started = time.perf_counter()
+                ScheduleService.reschedule_team_member(team_member)
+                timings.append((team_member, time.perf_counter() - member_started))
+                logger.info(self.style.SUCCESS(f'reschedule_team_member for {team_member} successfully.'))
+        else:
+            timings = ScheduleService.reschedule_team_members(unique_team_members, workers=workers,
+                                                              incremental=options.get('incremental'))
+
+        for team_member, seconds in sorted(timings, key=lambda timing: timing[1], reverse=True):
+            logger.info(f'{team_member}: {seconds:.3f}s')
+        logger.info(self.style.SUCCESS(
+            f'Schedule recalculation of {len(timings)} team members with {workers} worker(s) completed '
+            f'successfully in {time.perf_counter() - started:.3f}s.'))
+
+    def report_profile(self, summary, output=None):
+        names = {team_member.pk: str(team_member) for team_member in TeamMember.objects.filter(
+            pk__in=summary['team_members']).select_related('user')}
+        for team_member_id, totals in sorted(summary['team_members'].items(),
+                                             key=lambda item: item[1]['seconds'], reverse=True):
+            phases = ', '.join(f'{name} {totals["phases"][name]["seconds"]:.3f}s/{totals["phases"][name]["queries"]}q'
+                               for name in PHASES if name in totals['phases'])
+            logger.info(f'{names.get(team_member_id, team_member_id)}: {totals["seconds"]:.3f}s, '
+                        f'{totals["queries"]} queries ({phases})')
+
+        for name in PHASES:
+            if name in summary['phases']:
+                logger.info(f'{name}: {summary["phases"][name]["seconds"]:.3f}s, '
+                            f'{summary["phases"][name]["queries"]} queries')
+        logger.info(self.style.SUCCESS(
+            f'Profiled run: {summary["seconds"]:.3f}s, {summary["queries"]} queries over '
+            f'{len(summary["team_members"])} team members.'))
 
-        logger.info(self.style.SUCCESS('Schedule recalculation completed successfully.'))
+        if output:
+            with open(output, 'w') as output_file:
+                json.dump(summary, output_file, indent=2)
+            logger.info(self.style.SUCCESS(f'Profile written to {output}.'))
 
 
 
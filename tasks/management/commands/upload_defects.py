@@ -1,31 +1,72 @@
-import pandas as pd
-from django.core.management.base import BaseCommand
-from sqlalchemy import create_engine, text
-from django.conf import settings
+import glob
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.services.defect_ingest import DEFECTS_TABLE, INGEST_CHUNK_SIZE, SwapTimeout, load_defects
+
+logger = logging.getLogger('management.commands')  # 使用管理命令日志记录器
+
+
 class Command(BaseCommand):
     help = 'Upload CSV data to the database'
 
     def add_arguments(self, parser):
-        parser.add_argument('csv_file', type=str, help='The path to the CSV file')
+        parser.add_argument('csv_files', nargs='+', metavar='csv_file',
+                            help='The paths or glob patterns of the CSV files, e.g. per-system exports; '
+                                 'they are loaded together as one snapshot.')
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('--incremental', action='store_true',
+                          help='Only insert new rows, update changed ones and delete the ones missing from '
+                               'the files, instead of reloading the table; unchanged rows keep their id.')
+        mode.add_argument('--swap', action='store_true',
+                          help='Reload the table into a shadow table and swap it in with a rename, so readers '
+                               'of the table and its views are not blocked while the files are loaded.')
+        parser.add_argument('--key', nargs='+', metavar='COLUMN',
+                            help='Columns that identify a defect across exports. Without them rows are keyed by '
+                                 'their content, so an edited row is deleted and inserted again.')
+        parser.add_argument('--chunk-size', type=int, default=INGEST_CHUNK_SIZE,
+                            help='Rows read from a file and copied to the database at a time.')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes parsing the files in parallel, one per CPU by default.')
 
     def handle(self, *args, **options):
-        csv_file = options['csv_file']
-
-        # Load the CSV file into a DataFrame
-        df = pd.read_csv(csv_file)
-
-        # Create an SQLAlchemy engine using Django's database settings
-        db_settings = settings.DATABASES['default']
-        engine = create_engine(
-            f"postgresql+psycopg2://{db_settings['USER']}:{db_settings['PASSWORD']}@"
-            f"{db_settings['HOST']}:{db_settings['PORT']}/{db_settings['NAME']}"
-        )
-
-        # Upload DataFrame to the database
-        table_name = 'all_veriii_defects'  # 替换为实际表名
-        with engine.begin() as connection:
-            # Truncate the table to remove all existing data
-            connection.execute(text(f'TRUNCATE TABLE "{table_name}" RESTART IDENTITY CASCADE'))
-            df.to_sql(name=table_name, con=connection, if_exists='append', index=False, chunksize=1000)
-
-        self.stdout.write(self.style.SUCCESS(f'Successfully uploaded {csv_file} to {table_name}'))
\ No newline at end of file
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        if options['workers'] is not None and options['workers'] < 1:
+            raise CommandError('--workers must be positive.')
+
+        csv_files = []
+        for pattern in options['csv_files']:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise CommandError(f'No CSV file matches {pattern}')
+            csv_files.extend(match for match in matches if match not in csv_files)
+
+        started = time.perf_counter()
+
+        def progress(csv_file, rows):
+            logger.info(f'{csv_file}: {rows} rows copied ({time.perf_counter() - started:.1f}s)')
+
+        try:
+            counts = load_defects(csv_files, options['key'], options['incremental'], options['swap'],
+                                  options['chunk_size'], options['workers'], progress)
+        except (OSError, ValueError, SwapTimeout) as error:
+            raise CommandError(str(error))
+        seconds = time.perf_counter() - started
+
+        for file in counts['files']:
+            file_seconds = file['parse_seconds'] + file['copy_seconds']
+            logger.info(f'{file["file"]}: {file["rows"]} rows, parsed in {file["parse_seconds"]:.2f}s, '
+                        f'copied in {file["copy_seconds"]:.2f}s '
+                        f'({file["rows"] / file_seconds if file_seconds else 0:.0f} rows/s)')
+
+        rows = counts['inserted'] + counts['updated'] + counts['unchanged']
+        logger.info(self.style.SUCCESS(
+            f'Successfully uploaded {len(csv_files)} files to {DEFECTS_TABLE}: {rows} rows in {seconds:.2f}s '
+            f'({rows / seconds if seconds else 0:.0f} rows/s); {counts["inserted"]} inserted, '
+            f'{counts["updated"]} updated, {counts["deleted"]} deleted, {counts["unchanged"]} unchanged'))
+
+        if counts['refreshed']:
+            logger.info(f'Refreshed {", ".join(counts["refreshed"])}.')
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0019_allcompletionwork_alter_veriiitaskassignments_table'),
+    ]
+
+    operations = [
+        migrations.AlterModelTable(
+            name='veriiitaskassignments',
+            table='veriii_task_assignments',
+        ),
+        migrations.CreateModel(
+            name='RescheduleRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('requested_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('team_member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reschedule_requests', to='tasks.teammember')),
+            ],
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0020_reschedulerequest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='earliest_planned_start_time',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='latest_planned_end_time',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='percent_completed',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, help_text='Share of the subtree effort that is completed', max_digits=5, null=True),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='subtree_completed_effort',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Estimated effort of the completed assignments', max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='subtree_effort_estimation',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Effort estimation of the subtree, in man days', max_digits=12),
+        ),
+        # The rollups of every task, computed as TaskRollups.rebuild did when this migration was written
+        migrations.RunSQL('''
+        UPDATE tasks_task task SET
+            subtree_effort_estimation = rollup.effort,
+            subtree_completed_effort = rollup.completed,
+            earliest_planned_start_time = rollup.earliest,
+            latest_planned_end_time = rollup.latest,
+            percent_completed = rollup.percent
+        FROM (
+            WITH RECURSIVE subtree(root_id, task_id) AS (
+                SELECT id, id FROM tasks_task
+                UNION
+                SELECT subtree.root_id, child.id
+                FROM tasks_task child JOIN subtree ON child.parent_task_id = subtree.task_id
+            ), nodes AS (
+                SELECT root_id, task_id,
+                       NOT EXISTS (
+                           SELECT 1 FROM tasks_task child WHERE child.parent_task_id = subtree.task_id
+                       ) AS is_leaf
+                FROM subtree
+            ), totals AS (
+                SELECT nodes.root_id,
+                       COALESCE(SUM(assignment.effort_estimation) FILTER (WHERE nodes.is_leaf), 0) AS effort,
+                       COALESCE(SUM(assignment.effort_estimation) FILTER (
+                           WHERE nodes.is_leaf AND assignment.actual_end_time IS NOT NULL), 0) AS completed,
+                       MIN(assignment.planned_start_time) AS earliest,
+                       MAX(assignment.planned_end_time) AS latest
+                FROM nodes LEFT JOIN tasks_assignment assignment ON assignment.task_id = nodes.task_id
+                GROUP BY nodes.root_id
+            )
+            SELECT root_id, effort, completed, earliest, latest, ROUND(100 * completed / NULLIF(effort, 0), 2)
+            FROM totals
+        ) AS rollup(id, effort, completed, earliest, latest, percent)
+        WHERE task.id = rollup.id;
+        ''', reverse_sql=migrations.RunSQL.noop),
+    ]
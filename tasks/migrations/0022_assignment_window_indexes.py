@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0021_task_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['planned_start_time', 'planned_end_time'], name='assignment_planned_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assignment',
+            index=models.Index(fields=['actual_start_time', 'actual_end_time'], name='assignment_actual_window_idx'),
+        ),
+    ]
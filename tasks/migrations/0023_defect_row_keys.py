@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0022_assignment_window_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL('''
+        ALTER TABLE all_veriii_defects ADD COLUMN row_key text, ADD COLUMN row_hash text;
+        CREATE UNIQUE INDEX all_veriii_defects_row_key_uniq ON all_veriii_defects (row_key);
+        ''', reverse_sql='''
+        DROP INDEX all_veriii_defects_row_key_uniq;
+        ALTER TABLE all_veriii_defects DROP COLUMN row_key, DROP COLUMN row_hash;
+        '''),
+        # Hash and key the rows already loaded as a full load does: the hash of the exported columns, numbered
+        # among identical rows in id order
+        migrations.RunSQL('''
+        DO $$
+        DECLARE
+            exported_columns text;
+        BEGIN
+            SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) INTO exported_columns
+            FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'all_veriii_defects'
+              AND is_generated = 'NEVER' AND column_name NOT IN ('id', 'row_key', 'row_hash');
+            EXECUTE format($update$
+                UPDATE all_veriii_defects defect SET row_hash = keyed.row_hash, row_key = keyed.row_key
+                FROM (
+                    SELECT id, row_hash, row_hash || '-' || ROW_NUMBER() OVER (PARTITION BY row_hash ORDER BY id)
+                        AS row_key
+                    FROM (SELECT id, md5(ROW(%s)::text) AS row_hash FROM all_veriii_defects) AS hashed
+                ) AS keyed
+                WHERE defect.id = keyed.id$update$, exported_columns);
+        END
+        $$;
+        ''', reverse_sql=migrations.RunSQL.noop),
+    ]
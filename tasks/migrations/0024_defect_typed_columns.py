@@ -0,0 +1,59 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0023_defect_row_keys'),
+    ]
+
+    operations = [
+        migrations.RunSQL('''
+        ALTER TABLE all_veriii_defects
+            ADD COLUMN priority_no integer,
+            ADD COLUMN workflow_status text,
+            ADD COLUMN creation_date date,
+            ADD COLUMN creation_timestamp timestamp with time zone,
+            ADD COLUMN complete_date date;
+        ''', reverse_sql='''
+        ALTER TABLE all_veriii_defects
+            DROP COLUMN priority_no,
+            DROP COLUMN workflow_status,
+            DROP COLUMN creation_date,
+            DROP COLUMN creation_timestamp,
+            DROP COLUMN complete_date;
+        '''),
+        # The typed columns of the rows already loaded, computed as staging does: dates that don't start with
+        # a valid date (and time) are left NULL
+        migrations.RunSQL(r'''
+        UPDATE all_veriii_defects SET
+            priority_no = CASE "Priority" WHEN '非常紧急' THEN 1 WHEN '紧急' THEN 2 WHEN '普通' THEN 3
+                                          WHEN '较低' THEN 4 END,
+            workflow_status = CASE WHEN "Workflow Status" IN ('待部署生产环境', 'Verified(生产问题则代表已发版)')
+                                   THEN 'Closed' ELSE 'WIP' END,
+            creation_date = CASE
+                WHEN pg_input_is_valid(substring("Creation Time" FROM '^\d{4}[-/]\d{1,2}[-/]\d{1,2}'), 'date')
+                THEN substring("Creation Time" FROM '^\d{4}[-/]\d{1,2}[-/]\d{1,2}')::date END,
+            creation_timestamp = CASE
+                WHEN pg_input_is_valid(substring("Creation Time"
+                                                 FROM '^\d{4}[-/]\d{1,2}[-/]\d{1,2}(?: \d{1,2}:\d{1,2}(?::\d{1,2})?)?'),
+                                       'timestamptz')
+                THEN substring("Creation Time"
+                               FROM '^\d{4}[-/]\d{1,2}[-/]\d{1,2}(?: \d{1,2}:\d{1,2}(?::\d{1,2})?)?')::timestamptz END,
+            complete_date = CASE
+                WHEN pg_input_is_valid(substring("complete time" FROM '^\d{4}[-/]\d{1,2}[-/]\d{1,2}'), 'date')
+                THEN substring("complete time" FROM '^\d{4}[-/]\d{1,2}[-/]\d{1,2}')::date END;
+        ''', reverse_sql=migrations.RunSQL.noop),
+        # The filters and ordering of VeriiiDefectsAdmin
+        migrations.RunSQL('''
+        CREATE INDEX all_veriii_defects_priority_creation_idx ON all_veriii_defects (priority_no, creation_date);
+        CREATE INDEX all_veriii_defects_creation_idx ON all_veriii_defects (creation_date);
+        CREATE INDEX all_veriii_defects_owner_idx ON all_veriii_defects ("Executor");
+        CREATE INDEX all_veriii_defects_status_idx ON all_veriii_defects (workflow_status);
+        ''', reverse_sql='''
+        DROP INDEX all_veriii_defects_priority_creation_idx;
+        DROP INDEX all_veriii_defects_creation_idx;
+        DROP INDEX all_veriii_defects_owner_idx;
+        DROP INDEX all_veriii_defects_status_idx;
+        '''),
+    ]
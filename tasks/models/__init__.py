@@ -94,12 +94,7 @@ class WorkCalendar(models.Model):
     @classmethod
     def get_next_available_workday(cls, team_member, start_date):
         """Find the next available workday starting from the given date for the specified team member."""
-        date_to_check = start_date
-        work_start_time = time(9, 0, 0)  # 工作开始时间为上午9:00
-        while True:
-            if cls.is_working_day(team_member, date_to_check):
-                return timezone.make_aware(datetime.combine(date_to_check, work_start_time))
-            date_to_check += timedelta(days=1)
+        return cls.snapshot(team_member, start_date).get_next_available_workday(start_date)
 
     @classmethod
     def get_daily_working_hours(cls, team_member, date):
@@ -126,12 +121,90 @@ class WorkCalendar(models.Model):
     @classmethod
     def add_working_hours(cls, team_member, start_date, hours_to_add):
         """Add working hours to a date using the given team member's calendar."""
+        return cls.snapshot(team_member, start_date.date()).add_working_hours(start_date, hours_to_add)
+
+    @classmethod
+    def snapshot(cls, team_member, start_date, end_date=None):
+        """Load the team member's calendar from start_date (up to end_date, if given) into memory."""
+        return WorkCalendarSnapshot(team_member, start_date, end_date)
+
+
+class WorkCalendarSnapshot:
+    """In-memory copy of one team member's WorkCalendar entries and the holidays of a date range.
+
+    It answers the same questions as the WorkCalendar classmethods, but loads the data with two queries
+    up front instead of querying for every day, so walking a long schedule costs no extra queries.
+    Without end_date the range is open-ended; dates outside the loaded range are fetched on demand.
+    """
+
+    def __init__(self, team_member, start_date, end_date=None):
+        self.team_member = team_member
+        self.start_date = start_date
+        self.end_date = end_date
+        self.entries = {}
+        self.holidays = set()
+        self._load(start_date, end_date)
+
+    def _load(self, start_date, end_date):
+        entries = WorkCalendar.objects.filter(team_member=self.team_member, date__gte=start_date)
+        holidays = Holiday.objects.filter(date__gte=start_date)
+        if end_date is not None:
+            entries = entries.filter(date__lte=end_date)
+            holidays = holidays.filter(date__lte=end_date)
+
+        self.entries.update((entry.date, entry) for entry in entries)
+        self.holidays.update(holidays.values_list('date', flat=True))
+
+    def _ensure_loaded(self, date):
+        if date < self.start_date:
+            self._load(date, self.start_date - timedelta(days=1))
+            self.start_date = date
+        elif self.end_date is not None and date > self.end_date:
+            self._load(self.end_date + timedelta(days=1), None)
+            self.end_date = None
+
+    def is_working_day(self, date):
+        """Check if the given date is a working day for the team member."""
+        self._ensure_loaded(date)
+        entry = self.entries.get(date)
+        if entry is not None:
+            return entry.status == 'overtime'
+
+        return date.weekday() < 5 and date not in self.holidays
+
+    def get_next_available_workday(self, start_date):
+        """Find the next available workday starting from the given date."""
+        date_to_check = start_date
+        work_start_time = time(9, 0, 0)  # 工作开始时间为上午9:00
+        while True:
+            if self.is_working_day(date_to_check):
+                return timezone.make_aware(datetime.combine(date_to_check, work_start_time))
+            date_to_check += timedelta(days=1)
+
+    def get_daily_working_hours(self, date):
+        """Get the number of working hours on a given date."""
+        self._ensure_loaded(date)
+        entry = self.entries.get(date)
+        if entry is not None:
+            return entry.hours_worked or 8  # Assuming 8 hours as the default working day
+        return 8
+
+    def get_end_of_working_day(self, date):
+        """Get the end of the working day for a given date."""
+        self._ensure_loaded(date)
+        entry = self.entries.get(date)
+        if entry is not None and entry.status == 'overtime':
+            return timezone.make_aware(datetime.combine(date, time(hour=23, minute=59)))
+        return timezone.make_aware(datetime.combine(date, time(hour=17, minute=0)))  # Standard end time
+
+    def add_working_hours(self, start_date, hours_to_add):
+        """Add working hours to a date using the team member's calendar."""
         end_date = start_date
         accumulated_hours = 0
 
         while accumulated_hours < hours_to_add:
-            if cls.is_working_day(team_member, end_date.date()):
-                daily_hours = cls.get_daily_working_hours(team_member, end_date.date())
+            if self.is_working_day(end_date.date()):
+                daily_hours = self.get_daily_working_hours(end_date.date())
                 remaining_hours = hours_to_add - float(accumulated_hours)
                 if daily_hours >= remaining_hours:
                     end_date += timedelta(hours=remaining_hours)
@@ -143,9 +216,7 @@ class WorkCalendar(models.Model):
                 end_date += timedelta(days=1)
 
         # Ensure end_date is at the end of the working day
-        end_date = cls.get_end_of_working_day(team_member, end_date.date())
-
-        return end_date
+        return self.get_end_of_working_day(end_date.date())
 
 
 class Task(models.Model):
@@ -197,7 +268,20 @@ class Task(models.Model):
     # Many-to-Many relationship with TeamMember through the Assignment model
     team_members = models.ManyToManyField(TeamMember, through='Assignment')
 
-    history = HistoricalRecords()
+    # Rollups of the whole subtree, kept up to date along the ancestor path by tasks.signals
+    # (see TaskRollups) and rebuilt from scratch by the rebuild_task_rollups command
+    subtree_effort_estimation = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False,
+                                                    help_text="Effort estimation of the subtree, in man days")
+    subtree_completed_effort = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False,
+                                                   help_text="Estimated effort of the completed assignments")
+    earliest_planned_start_time = models.DateTimeField(null=True, blank=True, editable=False)
+    latest_planned_end_time = models.DateTimeField(null=True, blank=True, editable=False)
+    percent_completed = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, editable=False,
+                                            help_text="Share of the subtree effort that is completed")
+
+    history = HistoricalRecords(excluded_fields=['subtree_effort_estimation', 'subtree_completed_effort',
+                                                 'earliest_planned_start_time', 'latest_planned_end_time',
+                                                 'percent_completed'])
 
     def __str__(self):
         return self.task_name
@@ -209,13 +293,13 @@ class Task(models.Model):
 
     @property
     def total_effort_estimation(self):
-        """Calculate the total effort estimation including all sub-tasks."""
-        if self.sub_tasks.exists():
-            # For parent tasks, sum up the effort estimations of all sub-tasks
-            return sum(task.total_effort_estimation for task in self.sub_tasks.all())
-        else:
-            # For leaf tasks, sum up the effort estimations from assignments
-            return sum(assignment.effort_estimation or 0 for assignment in self.assignments.all())
+        """Calculate the total effort estimation including all sub-tasks.
+
+        For parent tasks this is the sum over all sub-tasks, for leaf tasks the sum of the effort estimations
+        of the assignments; the whole subtree is summed up with one query.
+        """
+        from tasks.services.task_hierarchy import TaskHierarchy  # the services import the models
+        return TaskHierarchy.subtree_effort([self])[self.pk]
 
 
 class TaskPredecessor(models.Model):
@@ -245,9 +329,34 @@ class Assignment(models.Model):
 
     history = HistoricalRecords()
 
+    class Meta:
+        indexes = [
+            # Time-window lookups of the Gantt data endpoint
+            models.Index(fields=['planned_start_time', 'planned_end_time'], name='assignment_planned_window_idx'),
+            models.Index(fields=['actual_start_time', 'actual_end_time'], name='assignment_actual_window_idx'),
+        ]
+
     @property
     def completed(self):
         return self.actual_end_time is not None
 
     def __str__(self):
         return f"{self.task.task_name} assigned to {self.team_member}"
+
+
+class RescheduleRequest(models.Model):
+    """Queue of pending schedule recalculations, drained by the process_reschedule_queue command.
+
+    Requests are only ever inserted, so enqueueing never waits on a worker; the worker merges all requests
+    of a team member into one reschedule once the member has been quiet for a short debounce window.
+    """
+    team_member = models.ForeignKey(TeamMember, on_delete=models.CASCADE, related_name='reschedule_requests')
+    requested_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f'Reschedule {self.team_member} requested at {self.requested_at}'
+
+    @classmethod
+    def enqueue(cls, team_member_ids):
+        """Request a reschedule of every given team member."""
+        return cls.objects.bulk_create([cls(team_member_id=team_member_id) for team_member_id in set(team_member_ids)])
@@ -0,0 +1,201 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from tasks.models import Holiday, WorkCalendar
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+DEFAULT_HOURS = 8
+WORK_START_TIME = time(9, 0, 0)
+END_OF_DAY = time(hour=17, minute=0)
+END_OF_OVERTIME_DAY = time(hour=23, minute=59)
+
+
+class MemberCalendar:
+    """Daily working hours of one team member as arrays indexed by days since the engine origin.
+
+    Hours are kept in hundredths of an hour (hours_worked has two decimal places), so the cumulative
+    sum is exact and a start-plus-effort question is answered with one searchsorted.
+    """
+
+    def __init__(self, origin, entries, holidays, days):
+        self.origin = origin
+        self.entries = entries
+        self.holidays = holidays
+        # Looked up once: timezone.make_aware resolves the current timezone on every call
+        self.tzinfo = timezone.get_current_timezone()
+        self._build(days)
+
+    def _build(self, days):
+        dates = np.datetime64(self.origin, 'D') + np.arange(days)
+        weekdays = (dates - EPOCH).astype(np.int64) % 7  # 1970-01-01 was a Thursday
+        weekdays = (weekdays + 3) % 7
+        holidays = np.isin(dates, np.array(sorted(self.holidays), dtype='datetime64[D]'))
+
+        working = (weekdays < 5) & ~holidays
+        overtime = np.zeros(days, dtype=bool)
+        hours = np.where(working, DEFAULT_HOURS * 100, 0).astype(np.int64)
+
+        # Any WorkCalendar entry overrides weekends and holidays, like WorkCalendar.is_working_day
+        for date, (status, hours_worked) in self.entries.items():
+            index = (date - self.origin).days
+            if 0 <= index < days:
+                is_overtime = status == 'overtime'
+                working[index] = is_overtime
+                overtime[index] = is_overtime
+                hours[index] = round((hours_worked or DEFAULT_HOURS) * 100) if is_overtime else 0
+
+        self.days = days
+        self.working = working
+        self.overtime = overtime
+        self.hours = hours
+        self.cumulative_hours = np.concatenate(([0], np.cumsum(hours)))
+        self.working_days = np.flatnonzero(working)
+
+    def extend(self, days):
+        """Grow the horizon to at least the given number of days."""
+        if days > self.days:
+            self._build(max(days, self.days * 2))
+
+    def index(self, date):
+        index = (date - self.origin).days
+        if index < 0:
+            raise ValueError(f'{date} is before the calendar origin {self.origin}.')
+        return index
+
+    def date(self, index):
+        return self.origin + timedelta(days=int(index))
+
+    def next_working_index(self, index):
+        while True:
+            position = np.searchsorted(self.working_days, index)
+            if position < len(self.working_days):
+                return int(self.working_days[position])
+            self.extend(index + 366)
+
+    def end_indexes(self, start_indexes, hours):
+        """Index of the day on which each effort is used up, counting from the start day inclusive."""
+        self.extend(start_indexes.max(initial=-1) + 1)
+        while True:
+            targets = self.cumulative_hours[start_indexes] + hours * 100
+            positions = np.searchsorted(self.cumulative_hours, targets, side='left')
+            if positions.max(initial=0) <= self.days:
+                break
+            self.extend(self.days + 1)
+
+        # No effort means the loop in add_working_hours never runs and the start day is kept
+        return np.where(hours > 0, positions - 1, start_indexes)
+
+    def end_of_working_day(self, date):
+        index = self.index(date)
+        self.extend(index + 1)
+        end_time = END_OF_OVERTIME_DAY if self.overtime[index] else END_OF_DAY
+        return datetime.combine(date, end_time, tzinfo=self.tzinfo)
+
+    def end_date(self, start_date, start_index, end_index, hours_to_add):
+        """End of the working day on which an effort started at start_date and used up on end_index ends."""
+        if hours_to_add > 0:
+            # Same walk as add_working_hours: whole days, then the rest of the effort on the last day,
+            # which may carry over midnight for long overtime days.
+            used_hours = (self.cumulative_hours[end_index] - self.cumulative_hours[start_index]) / 100
+            start_date += timedelta(days=int(end_index - start_index), hours=float(hours_to_add - used_hours))
+        return self.end_of_working_day(start_date.date())
+
+    def add_working_hours(self, start_date, hours_to_add):
+        """Scalar version of BusinessHoursEngine.add_working_hours, for schedulers chaining one effort at a time."""
+        start_index = self.index(start_date.date())
+        if hours_to_add <= 0:
+            return self.end_date(start_date, start_index, start_index, hours_to_add)
+
+        self.extend(start_index + 1)
+        target = self.cumulative_hours[start_index] + hours_to_add * 100
+        while target > self.cumulative_hours[-1]:
+            self.extend(self.days + 1)
+        end_index = int(np.searchsorted(self.cumulative_hours, target, side='left')) - 1
+        return self.end_date(start_date, start_index, end_index, hours_to_add)
+
+
+class BusinessHoursEngine:
+    """Batch counterpart of WorkCalendar.add_working_hours.
+
+    Builds an array of daily working hours per team member, with weekends, holidays and the member's
+    leave/overtime entries applied, and answers many (member, start, hours) questions per call.
+    Results follow the WorkCalendar semantics exactly, including the 17:00/23:59 end of day.
+    Starts must not be earlier than the origin the engine was loaded with.
+    """
+
+    def __init__(self, origin, entries, holidays, horizon=366):
+        self.origin = origin
+        self.entries = entries
+        self.holidays = set(holidays)
+        self.horizon = horizon
+        self._calendars = {}
+
+    @classmethod
+    def load(cls, team_members, origin):
+        """Load the calendars of the given team members (instances or ids) from origin on in two queries."""
+        team_member_ids = [getattr(team_member, 'pk', team_member) for team_member in team_members]
+        entries = {team_member_id: {} for team_member_id in team_member_ids}
+        for team_member_id, date, status, hours_worked in WorkCalendar.objects.filter(
+                team_member_id__in=team_member_ids, date__gte=origin
+        ).values_list('team_member_id', 'date', 'status', 'hours_worked'):
+            entries[team_member_id][date] = (status, hours_worked)
+
+        holidays = Holiday.objects.filter(date__gte=origin).values_list('date', flat=True)
+        return cls(origin, entries, holidays)
+
+    def with_changes(self, entries=None, holidays=None):
+        """Copy of the engine with some members' entries, or the holidays, replaced.
+
+        Calendars that are not affected by the changes are shared with this engine instead of being rebuilt.
+        """
+        engine = BusinessHoursEngine(self.origin, {**self.entries, **(entries or {})},
+                                     self.holidays if holidays is None else holidays, self.horizon)
+        if holidays is None:
+            engine._calendars = {team_member_id: calendar for team_member_id, calendar in self._calendars.items()
+                                 if team_member_id not in (entries or {})}
+        return engine
+
+    def calendar(self, team_member):
+        team_member_id = getattr(team_member, 'pk', team_member)
+        calendar = self._calendars.get(team_member_id)
+        if calendar is None:
+            if team_member_id not in self.entries:
+                raise ValueError(f'Calendar of team member {team_member_id} has not been loaded.')
+            calendar = MemberCalendar(self.origin, self.entries[team_member_id], self.holidays, self.horizon)
+            self._calendars[team_member_id] = calendar
+        return calendar
+
+    def get_next_available_workday(self, team_member, start_date):
+        """Find the next available workday starting from the given date for the specified team member."""
+        calendar = self.calendar(team_member)
+        index = calendar.next_working_index(calendar.index(start_date))
+        return datetime.combine(calendar.date(index), WORK_START_TIME, tzinfo=calendar.tzinfo)
+
+    def add_working_hours(self, team_members, start_dates, hours_to_add):
+        """Add working hours to every start date, each using its own team member's calendar.
+
+        The three arguments are parallel sequences; the end datetimes are returned in the same order.
+        """
+        team_member_ids = [getattr(team_member, 'pk', team_member) for team_member in team_members]
+        hours_to_add = np.asarray(hours_to_add, dtype=np.float64)
+        end_dates = [None] * len(start_dates)
+
+        positions_by_member = defaultdict(list)
+        for position, team_member_id in enumerate(team_member_ids):
+            positions_by_member[team_member_id].append(position)
+
+        for team_member_id, positions in positions_by_member.items():
+            calendar = self.calendar(team_member_id)
+            starts = [start_dates[position] for position in positions]
+            start_indexes = np.array([calendar.index(start.date()) for start in starts], dtype=np.int64)
+            hours = hours_to_add[positions]
+            end_indexes = calendar.end_indexes(start_indexes, hours)
+
+            for position, start, start_index, end_index, effort in zip(
+                    positions, starts, start_indexes, end_indexes, hours):
+                end_dates[position] = calendar.end_date(start, start_index, end_index, effort)
+
+        return end_dates
@@ -0,0 +1,419 @@
+import csv
+import logging
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.db import OperationalError, connection, transaction
+
+from common_utils.db_code import compile_app, refresh_materialized_views
+
+logger = logging.getLogger('tasks')
+
+DEFECTS_TABLE = 'all_veriii_defects'
+
+# Exports are written by Excel-like tools, which may start the file with a byte order mark
+CSV_ENCODING = 'utf-8-sig'
+
+# Columns kept by the loader rather than read from the export: the serial id of migration 0018, and the
+# key and content hash that incremental loads match rows by (migration 0023)
+ID_COLUMN = 'id'
+ROW_KEY = 'row_key'
+ROW_HASH = 'row_hash'
+
+# Rows read from the export and copied to the database at a time, so memory use doesn't grow with the file
+INGEST_CHUNK_SIZE = 50000
+# Chunks of an export parsed ahead of the one being copied, which bounds the disk space of the chunk files
+CHUNK_READ_AHEAD = 2
+
+# The date, or date and time, that an exported date starts with, e.g. 2025-01-06 10:00:00
+DATE_PATTERN = r'^\d{4}[-/]\d{1,2}[-/]\d{1,2}'
+TIMESTAMP_PATTERN = DATE_PATTERN + r'(?: \d{1,2}:\d{1,2}(?::\d{1,2})?)?'
+
+
+def leading_value(column, pattern, data_type):
+    """SQL for the start of an exported column that matches `pattern`, as a `data_type`; NULL if the column
+    doesn't start with a valid one, so a malformed value doesn't fail the load.
+    """
+    value = f"""substring("{column}" FROM '{pattern}')"""
+    return f"CASE WHEN pg_input_is_valid({value}, '{data_type}') THEN {value}::{data_type} END"
+
+
+# Typed and normalized columns computed from the exported text when rows are staged, so the veriii_defects
+# view reads and filters them without parsing every row again (migration 0024 indexes them). These aren't
+# generated columns because casts to timestamptz aren't immutable.
+TYPED_COLUMNS = {
+    'priority_no': """CASE "Priority" WHEN '非常紧急' THEN 1 WHEN '紧急' THEN 2 WHEN '普通' THEN 3
+                         WHEN '较低' THEN 4 END""",
+    'workflow_status': """CASE WHEN "Workflow Status" IN ('待部署生产环境', 'Verified(生产问题则代表已发版)')
+                             THEN 'Closed' ELSE 'WIP' END""",
+    'creation_date': leading_value('Creation Time', DATE_PATTERN, 'date'),
+    'creation_timestamp': leading_value('Creation Time', TIMESTAMP_PATTERN, 'timestamptz'),
+    'complete_date': leading_value('complete time', DATE_PATTERN, 'date'),
+}
+
+UPLOAD_TABLE = 'defects_upload'
+STAGING_TABLE = 'defects_staging'
+
+# A swapped load fills this table and its indexes, then renames it over the defects table
+SHADOW_SUFFIX = '_shadow'
+SHADOW_TABLE = DEFECTS_TABLE + SHADOW_SUFFIX
+SHADOW_SEQUENCE = f'{SHADOW_TABLE}_{ID_COLUMN}_seq'
+
+# The swap waits this long for readers of the table and its views before it gives up and tries again,
+# so readers queued behind it are never held up for longer
+SWAP_LOCK_TIMEOUT = '200ms'
+SWAP_ATTEMPTS = 10
+LOCK_NOT_AVAILABLE = '55P03'
+
+# Name and table of a pg_get_indexdef() definition
+INDEX_DEFINITION = re.compile(r'^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON (?:ONLY )?)(\S+)')
+
+
+class SwapTimeout(Exception):
+    """The shadow table could not be swapped in because readers kept holding the defects table."""
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def unquote_identifier(name):
+    """Unqualified name of a possibly schema-qualified and quoted identifier, as Postgres prints them."""
+    name = name.rpartition('.')[2]
+    return name[1:-1].replace('""', '"') if name.startswith('"') else name
+
+
+def column_list(columns, prefix=''):
+    return ', '.join(prefix + quote_identifier(column) for column in columns)
+
+
+def data_columns(cursor, table=DEFECTS_TABLE):
+    """Columns of the defects table that hold exported data, in table order."""
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+          AND column_name <> ALL(%s)
+        ORDER BY ordinal_position""", [table, [ID_COLUMN, ROW_KEY, ROW_HASH, *TYPED_COLUMNS]])
+    return [column for column, in cursor.fetchall()]
+
+
+def stored_columns(columns):
+    """Columns the loader writes for the given data columns."""
+    return columns + list(TYPED_COLUMNS) + [ROW_KEY, ROW_HASH]
+
+
+def typed_expressions():
+    return ', '.join(f'{expression} AS {quote_identifier(column)}' for column, expression in TYPED_COLUMNS.items())
+
+
+def row_hash_expression(columns, prefix=''):
+    return f'md5(ROW({column_list(columns, prefix)})::text)'
+
+
+def row_key_expression(key_columns, prefix=''):
+    """Natural key of the given columns or, without any, the content hash numbered among identical rows,
+    so duplicate rows in an export keep one key each.
+    """
+    if key_columns:
+        return row_hash_expression(key_columns, prefix)
+    return (f"{prefix}{ROW_HASH} || '-' || "
+            f'ROW_NUMBER() OVER (PARTITION BY {prefix}{ROW_HASH} ORDER BY {prefix}{ID_COLUMN})')
+
+
+def check_header(csv_file, header, columns):
+    """Raise ValueError unless the header of a CSV export names distinct columns of the defects table."""
+    if not header:
+        raise ValueError(f'{csv_file} has no header line')
+    unknown = [column for column in header if column not in columns]
+    if unknown or len(set(header)) != len(header):
+        raise ValueError(f'{csv_file}: unknown or repeated {DEFECTS_TABLE} columns in the header: '
+                         f'{", ".join(unknown) or ", ".join(header)}')
+
+
+def prepare_chunk(csv_file, columns, path, chunk_size=INGEST_CHUNK_SIZE, position=None):
+    """Parse and check the next rows of a CSV export, at most `chunk_size` of them, and write them to the
+    chunk file `path`.
+
+    `position` is where the previous chunk of the file ended, as returned with it; without one the chunk
+    starts at the top of the file and the header is checked. Chunk files have no header and the given
+    `columns` in order, fields the export lacks left empty, so every export can be copied with the same COPY
+    statement. Rows must have as many fields as the header, and blank lines are skipped. Runs in a worker
+    process: returns the number of rows, the position of the next chunk (None at the end of the file) and
+    the seconds it took.
+    """
+    started = time.perf_counter()
+    with open(csv_file, encoding=CSV_ENCODING, newline='') as file:
+        if position is None:
+            first_line, header = 0, None
+        else:
+            offset, first_line, header = position
+            file.seek(offset)
+        # Lines are read with readline rather than by iterating the file, which would disable tell()
+        reader = csv.reader(iter(file.readline, ''))
+        if header is None:
+            header = next(reader, [])
+            check_header(csv_file, header, columns)
+        indexes = [header.index(column) if column in header else None for column in columns]
+
+        rows = 0
+        with open(path, 'w', encoding='utf-8', newline='') as chunk:
+            writer = csv.writer(chunk)
+            for row in reader:
+                if not row:
+                    continue
+                if len(row) != len(header):
+                    raise ValueError(f'{csv_file}, line {first_line + reader.line_num}: {len(row)} fields, '
+                                     f'the header has {len(header)}')
+                writer.writerow(['' if index is None else row[index] for index in indexes])
+                rows += 1
+                if rows == chunk_size:
+                    break
+        next_position = (file.tell(), first_line + reader.line_num, header) if rows == chunk_size else None
+    return rows, next_position, time.perf_counter() - started
+
+
+def copy_prepared(cursor, path, table, columns):
+    """COPY a chunk file of prepare_chunk into `table`.
+
+    Empty fields, quoted or not, are loaded as NULL, like pandas' read_csv/to_sql did before.
+    """
+    columns = column_list(columns)
+    with open(path, encoding='utf-8', newline='') as file:
+        cursor.copy_expert(f'COPY {quote_identifier(table)} ({columns}) '
+                           f'FROM STDIN WITH (FORMAT csv, FORCE_NULL ({columns}))', file)
+
+
+def copy_csv_files(cursor, csv_files, table, columns, chunk_size=INGEST_CHUNK_SIZE, workers=None,
+                   progress=None):
+    """Copy CSV exports into `table` in file and row order, chunk by chunk as a process pool parses and
+    checks them (see prepare_chunk).
+
+    The files are parsed in parallel, each one chunk after the other and at most CHUNK_READ_AHEAD chunks
+    ahead of the copy, and every chunk file is deleted once it is copied, so the first rows are copied as
+    soon as they are parsed and the chunk files never hold more than a few chunks per export.
+    `progress`, if given, is called with the export's name and the number of its rows copied so far after
+    every chunk. Returns a list with every export's name, rows, and seconds spent parsing and copying it.
+    """
+    files = [{'file': csv_file, 'rows': 0, 'parse_seconds': 0, 'copy_seconds': 0} for csv_file in csv_files]
+    with tempfile.TemporaryDirectory(prefix='defects-') as directory, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        parsing = {}  # future: (file number, chunk number)
+        parsed = {}  # (file number, chunk number): (rows, position of the next chunk)
+        paused = {}  # file number: (chunk number, position) of the next chunk, once enough are read ahead
+
+        def parse(number, chunk, position=None):
+            path = os.path.join(directory, f'{number}.{chunk}')
+            parsing[pool.submit(prepare_chunk, csv_files[number], columns, path, chunk_size, position)] = (
+                number, chunk)
+
+        for number in range(len(csv_files)):
+            parse(number, 0)
+
+        for number, file in enumerate(files):
+            chunk = 0
+            while True:
+                while (number, chunk) not in parsed:
+                    done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        done_number, done_chunk = parsing.pop(future)
+                        rows, position, seconds = future.result()
+                        files[done_number]['parse_seconds'] += seconds
+                        parsed[done_number, done_chunk] = rows, position
+                        if position is None:
+                            continue
+                        if sum(key[0] == done_number for key in parsed) < CHUNK_READ_AHEAD:
+                            parse(done_number, done_chunk + 1, position)
+                        else:
+                            paused[done_number] = done_chunk + 1, position
+
+                rows, position = parsed.pop((number, chunk))
+                path = os.path.join(directory, f'{number}.{chunk}')
+                started = time.perf_counter()
+                if rows:
+                    copy_prepared(cursor, path, table, columns)
+                os.remove(path)
+                file['copy_seconds'] += time.perf_counter() - started
+                file['rows'] += rows
+                if number in paused:
+                    parse(number, *paused.pop(number))
+                if rows and progress:
+                    progress(file['file'], file['rows'])
+                if position is None:
+                    break
+                chunk += 1
+    return files
+
+
+def stage_defects(cursor, csv_files, key_columns=None, chunk_size=INGEST_CHUNK_SIZE, workers=None,
+                  progress=None):
+    """Copy CSV exports into a temporary staging table with the key and hash of every row.
+
+    The staging table has the data columns of the defects table, the row key and hash, and the
+    position of the row in the files as `id`; it is dropped by load_defects or else at the end of the
+    transaction. Returns the data columns and the per-file results of copy_csv_files.
+    """
+    columns = data_columns(cursor)
+    unknown = [column for column in key_columns or [] if column not in columns]
+    if unknown:
+        raise ValueError(f'Unknown {DEFECTS_TABLE} columns: {", ".join(unknown)}')
+
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE {UPLOAD_TABLE} ON COMMIT DROP AS
+        SELECT {column_list(columns)} FROM {quote_identifier(DEFECTS_TABLE)} WITH NO DATA""")
+    cursor.execute(f'ALTER TABLE {UPLOAD_TABLE} ADD COLUMN {ID_COLUMN} bigint GENERATED ALWAYS AS IDENTITY')
+    files = copy_csv_files(cursor, csv_files, UPLOAD_TABLE, columns, chunk_size, workers, progress)
+
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE {STAGING_TABLE} ON COMMIT DROP AS
+        SELECT *, {typed_expressions()}, {row_key_expression(key_columns)} AS {ROW_KEY}
+        FROM (SELECT *, {row_hash_expression(columns)} AS {ROW_HASH} FROM {UPLOAD_TABLE}) AS hashed""")
+    cursor.execute(f'DROP TABLE {UPLOAD_TABLE}')
+    cursor.execute(f'ANALYZE {STAGING_TABLE}')
+
+    if key_columns:
+        cursor.execute(f'SELECT {ROW_KEY} FROM {STAGING_TABLE} GROUP BY {ROW_KEY} HAVING COUNT(*) > 1 LIMIT 1')
+        if cursor.fetchone():
+            raise ValueError(f'Several rows have the same {", ".join(key_columns)}')
+    return columns, files
+
+
+def insert_staged(cursor, columns, table):
+    """Insert all staged rows into an empty table in file order; returns the counts of a full load."""
+    targets = column_list(stored_columns(columns))
+    cursor.execute(f'INSERT INTO {quote_identifier(table)} ({targets}) '
+                   f'SELECT {targets} FROM {STAGING_TABLE} ORDER BY {ID_COLUMN}')
+    return {'inserted': cursor.rowcount, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+
+
+def replace_defects(cursor, columns):
+    """Replace the whole defects table with the staged rows, numbering them from 1 in file order."""
+    cursor.execute(f'TRUNCATE TABLE {quote_identifier(DEFECTS_TABLE)} RESTART IDENTITY CASCADE')
+    return insert_staged(cursor, columns, DEFECTS_TABLE)
+
+
+def fill_shadow(cursor, columns):
+    """Create the shadow table like the defects table, with its own id sequence, and fill it and build its
+    indexes from the staged rows. Indexes are named like the defects table's, with SHADOW_SUFFIX.
+    """
+    table, shadow = quote_identifier(DEFECTS_TABLE), quote_identifier(SHADOW_TABLE)
+    sequence = quote_identifier(SHADOW_SEQUENCE)
+    cursor.execute(f'DROP TABLE IF EXISTS {shadow}')
+    cursor.execute(f'CREATE TABLE {shadow} (LIKE {table} INCLUDING ALL EXCLUDING INDEXES)')
+    cursor.execute(f'CREATE SEQUENCE {sequence} OWNED BY {shadow}.{ID_COLUMN}')
+    cursor.execute(f"ALTER TABLE {shadow} ALTER COLUMN {ID_COLUMN} SET DEFAULT nextval('{sequence}')")
+    counts = insert_staged(cursor, columns, SHADOW_TABLE)
+
+    # Indexes are built once the rows are in, which is faster than maintaining them row by row
+    cursor.execute('SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = %s::regclass', [table])
+    for definition, in cursor.fetchall():
+        cursor.execute(INDEX_DEFINITION.sub(lambda match: (
+            f'{match[1]}{quote_identifier(unquote_identifier(match[2]) + SHADOW_SUFFIX)}{match[3]}{shadow}'),
+            definition))
+    cursor.execute(f'ANALYZE {shadow}')
+    return counts
+
+
+def swap_shadow():
+    """Put the shadow table in place of the defects table, and recreate the views of tasks/db_code on it.
+
+    Dropping the defects table also drops the views that read it, so the tasks db code of those views is
+    compiled again in the same transaction. Materialized views are recreated WITH NO DATA, to keep the
+    transaction and its locks short, and must be refreshed once it has committed (see load_defects).
+    Every statement waits at most SWAP_LOCK_TIMEOUT for a lock; the swap is tried again if that runs out,
+    up to SWAP_ATTEMPTS times before SwapTimeout is raised.
+    """
+    table, shadow = quote_identifier(DEFECTS_TABLE), quote_identifier(SHADOW_TABLE)
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+                cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, ID_COLUMN])
+                sequence, = cursor.fetchone()
+                cursor.execute('SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = %s::regclass',
+                               [shadow])
+                indexes = [index for index, in cursor.fetchall()]
+
+                cursor.execute(f'DROP TABLE {table} CASCADE')
+                cursor.execute(f'ALTER TABLE {shadow} RENAME TO {table}')
+                for index in indexes:
+                    cursor.execute(f'ALTER INDEX {index} RENAME TO '
+                                   f'{quote_identifier(unquote_identifier(index).removesuffix(SHADOW_SUFFIX))}')
+                if sequence:
+                    cursor.execute(f'ALTER SEQUENCE {quote_identifier(SHADOW_SEQUENCE)} '
+                                   f'RENAME TO {quote_identifier(unquote_identifier(sequence))}')
+                compile_app('tasks', with_data=False)
+            return attempt
+        except OperationalError as error:
+            if getattr(error.__cause__, 'pgcode', None) != LOCK_NOT_AVAILABLE:
+                raise
+            if attempt == SWAP_ATTEMPTS:
+                raise SwapTimeout(f'{DEFECTS_TABLE} stayed locked for {SWAP_ATTEMPTS} attempts; '
+                                  f'the new rows are left in {SHADOW_TABLE}') from error
+            logger.warning(f'Swapping in {SHADOW_TABLE} timed out waiting for a lock, attempt {attempt}')
+            time.sleep(attempt * 0.1)
+
+
+def merge_defects(cursor, columns):
+    """Apply the staged rows to the defects table by row key, writing only what changed.
+
+    New rows are inserted, rows whose content hash changed are updated in place and keep their id, and
+    rows whose key is no longer in the export are deleted. Returns the number of rows of each kind.
+    """
+    table, targets = quote_identifier(DEFECTS_TABLE), column_list(stored_columns(columns))
+    # Unchanged rows are left out of the INSERT, so they don't even draw an id from the sequence
+    cursor.execute(f"""
+        WITH upserted AS (
+            INSERT INTO {table} AS defect ({targets})
+            SELECT {column_list(stored_columns(columns), 'staged.')} FROM {STAGING_TABLE} staged
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table} existing
+                WHERE existing.{ROW_KEY} = staged.{ROW_KEY} AND existing.{ROW_HASH} = staged.{ROW_HASH}
+            )
+            ORDER BY staged.{ID_COLUMN}
+            ON CONFLICT ({ROW_KEY}) DO UPDATE SET
+                ({targets}) = ROW({column_list(stored_columns(columns), 'EXCLUDED.')})
+            WHERE defect.{ROW_HASH} IS DISTINCT FROM EXCLUDED.{ROW_HASH}
+            RETURNING xmax = 0 AS inserted
+        )
+        SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM upserted""")
+    inserted, updated = cursor.fetchone()
+
+    cursor.execute(f"""
+        DELETE FROM {table} defect
+        WHERE NOT EXISTS (SELECT 1 FROM {STAGING_TABLE} staged WHERE staged.{ROW_KEY} = defect.{ROW_KEY})""")
+    deleted = cursor.rowcount
+
+    cursor.execute(f'SELECT COUNT(*) FROM {STAGING_TABLE}')
+    staged, = cursor.fetchone()
+    return {'inserted': inserted, 'updated': updated, 'deleted': deleted, 'unchanged': staged - inserted - updated}
+
+
+def load_defects(csv_files, key_columns=None, incremental=False, swap=False, chunk_size=INGEST_CHUNK_SIZE,
+                 workers=None, progress=None):
+    """Load CSV exports into the defects table as one snapshot; returns the number of rows inserted,
+    updated, deleted and left unchanged, under 'files' the per-file results of copy_csv_files and under
+    'refreshed' the materialized views refreshed after the load.
+
+    The CSV headers name the table columns, so the exports' columns may come in any order. Rows are keyed
+    by the `key_columns` or, without any, by their content; a full load replaces the table, an incremental
+    one only writes the rows that are new, changed or gone (see merge_defects). Both run in one transaction
+    that locks the table until it commits; with `swap`, the full load fills a shadow table instead and
+    only locks the table for the swap (see swap_shadow). The files are parsed by `workers` processes and
+    copied `chunk_size` rows at a time, calling `progress` as in copy_csv_files. The tasks app's
+    materialized views are refreshed once the new rows are committed.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        columns, files = stage_defects(cursor, csv_files, key_columns, chunk_size, workers, progress)
+        if swap:
+            counts = fill_shadow(cursor, columns)
+        else:
+            counts = merge_defects(cursor, columns) if incremental else replace_defects(cursor, columns)
+        # Dropped now rather than on commit, in case the load runs in a longer transaction
+        cursor.execute(f'DROP TABLE {STAGING_TABLE}')
+    if swap:
+        swap_shadow()
+    return {**counts, 'files': files, 'refreshed': refresh_materialized_views(['tasks'])}
+
@@ -0,0 +1,55 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from tasks.models import AllCompletionWork, VeriiiTaskAssignments
+from tasks.utils import filter_by_date_range
+
+# Exportable views: name -> (model, field the date range filter applies to, like the admin list filters)
+EXPORTS = {
+    'task-assignments': (VeriiiTaskAssignments, 'planed_end_time'),
+    'completion-work': (AllCompletionWork, 'complete_time'),
+}
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """File-like object whose write() returns the value, so csv.writer produces lines for a generator."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(name, date_range=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Column names and a row iterator for an export, read through a server-side cursor in chunks.
+
+    Rows are tuples from values_list, so memory use stays the same however many rows the view has.
+    """
+    model, date_field = EXPORTS[name]
+    fields = [field.attname for field in model._meta.concrete_fields]
+    queryset = model.objects.all()
+    if date_range:
+        queryset = filter_by_date_range(queryset, date_field, date_range)
+        if queryset is None:
+            raise ValueError(f'Unknown date range: {date_range!r}')
+    return fields, queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+
+
+def csv_lines(fields, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(fields, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def export_lines(name, export_format, date_range=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Lines of an export in the given format ('csv' or 'jsonl'), generated while the rows are read."""
+    fields, rows = export_rows(name, date_range, chunk_size)
+    return csv_lines(fields, rows) if export_format == 'csv' else jsonl_lines(fields, rows)
@@ -0,0 +1,134 @@
+import plotly.graph_objs as go
+from django.db.models import Q
+
+from tasks.models import Assignment
+
+# Columns read for every assignment on the Gantt chart, in one query without loading model instances
+GANTT_FIELDS = {
+    'assignment_id': 'pk',
+    'task_name': 'task__task_name',
+    'team_member_id': 'team_member_id',
+    'first_name': 'team_member__user__first_name',
+    'last_name': 'team_member__user__last_name',
+    'username': 'team_member__user__username',
+    'planned_start_time': 'planned_start_time',
+    'planned_end_time': 'planned_end_time',
+    'actual_start_time': 'actual_start_time',
+    'actual_end_time': 'actual_end_time',
+}
+
+
+def member_name(first_name, last_name, username):
+    """Same text as str(team_member): the user's full name, or the username without one."""
+    return f'{first_name} {last_name}'.strip() or username
+
+
+def load_gantt_columns(assignments=None):
+    """Read the Gantt fields of the given assignments (all by default) as {column: list of values}."""
+    if assignments is None:
+        assignments = Assignment.objects.order_by('pk')
+    rows = list(assignments.values_list(*GANTT_FIELDS.values()))
+    columns = {name: list(values) for name, values in zip(GANTT_FIELDS, zip(*rows))} if rows else {
+        name: [] for name in GANTT_FIELDS}
+    columns['team_member'] = [member_name(*names) for names in zip(
+        columns.pop('first_name'), columns.pop('last_name'), columns.pop('username'))]
+    return columns
+
+
+def filter_gantt_assignments(assignments, start=None, end=None, team_member_ids=None, department=None, level=None):
+    """Narrow assignments down to a time window, team members, a department and a task level.
+
+    An assignment is in the window when its planned or its actual bar overlaps it; assignments without
+    planned or actual times have no bar in any window and are left out.
+    """
+    if start is not None or end is not None:
+        planned, actual = Q(planned_start_time__isnull=False, planned_end_time__isnull=False), Q(
+            actual_start_time__isnull=False, actual_end_time__isnull=False)
+        if start is not None:
+            planned &= Q(planned_end_time__gt=start)
+            actual &= Q(actual_end_time__gt=start)
+        if end is not None:
+            planned &= Q(planned_start_time__lt=end)
+            actual &= Q(actual_start_time__lt=end)
+        assignments = assignments.filter(planned | actual)
+    if team_member_ids:
+        assignments = assignments.filter(team_member_id__in=team_member_ids)
+    if department:
+        assignments = assignments.filter(team_member__department=department)
+    if level is not None:
+        assignments = assignments.filter(task__level=level)
+    return assignments
+
+
+def load_gantt_page(assignments, after=None, limit=5000):
+    """Columns of at most `limit` assignments with an id above `after`, and the `after` of the next page.
+
+    Pages are cut by assignment id (keyset pagination), so a page is one query however deep it is.
+    """
+    assignments = assignments.order_by('pk')
+    if after is not None:
+        assignments = assignments.filter(pk__gt=after)
+    columns = load_gantt_columns(assignments[:limit + 1])
+    next_after = None
+    if len(columns['assignment_id']) > limit:
+        columns = {name: values[:limit] for name, values in columns.items()}
+        next_after = columns['assignment_id'][-1]
+    return columns, next_after
+
+
+def epoch_milliseconds(values):
+    return [round(value.timestamp() * 1000) if value else None for value in values]
+
+
+def gantt_payload(columns, next_after=None):
+    """JSON-ready columnar payload: parallel arrays, with times as epoch milliseconds like the bar bases."""
+    payload = {name: values for name, values in columns.items() if not name.endswith('_time')}
+    payload.update({name: epoch_milliseconds(values) for name, values in columns.items() if name.endswith('_time')})
+    payload['next_after'] = next_after
+    return payload
+
+
+def hours_between(start_time, end_time):
+    return (end_time - start_time).total_seconds() / 3600 if start_time and end_time else None
+
+
+def gantt_figure(columns):
+    """One horizontal bar trace per (planned/actual, team member), each holding all of the member's bars.
+
+    Traces are named "Planned (member)" and "Actual (member)" as before; bar length is the duration in hours
+    on top of a base of epoch milliseconds. Assignments that are not planned keep a (gapped) planned bar,
+    so every task still has its row.
+    """
+    traces = {}
+
+    def add_bar(kind, team_member, task_name, start_time, end_time):
+        trace = traces.setdefault((kind, team_member), {'x': [], 'y': [], 'base': []})
+        trace['x'].append(hours_between(start_time, end_time))
+        trace['y'].append(task_name)
+        trace['base'].append(start_time.timestamp() * 1000 if start_time else None)
+
+    for task_name, team_member, planned_start_time, planned_end_time, actual_start_time, actual_end_time in zip(
+            columns['task_name'], columns['team_member'], columns['planned_start_time'],
+            columns['planned_end_time'], columns['actual_start_time'], columns['actual_end_time']):
+        add_bar('Planned', team_member, task_name, planned_start_time, planned_end_time)
+        if actual_start_time and actual_end_time:
+            add_bar('Actual', team_member, task_name, actual_start_time, actual_end_time)
+
+    fig = go.Figure()
+    for (kind, team_member), trace in traces.items():
+        fig.add_trace(go.Bar(
+            x=trace['x'],
+            y=trace['y'],
+            base=trace['base'],
+            orientation='h',
+            name=f'{kind} ({team_member})',
+            opacity=0.6 if kind == 'Actual' else None
+        ))
+
+    fig.update_layout(
+        title='Task Assignments Gantt Chart',
+        barmode='overlay',
+        xaxis_title="Time (Hours)",
+        yaxis_title="Tasks"
+    )
+    return fig
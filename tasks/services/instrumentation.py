@@ -0,0 +1,107 @@
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from django.db import connection
+from django.dispatch import Signal
+
+# Sent with `summary` (see ScheduleProfile.summary) when a profiling() block ends
+schedule_profiled = Signal()
+
+PHASES = ('lock', 'load', 'aggregates', 'calendar', 'write')
+
+# Returned by phase() while nothing is being profiled, so the scheduler only pays for a function call
+NO_PHASE = nullcontext()
+
+_active_profile = None
+
+
+class QueryCounter:
+    """execute_wrapper that counts the queries run on a connection, without keeping them like DEBUG does."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class ScheduleProfile:
+    """Time and query count of every scheduler phase, per team member and for the whole run.
+
+    Phases are recorded from several threads when team members are rescheduled in parallel; the queries
+    are counted on the connection of the thread that runs the phase.
+    """
+
+    def __init__(self):
+        self.phases = defaultdict(lambda: [0.0, 0])  # (team member id or None, phase) -> [seconds, queries]
+        self.started = time.perf_counter()
+        self.seconds = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, team_member=None):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(counter):
+                yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                totals = self.phases[(getattr(team_member, 'pk', team_member), name)]
+                totals[0] += seconds
+                totals[1] += counter.count
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+
+    def summary(self):
+        """Totals as plain data: the run's wall-clock time, and seconds/queries per phase and per team member.
+
+        Phases that are not specific to one member (e.g. the dependency-aware run) only count in the totals.
+        """
+        phases = {}
+        team_members = {}
+        for (team_member_id, name), (seconds, queries) in self.phases.items():
+            targets = [phases]
+            if team_member_id is not None:
+                member = team_members.setdefault(team_member_id, {'seconds': 0.0, 'queries': 0, 'phases': {}})
+                member['seconds'] += seconds
+                member['queries'] += queries
+                targets.append(member['phases'])
+
+            for totals in targets:
+                phase_totals = totals.setdefault(name, {'seconds': 0.0, 'queries': 0})
+                phase_totals['seconds'] += seconds
+                phase_totals['queries'] += queries
+
+        return {
+            'seconds': self.seconds if self.seconds is not None else time.perf_counter() - self.started,
+            'queries': sum(totals['queries'] for totals in phases.values()),
+            'phases': phases,
+            'team_members': team_members,
+        }
+
+
+@contextmanager
+def profiling():
+    """Record the scheduler phases run inside the block and send schedule_profiled when it ends."""
+    global _active_profile
+    previous, profile = _active_profile, ScheduleProfile()
+    _active_profile = profile
+    try:
+        yield profile
+    finally:
+        _active_profile = previous
+        profile.finish()
+        schedule_profiled.send(sender=ScheduleProfile, summary=profile.summary())
+
+
+def phase(name, team_member=None):
+    """Context manager recording one scheduler phase in the active profile, or doing nothing without one."""
+    if _active_profile is None:
+        return NO_PHASE
+    return _active_profile.phase(name, team_member)
@@ -1,90 +1,436 @@
+import heapq
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import Q
 from django.db.models.aggregates import Max
+from django.db.models.functions import Coalesce
 from django.utils import timezone
-from collections import deque, defaultdict
-from tasks.models import Assignment, TaskPredecessor, WorkCalendar
+from collections import defaultdict
+from simple_history.utils import bulk_update_with_history
+from tasks.models import Assignment, TaskPredecessor, WorkCalendar, WorkCalendarSnapshot
+from tasks.services.business_hours import BusinessHoursEngine
+from tasks.services.instrumentation import phase
+from tasks.services.task_rollups import TaskRollups
 
 logger = logging.getLogger('tasks')  # 使用特定的应用程序日志记录器
 
 
+# Assignments that are (re)planned by the scheduler: level-1 work that hasn't started yet
+QUEUE_FILTER = Q(task__level=1, actual_start_time__isnull=True, actual_end_time__isnull=True)
+QUEUE_ORDERING = ('task__level', 'task__priority', 'task__created_at', 'pk')
+SCHEDULE_FIELDS = ['planned_start_time', 'planned_end_time', 'need_update']
+
+# First key of the Postgres advisory locks taken on a team member's schedule, the second one is the member id
+SCHEDULE_LOCK_NAMESPACE = 1801
+
+
+class DependencyCycleError(ValueError):
+    """Raised when task predecessors form a cycle; `tasks` lists the cycle, first task repeated at the end."""
+
+    def __init__(self, tasks):
+        self.tasks = tasks
+        super().__init__(f"Cycle detected in task dependencies: {' -> '.join(str(task) for task in tasks)}")
+
+
 class ScheduleService:
 
     @staticmethod
-    def get_dependency_order(tasks):
-        """Determine the dependency order of tasks."""
-        graph = defaultdict(list)
-        in_degree = {task: 0 for task in tasks}
+    @contextmanager
+    def lock_team_members(team_member_ids):
+        """Run the block in a transaction holding the schedule locks of the given team members.
 
-        for predecessor in TaskPredecessor.objects.filter(to_task__in=tasks):
-            graph[predecessor.from_task].append(predecessor.to_task)
-            in_degree[predecessor.to_task] += 1
+        The Postgres advisory locks make concurrent reschedules of the same member (parallel workers, a second
+        run, an admin action) wait for each other. Locks are taken in id order so runs can't deadlock.
+        """
+        team_member_ids = sorted(set(team_member_ids))
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Waiting for a single member's lock is profiled as that member's, otherwise as the run's
+                with phase('lock', team_member_ids[0] if len(team_member_ids) == 1 else None), \
+                        connection.cursor() as cursor:
+                    for team_member_id in team_member_ids:
+                        cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)',
+                                       [SCHEDULE_LOCK_NAMESPACE, team_member_id])
+            yield
 
-        queue = deque([task for task in tasks if in_degree[task] == 0])
+    @staticmethod
+    def load_predecessors(tasks=None):
+        """Load the predecessor graph in one query, as {task id: [predecessor task ids]}.
+
+        A TaskPredecessor row means its to_task is a predecessor of its from_task (see Task.predecessors).
+        """
+        edges = TaskPredecessor.objects.all()
+        if tasks is not None:
+            edges = edges.filter(from_task__in=tasks)
+
+        predecessors = defaultdict(list)
+        for task_id, predecessor_id in edges.values_list('from_task_id', 'to_task_id'):
+            predecessors[task_id].append(predecessor_id)
+        return predecessors
+
+    @staticmethod
+    def order_by_dependencies(tasks, predecessors):
+        """Order tasks so that every task comes after its predecessors, in O(V+E) heap operations.
+
+        Tasks that are ready at the same time keep the scheduling order (level, priority, created_at).
+        Predecessors outside the given tasks are ignored.
+        """
+        tasks_by_id = {task.pk: task for task in tasks}
+        successors = defaultdict(list)
+        in_degree = dict.fromkeys(tasks_by_id, 0)
+        for task_id in tasks_by_id:
+            for predecessor_id in predecessors.get(task_id, ()):
+                if predecessor_id in tasks_by_id:
+                    successors[predecessor_id].append(task_id)
+                    in_degree[task_id] += 1
+
+        def sort_key(task_id):
+            task = tasks_by_id[task_id]
+            return task.level, task.priority, task.created_at, task_id
+
+        ready = [sort_key(task_id) for task_id, degree in in_degree.items() if degree == 0]
+        heapq.heapify(ready)
         ordered_tasks = []
 
-        while queue:
-            current_task = queue.popleft()
-            ordered_tasks.append(current_task)
+        while ready:
+            current_task_id = heapq.heappop(ready)[-1]
+            ordered_tasks.append(tasks_by_id[current_task_id])
 
-            for next_task in graph[current_task]:
-                in_degree[next_task] -= 1
-                if in_degree[next_task] == 0:
-                    queue.append(next_task)
+            for next_task_id in successors[current_task_id]:
+                in_degree[next_task_id] -= 1
+                if in_degree[next_task_id] == 0:
+                    heapq.heappush(ready, sort_key(next_task_id))
 
-        if len(ordered_tasks) != len(tasks):
-            raise ValueError("Cycle detected in task dependencies")
+        if len(ordered_tasks) != len(tasks_by_id):
+            remaining = {task_id for task_id, degree in in_degree.items() if degree > 0}
+            cycle = ScheduleService._find_cycle(remaining, predecessors)
+            raise DependencyCycleError([tasks_by_id[task_id] for task_id in cycle])
 
         return ordered_tasks
 
     @staticmethod
-    def recalculate_assignment_schedule(assignment: Assignment):
-        """Recalculate the schedule for a single assignment considering its dependencies and working calendar."""
-        max_planned_end_time = \
-            Assignment.objects.filter(team_member=assignment.team_member, need_update=False).aggregate(
-                Max('planned_end_time'))['planned_end_time__max']
+    def _find_cycle(task_ids, predecessors):
+        """Return one cycle, in dependency order, among tasks that all still wait for a predecessor."""
+        path, positions = [], {}
+        task_id = next(iter(task_ids))
+        while task_id not in positions:
+            positions[task_id] = len(path)
+            path.append(task_id)
+            task_id = next(
+                predecessor_id for predecessor_id in predecessors[task_id] if predecessor_id in task_ids)
+
+        cycle = path[positions[task_id]:]
+        cycle.reverse()
+        return cycle + [cycle[0]]
+
+    @staticmethod
+    def get_dependency_order(tasks):
+        """Determine the dependency order of tasks."""
+        tasks = list(tasks)
+        return ScheduleService.order_by_dependencies(tasks, ScheduleService.load_predecessors(tasks))
 
-        max_actual_end_time = Assignment.objects.filter(team_member=assignment.team_member).aggregate(
-            Max('actual_end_time'))['actual_end_time__max']
+    @staticmethod
+    def recalculate_assignment_schedule(assignment: Assignment, calendar: WorkCalendarSnapshot = None):
+        """Recalculate the schedule for a single assignment considering its dependencies and working calendar.
+
+        Pass the team member's calendar snapshot when scheduling several assignments in a row,
+        so the calendar is loaded once instead of once per assignment.
+        """
+        with phase('aggregates', assignment.team_member_id):
+            max_planned_end_time = \
+                Assignment.objects.filter(team_member=assignment.team_member, need_update=False).aggregate(
+                    Max('planned_end_time'))['planned_end_time__max']
+
+            max_actual_end_time = Assignment.objects.filter(team_member=assignment.team_member).aggregate(
+                Max('actual_end_time'))['actual_end_time__max']
 
         new_planned_start_date_for_assignment = max(
             [end_time for end_time in [max_actual_end_time, max_planned_end_time, timezone.now()] if
              end_time is not None])
 
-        # Use the team member's work calendar to find the next available workday
-        start_date = WorkCalendar.get_next_available_workday(
-            assignment.team_member,
-            new_planned_start_date_for_assignment.date()
-        )
+        with phase('calendar', assignment.team_member_id):
+            if calendar is None:
+                calendar = WorkCalendar.snapshot(assignment.team_member,
+                                                 new_planned_start_date_for_assignment.date())
 
-        # Calculate the planned end time using the work calendar
-        end_date = WorkCalendar.add_working_hours(
-            assignment.team_member,
-            start_date,
-            float(assignment.effort_estimation or 0) * 8
-        )
+            # Use the team member's work calendar to find the next available workday
+            start_date = calendar.get_next_available_workday(new_planned_start_date_for_assignment.date())
+
+            # Calculate the planned end time using the work calendar
+            end_date = calendar.add_working_hours(start_date, float(assignment.effort_estimation or 0) * 8)
 
         assignment.planned_start_time = start_date
         assignment.planned_end_time = end_date
         assignment.need_update = False
-        assignment.save(update_fields=['planned_start_time', 'planned_end_time', 'need_update'])
+        with phase('write', assignment.team_member_id):
+            assignment.save(update_fields=['planned_start_time', 'planned_end_time', 'need_update'])
         logger.info(
             f'Recalculated schedule for assignment {assignment}, estimation is {assignment.effort_estimation} new start_date is {start_date}, new end_date is {end_date}')
 
     @staticmethod
     def reschedule_team_member(team_member):
         """Reschedule all assignments for a specific team member considering dependency order."""
-        Assignment.objects.filter(team_member=team_member,
-                                  task__level=1,
-                                  actual_start_time__isnull=True,
-                                  actual_end_time__isnull=True).update(need_update=True)
-
-        assignments = Assignment.objects.filter(
-            team_member=team_member,
-            task__level=1,
-            actual_start_time__isnull=True,
-            actual_end_time__isnull=True,
-            effort_estimation__isnull=False
-        ).select_related('task').order_by('task__level', 'task__priority', 'task__created_at')
+        with ScheduleService.lock_team_members([team_member.pk]):
+            with phase('load', team_member):
+                Assignment.objects.filter(team_member=team_member,
+                                          task__level=1,
+                                          actual_start_time__isnull=True,
+                                          actual_end_time__isnull=True).update(need_update=True)
+
+                assignments = list(Assignment.objects.filter(
+                    team_member=team_member,
+                    task__level=1,
+                    actual_start_time__isnull=True,
+                    actual_end_time__isnull=True,
+                    effort_estimation__isnull=False
+                ).select_related('task').order_by('task__level', 'task__priority', 'task__created_at'))
+
+            with phase('calendar', team_member):
+                # Every assignment starts no earlier than now, so one snapshot from today covers the whole queue
+                calendar = WorkCalendar.snapshot(team_member, timezone.now().date())
+            for assignment in assignments:
+                ScheduleService.recalculate_assignment_schedule(assignment, calendar)
+                logger.info(f'recalculate_assignment_schedule for {assignment} done')
+
+    @staticmethod
+    def reschedule_team_member_batch(team_member, engine: BusinessHoursEngine = None, incremental=False):
+        """Reschedule all assignments for a specific team member in a single pass.
+
+        Plans the same way as reschedule_team_member, but loads the queue and the current max planned/actual
+        end times once, chains start/end times in memory and writes the changed rows with one bulk update.
+        With incremental=True only the tail of the queue starting at the first assignment flagged with
+        need_update (or not planned yet) is recomputed, continuing from the planned end of the untouched part.
+        """
+        with ScheduleService.lock_team_members([team_member.pk]):
+            now = timezone.now()
+            member_assignments = Assignment.objects.filter(team_member=team_member)
+
+            with phase('load', team_member):
+                # Queued assignments without an estimate can't be planned and stay flagged, as in the
+                # per-assignment path
+                member_assignments.filter(QUEUE_FILTER, effort_estimation__isnull=True, need_update=False).update(
+                    need_update=True)
+
+                assignments = list(member_assignments.filter(
+                    QUEUE_FILTER,
+                    effort_estimation__isnull=False
+                ).select_related('task').order_by(*QUEUE_ORDERING))
+
+            with phase('aggregates', team_member):
+                end_times = member_assignments.aggregate(
+                    max_planned_end_time=Max('planned_end_time', filter=Q(need_update=False) & ~QUEUE_FILTER),
+                    max_actual_end_time=Max('actual_end_time'))
+
+            max_planned_end_time = end_times['max_planned_end_time']
+            if incremental:
+                first_dirty = next((position for position, assignment in enumerate(assignments) if
+                                    assignment.need_update or assignment.planned_end_time is None), len(assignments))
+                max_planned_end_time = max(
+                    [end_time for end_time in [max_planned_end_time] + [
+                        assignment.planned_end_time for assignment in assignments[:first_dirty]] if
+                     end_time is not None], default=None)
+                assignments = assignments[first_dirty:]
+
+            changed_assignments = []
+            with phase('calendar', team_member):
+                if assignments and engine is None:
+                    engine = BusinessHoursEngine.load([team_member], now.date())
+
+                for assignment in assignments:
+                    new_planned_start_date_for_assignment = max(
+                        [end_time for end_time in [end_times['max_actual_end_time'], max_planned_end_time, now] if
+                         end_time is not None])
+
+                    start_date = engine.get_next_available_workday(team_member,
+                                                                   new_planned_start_date_for_assignment.date())
+                    end_date = engine.calendar(team_member).add_working_hours(
+                        start_date, float(assignment.effort_estimation) * 8)
+                    max_planned_end_time = end_date if max_planned_end_time is None else max(max_planned_end_time,
+                                                                                             end_date)
+
+                    if (assignment.planned_start_time, assignment.planned_end_time, assignment.need_update) != (
+                            start_date, end_date, False):
+                        assignment.planned_start_time = start_date
+                        assignment.planned_end_time = end_date
+                        assignment.need_update = False
+                        changed_assignments.append(assignment)
+
+            if changed_assignments:
+                with phase('write', team_member):
+                    bulk_update_with_history(changed_assignments, Assignment, SCHEDULE_FIELDS)
+                    TaskRollups.update_ancestor_paths({assignment.task_id for assignment in changed_assignments})
+            logger.info(f'Rescheduled {len(changed_assignments)} changed assignments for {team_member}')
+
+    @staticmethod
+    def mark_for_update(team_member_ids=None, assignment_ids=None, from_date=None):
+        """Flag the affected tail of team members' queues with need_update, for incremental rescheduling.
+
+        The tail of a member's queue starts at the first queued assignment that is in assignment_ids, or that
+        ends on or after from_date or isn't planned yet, and runs to the end of the queue. Without
+        assignment_ids and from_date the whole queue is flagged.
+        """
+        queue = Assignment.objects.filter(QUEUE_FILTER, effort_estimation__isnull=False)
+        if team_member_ids is not None:
+            queue = queue.filter(team_member_id__in=team_member_ids)
+        assignment_ids = set(assignment_ids or ())
+        mark_all = not assignment_ids and from_date is None
+
+        affected_team_member_ids = set()
+        dirty_assignment_ids = []
+        for assignment_id, team_member_id, planned_end_time in queue.order_by(*QUEUE_ORDERING).values_list(
+                'pk', 'team_member_id', 'planned_end_time'):
+            if team_member_id not in affected_team_member_ids:
+                affected = mark_all or assignment_id in assignment_ids or from_date is not None and (
+                        planned_end_time is None or timezone.localtime(planned_end_time).date() >= from_date)
+                if not affected:
+                    continue
+                affected_team_member_ids.add(team_member_id)
+            dirty_assignment_ids.append(assignment_id)
+
+        return Assignment.objects.filter(pk__in=dirty_assignment_ids, need_update=False).update(need_update=True)
+
+    @staticmethod
+    def reschedule_team_members(team_members, workers=1, incremental=False):
+        """Batch-reschedule several team members, sharing one calendar engine loaded for all of them.
+
+        Without cross-member dependencies every member's timeline is independent, so with workers > 1 the
+        members are spread over a thread pool; each thread uses its own database connection.
+        Returns [(team_member, seconds)] in the order the members were given.
+        """
+        team_members = list(team_members)
+        with phase('calendar'):
+            engine = BusinessHoursEngine.load(team_members, timezone.now().date())
+
+        def reschedule(team_member):
+            started = time.perf_counter()
+            ScheduleService.reschedule_team_member_batch(team_member, engine, incremental=incremental)
+            return team_member, time.perf_counter() - started
+
+        if workers <= 1:
+            return [reschedule(team_member) for team_member in team_members]
+
+        def reschedule_in_worker(team_member):
+            try:
+                return reschedule(team_member)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(reschedule_in_worker, team_members))
+
+    @staticmethod
+    def plan_with_dependencies(assignments, predecessors, available_from, finished_at, engine, now, trace=None,
+                               reuse=None):
+        """Plan queued assignments of all team members in dependency order, in memory.
+
+        `assignments` are queued assignments with their task loaded, `available_from` maps a team member id
+        to the time the member is free, and `finished_at` maps a task id to the end of its work that is not
+        being replanned. Each assignment starts no earlier than its member is free and than the working day
+        after its predecessors' planned end.
+        If `trace` is given it is filled with {assignment id: (start day, planned start, planned end)}. Passing
+        the trace of an earlier run as `reuse` skips the calendar work for assignments that start on the same
+        day again, so it must only contain assignments whose estimate and member calendar are unchanged.
+        Returns {assignment id: (planned start, planned end)}.
+        """
+        tzinfo = timezone.get_current_timezone()
+        available_from = dict(available_from)
+        finished_at = dict(finished_at)
+        assignments_by_task = defaultdict(list)
         for assignment in assignments:
-            ScheduleService.recalculate_assignment_schedule(assignment)
-            logger.info(f'recalculate_assignment_schedule for {assignment} done')
+            assignments_by_task[assignment.task_id].append(assignment)
+
+        tasks = [task_assignments[0].task for task_assignments in assignments_by_task.values()]
+        plan = {}
+        for task in ScheduleService.order_by_dependencies(tasks, predecessors):
+            predecessor_end_times = [finished_at[predecessor_id] for predecessor_id in predecessors.get(task.pk, ())
+                                     if finished_at.get(predecessor_id) is not None]
+            not_before = max(predecessor_end_times).astimezone(tzinfo).date() + timedelta(
+                days=1) if predecessor_end_times else None
+
+            for assignment in assignments_by_task[task.pk]:
+                member_available_from = max(
+                    [end_time for end_time in [available_from.get(assignment.team_member_id), now] if
+                     end_time is not None])
+                start_day = member_available_from.date()
+                if not_before is not None and not_before > start_day:
+                    start_day = not_before
+
+                previous = reuse.get(assignment.pk) if reuse is not None else None
+                if previous is not None and previous[0] == start_day:
+                    start_date, end_date = previous[1:]
+                else:
+                    start_date = engine.get_next_available_workday(assignment.team_member_id, start_day)
+                    end_date = engine.calendar(assignment.team_member_id).add_working_hours(
+                        start_date, float(assignment.effort_estimation) * 8)
+                if trace is not None:
+                    trace[assignment.pk] = (start_day, start_date, end_date)
+
+                available_from[assignment.team_member_id] = max(member_available_from, end_date)
+                finished_at[task.pk] = max(
+                    [end_time for end_time in [finished_at.get(task.pk), end_date] if end_time is not None])
+                plan[assignment.pk] = (start_date, end_date)
+
+        return plan
+
+    @staticmethod
+    def reschedule_with_dependencies():
+        """Reschedule the queues of all team members together, respecting task predecessors.
+
+        Loads the queue, each member's current max planned/actual end times, the predecessor graph and the
+        end of the predecessor work that isn't replanned with one query each, then writes the changed rows.
+        """
+        queued_team_member_ids = Assignment.objects.filter(QUEUE_FILTER).values_list('team_member', flat=True)
+        with ScheduleService.lock_team_members(queued_team_member_ids.distinct()):
+            now = timezone.now()
+            with phase('load'):
+                Assignment.objects.filter(QUEUE_FILTER, effort_estimation__isnull=True, need_update=False).update(
+                    need_update=True)
+
+                assignments = list(Assignment.objects.filter(
+                    QUEUE_FILTER,
+                    effort_estimation__isnull=False
+                ).select_related('task').order_by('pk'))
+                predecessors = ScheduleService.load_predecessors()
+
+            with phase('aggregates'):
+                available_from = {}
+                for row in Assignment.objects.values('team_member').annotate(
+                        max_planned_end_time=Max('planned_end_time', filter=Q(need_update=False) & ~QUEUE_FILTER),
+                        max_actual_end_time=Max('actual_end_time')).order_by():
+                    end_times = [row['max_planned_end_time'], row['max_actual_end_time']]
+                    if any(end_time is not None for end_time in end_times):
+                        available_from[row['team_member']] = max(
+                            end_time for end_time in end_times if end_time is not None)
+
+                predecessor_ids = {predecessor_id for task_predecessors in predecessors.values()
+                                   for predecessor_id in task_predecessors}
+                finished_at = dict(Assignment.objects.filter(task_id__in=predecessor_ids).exclude(
+                    QUEUE_FILTER, effort_estimation__isnull=False
+                ).values('task').annotate(end_time=Max(Coalesce('actual_end_time', 'planned_end_time'))).order_by(
+                ).values_list('task', 'end_time'))
+
+            with phase('calendar'):
+                team_member_ids = {assignment.team_member_id for assignment in assignments}
+                engine = BusinessHoursEngine.load(team_member_ids, now.date())
+                plan = ScheduleService.plan_with_dependencies(assignments, predecessors, available_from,
+                                                              finished_at, engine, now)
+
+            changed_assignments = []
+            for assignment in assignments:
+                start_date, end_date = plan[assignment.pk]
+                if (assignment.planned_start_time, assignment.planned_end_time, assignment.need_update) != (
+                        start_date, end_date, False):
+                    assignment.planned_start_time = start_date
+                    assignment.planned_end_time = end_date
+                    assignment.need_update = False
+                    changed_assignments.append(assignment)
+
+            if changed_assignments:
+                with phase('write'):
+                    bulk_update_with_history(changed_assignments, Assignment, SCHEDULE_FIELDS)
+                    TaskRollups.update_ancestor_paths({assignment.task_id for assignment in changed_assignments})
+            logger.info(f'Rescheduled {len(changed_assignments)} changed assignments in dependency order')
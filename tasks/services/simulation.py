@@ -0,0 +1,255 @@
+import copy
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Max, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from tasks.models import Assignment, TeamMember
+from tasks.services.business_hours import BusinessHoursEngine
+from tasks.services.scheduling_service import QUEUE_FILTER, ScheduleService
+
+
+class InvalidEdit(ValueError):
+    """Raised when a hypothetical edit has a bad value or refers to something the snapshot doesn't have."""
+
+
+class ChangeEstimate:
+    """Give a queued assignment a different effort estimation (in man days)."""
+
+    def __init__(self, assignment_id, effort_estimation):
+        self.assignment_id = assignment_id
+        self.effort_estimation = Decimal(str(effort_estimation))
+        if self.effort_estimation < 0:
+            raise InvalidEdit(f'Effort estimation {effort_estimation} of assignment {assignment_id} is negative.')
+
+    def apply(self, scenario):
+        scenario.assignment(self.assignment_id).effort_estimation = self.effort_estimation
+        scenario.replanned_assignment_ids.add(self.assignment_id)
+
+
+class ChangePriority:
+    """Give a task a different priority within its level."""
+
+    def __init__(self, task_id, priority):
+        self.task_id = task_id
+        self.priority = priority
+
+    def apply(self, scenario):
+        scenario.task(self.task_id).priority = self.priority
+
+
+class Reassign:
+    """Move a queued assignment to another team member."""
+
+    def __init__(self, assignment_id, team_member_id):
+        self.assignment_id = assignment_id
+        self.team_member_id = team_member_id
+
+    def apply(self, scenario):
+        scenario.check_team_member(self.team_member_id)
+        scenario.assignment(self.assignment_id).team_member_id = self.team_member_id
+        scenario.replanned_assignment_ids.add(self.assignment_id)
+
+
+class AddLeave:
+    """Put a team member on leave from start_date to end_date, both inclusive."""
+
+    def __init__(self, team_member_id, start_date, end_date=None):
+        self.team_member_id = team_member_id
+        self.start_date = start_date
+        self.end_date = end_date or start_date
+        if self.end_date < self.start_date:
+            raise InvalidEdit(f'Leave of team member {team_member_id} ends on {self.end_date}, '
+                              f'before it starts on {self.start_date}.')
+
+    def apply(self, scenario):
+        entries = scenario.calendar_entries(self.team_member_id)
+        date = self.start_date
+        while date <= self.end_date:
+            entries[date] = ('leave', None)
+            date += timedelta(days=1)
+
+
+class AddOvertime:
+    """Let a team member work on a day, hours_worked hours (8 by default)."""
+
+    def __init__(self, team_member_id, date, hours_worked=None):
+        self.team_member_id = team_member_id
+        self.date = date
+        self.hours_worked = hours_worked
+
+    def apply(self, scenario):
+        scenario.calendar_entries(self.team_member_id)[self.date] = ('overtime', self.hours_worked)
+
+
+class AddHoliday:
+    """Add a public holiday."""
+
+    def __init__(self, date):
+        self.date = date
+
+    def apply(self, scenario):
+        scenario.holidays().add(self.date)
+
+
+class AddPredecessor:
+    """Make predecessor_id a predecessor of task_id."""
+
+    def __init__(self, task_id, predecessor_id):
+        self.task_id = task_id
+        self.predecessor_id = predecessor_id
+
+    def apply(self, scenario):
+        scenario.task_predecessors(self.task_id).append(self.predecessor_id)
+
+
+class RemovePredecessor:
+    """Drop predecessor_id from the predecessors of task_id."""
+
+    def __init__(self, task_id, predecessor_id):
+        self.task_id = task_id
+        self.predecessor_id = predecessor_id
+
+    def apply(self, scenario):
+        predecessors = scenario.task_predecessors(self.task_id)
+        if self.predecessor_id in predecessors:
+            predecessors.remove(self.predecessor_id)
+
+
+class Scenario:
+    """Copy-on-write view of a ScheduleSnapshot that hypothetical edits are applied to."""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.assignments = {assignment.pk: assignment for assignment in snapshot.assignments}
+        self.tasks = {}
+        self.predecessors = snapshot.predecessors
+        self.entries = {}
+        self.changed_holidays = None
+        # Assignments whose plan can't be taken over from the baseline even if they start on the same day
+        self.replanned_assignment_ids = set()
+
+    def assignment(self, assignment_id):
+        if assignment_id not in self.assignments:
+            raise InvalidEdit(f'Assignment {assignment_id} is not queued with an effort estimation.')
+        assignment = self.assignments[assignment_id]
+        if assignment is self.snapshot.assignments_by_id[assignment_id]:
+            assignment = self.assignments[assignment_id] = copy.copy(assignment)
+        return assignment
+
+    def task(self, task_id):
+        if task_id not in self.snapshot.tasks:
+            raise InvalidEdit(f'Task {task_id} has no queued assignment.')
+        if task_id not in self.tasks:
+            self.tasks[task_id] = copy.copy(self.snapshot.tasks[task_id])
+            for assignment_id in self.snapshot.assignment_ids_by_task[task_id]:
+                self.assignment(assignment_id).task = self.tasks[task_id]
+        return self.tasks[task_id]
+
+    def task_predecessors(self, task_id):
+        if self.predecessors is self.snapshot.predecessors:
+            self.predecessors = dict(self.predecessors)
+        if self.predecessors.get(task_id) is self.snapshot.predecessors.get(task_id):
+            self.predecessors[task_id] = list(self.predecessors.get(task_id, ()))
+        return self.predecessors[task_id]
+
+    def check_team_member(self, team_member_id):
+        if team_member_id not in self.snapshot.engine.entries:
+            raise InvalidEdit(f'Team member {team_member_id} does not exist.')
+
+    def calendar_entries(self, team_member_id):
+        self.check_team_member(team_member_id)
+        if team_member_id not in self.entries:
+            self.entries[team_member_id] = dict(self.snapshot.engine.entries.get(team_member_id, {}))
+        return self.entries[team_member_id]
+
+    def holidays(self):
+        if self.changed_holidays is None:
+            self.changed_holidays = set(self.snapshot.engine.holidays)
+        return self.changed_holidays
+
+    def plan(self):
+        engine = self.snapshot.engine.with_changes(self.entries, self.changed_holidays)
+        reuse = None
+        if self.changed_holidays is None:
+            reuse = {assignment_id: step for assignment_id, step in self.snapshot.trace.items()
+                     if assignment_id not in self.replanned_assignment_ids
+                     and self.assignments[assignment_id].team_member_id not in self.entries}
+        return self.snapshot.plan(list(self.assignments.values()), self.predecessors, engine, reuse=reuse)
+
+
+class ScheduleSnapshot:
+    """Everything the scheduler reads, loaded once, to try out hypothetical edits without touching the database.
+
+    The queue, the time each member is free, the predecessor graph, the end of predecessor work that isn't
+    replanned and every member's calendar are loaded with a fixed number of queries. simulate() then plans
+    a scenario in memory and returns how its planned start/end times differ from the unchanged plan.
+    """
+
+    def __init__(self, respect_dependencies=True):
+        self.respect_dependencies = respect_dependencies
+        self.now = timezone.now()
+
+        self.assignments = list(Assignment.objects.filter(
+            QUEUE_FILTER,
+            effort_estimation__isnull=False
+        ).select_related('task').order_by('pk'))
+        self.assignments_by_id = {assignment.pk: assignment for assignment in self.assignments}
+        self.tasks = {assignment.task_id: assignment.task for assignment in self.assignments}
+        self.assignment_ids_by_task = {}
+        for assignment in self.assignments:
+            self.assignment_ids_by_task.setdefault(assignment.task_id, []).append(assignment.pk)
+
+        self.available_from = {}
+        for row in Assignment.objects.values('team_member').annotate(
+                max_planned_end_time=Max('planned_end_time', filter=Q(need_update=False) & ~QUEUE_FILTER),
+                max_actual_end_time=Max('actual_end_time')).order_by():
+            end_times = [end_time for end_time in [row['max_planned_end_time'], row['max_actual_end_time']]
+                         if end_time is not None]
+            if end_times:
+                self.available_from[row['team_member']] = max(end_times)
+
+        self.predecessors = dict(ScheduleService.load_predecessors())
+        self.finished_at = dict(Assignment.objects.exclude(
+            QUEUE_FILTER, effort_estimation__isnull=False
+        ).values('task').annotate(end_time=Max(Coalesce('actual_end_time', 'planned_end_time'))).order_by(
+        ).values_list('task', 'end_time'))
+
+        # All members, so that assignments can be moved to someone without queued work
+        self.engine = BusinessHoursEngine.load(TeamMember.objects.values_list('pk', flat=True), self.now.date())
+        self.trace = {}
+        self.baseline = self.plan(self.assignments, self.predecessors, self.engine, trace=self.trace)
+
+    def plan(self, assignments, predecessors, engine, trace=None, reuse=None):
+        if not self.respect_dependencies:
+            predecessors = {}
+        return ScheduleService.plan_with_dependencies(assignments, predecessors, self.available_from,
+                                                      self.finished_at, engine, self.now, trace, reuse)
+
+    def simulate(self, edits):
+        """Plan the schedule with the given edits applied and return the assignments whose plan moved.
+
+        Returns a list of dicts with the assignment id and its planned start/end before and after the edits.
+        Raises InvalidEdit before planning if an edit refers to an assignment or task that isn't queued, or
+        to an unknown team member.
+        """
+        scenario = Scenario(self)
+        for edit in edits:
+            edit.apply(scenario)
+        plan = scenario.plan()
+
+        changes = []
+        for assignment_id, (planned_start_time, planned_end_time) in plan.items():
+            baseline_start_time, baseline_end_time = self.baseline[assignment_id]
+            if (planned_start_time, planned_end_time) != (baseline_start_time, baseline_end_time):
+                changes.append({
+                    'assignment_id': assignment_id,
+                    'team_member_id': scenario.assignments[assignment_id].team_member_id,
+                    'planned_start_time_before': baseline_start_time,
+                    'planned_end_time_before': baseline_end_time,
+                    'planned_start_time_after': planned_start_time,
+                    'planned_end_time_after': planned_end_time,
+                })
+        return changes
@@ -0,0 +1,100 @@
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from tasks.models import Assignment, Task
+
+TASK_TABLE = Task._meta.db_table
+ASSIGNMENT_TABLE = Assignment._meta.db_table
+
+# (root_id, task_id) for every task in the subtrees of the given roots, roots included.
+# UNION rather than UNION ALL, so a parent_task cycle in bad data ends the recursion instead of looping.
+SUBTREE_CTE = f"""
+    subtree(root_id, task_id) AS (
+        SELECT id, id FROM {TASK_TABLE} WHERE id = ANY(%s)
+        UNION
+        SELECT subtree.root_id, child.id
+        FROM {TASK_TABLE} child JOIN subtree ON child.parent_task_id = subtree.task_id
+    )"""
+
+ANCESTORS_CTE = f"""
+    ancestors(root_id, task_id) AS (
+        SELECT id, parent_task_id FROM {TASK_TABLE} WHERE id = ANY(%s) AND parent_task_id IS NOT NULL
+        UNION
+        SELECT ancestors.root_id, parent.parent_task_id
+        FROM {TASK_TABLE} parent JOIN ancestors ON parent.id = ancestors.task_id
+        WHERE parent.parent_task_id IS NOT NULL
+    )"""
+
+# Effort of a subtree is the effort of its leaf tasks: the estimates of a parent task's own assignments
+# are not counted, as in the original recursive Task.total_effort_estimation.
+LEAF_EFFORT = f"""
+    SELECT subtree.root_id, SUM(assignment.effort_estimation)
+    FROM subtree
+    LEFT JOIN {ASSIGNMENT_TABLE} assignment ON assignment.task_id = subtree.task_id
+    WHERE NOT EXISTS (SELECT 1 FROM {TASK_TABLE} child WHERE child.parent_task_id = subtree.task_id)
+    GROUP BY subtree.root_id"""
+
+
+def task_ids(tasks):
+    return [getattr(task, 'pk', task) for task in tasks]
+
+
+class TaskHierarchy:
+    """Queries over the parent_task tree that cost one recursive CTE query, however deep the tree is.
+
+    Every method takes a list of tasks (instances or ids), so a whole page of tasks is answered at once.
+    """
+
+    @staticmethod
+    def descendants(tasks, include_self=False):
+        """All tasks below the given tasks, as a Task queryset."""
+        queryset = Task.objects.filter(pk__in=RawSQL(
+            f'WITH RECURSIVE {SUBTREE_CTE} SELECT task_id FROM subtree', [task_ids(tasks)]))
+        if not include_self:
+            queryset = queryset.exclude(pk__in=task_ids(tasks))
+        return queryset
+
+    @staticmethod
+    def ancestors(tasks, include_self=False):
+        """All tasks above the given tasks, up to the top level, as a Task queryset."""
+        queryset = Task.objects.filter(pk__in=RawSQL(
+            f'WITH RECURSIVE {ANCESTORS_CTE} SELECT task_id FROM ancestors', [task_ids(tasks)]))
+        if include_self:
+            queryset = queryset | Task.objects.filter(pk__in=task_ids(tasks))
+        return queryset
+
+    @staticmethod
+    def ancestor_ids(tasks):
+        """{task id: [ancestor ids]} for the given tasks, nearest ancestor first."""
+        ids = task_ids(tasks)
+        ancestors = {task_id: [] for task_id in ids}
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH RECURSIVE ancestors(root_id, task_id, depth, path) AS (
+                    SELECT id, parent_task_id, 1, ARRAY[id, parent_task_id]
+                    FROM {TASK_TABLE} WHERE id = ANY(%s) AND parent_task_id IS NOT NULL
+                    UNION ALL
+                    SELECT ancestors.root_id, parent.parent_task_id, ancestors.depth + 1,
+                           ancestors.path || parent.parent_task_id
+                    FROM {TASK_TABLE} parent JOIN ancestors ON parent.id = ancestors.task_id
+                    WHERE parent.parent_task_id IS NOT NULL AND NOT parent.parent_task_id = ANY(ancestors.path)
+                )
+                SELECT root_id, task_id FROM ancestors ORDER BY root_id, depth""", [ids])
+            for root_id, task_id in cursor.fetchall():
+                ancestors[root_id].append(task_id)
+        return ancestors
+
+    @staticmethod
+    def subtree_effort(tasks):
+        """{task id: total effort estimation of the task's subtree}, with the Task.total_effort_estimation value.
+
+        Tasks whose leaves have no estimated assignment get 0, the others the Decimal sum of the estimates.
+        """
+        ids = task_ids(tasks)
+        effort = dict.fromkeys(ids, 0)
+        with connection.cursor() as cursor:
+            cursor.execute(f'WITH RECURSIVE {SUBTREE_CTE} {LEAF_EFFORT}', [ids])
+            for task_id, total in cursor.fetchall():
+                if total is not None:
+                    effort[task_id] = total
+        return effort
@@ -0,0 +1,129 @@
+from django.db import connection
+
+from tasks.models import Task
+from tasks.services.task_hierarchy import ASSIGNMENT_TABLE, TASK_TABLE, TaskHierarchy, task_ids
+
+ROLLUP_FIELDS = ['subtree_effort_estimation', 'subtree_completed_effort', 'earliest_planned_start_time',
+                 'latest_planned_end_time', 'percent_completed']
+
+# Rollups computed from scratch over each root's whole subtree. Effort only counts leaf tasks, like
+# Task.total_effort_estimation; planned times come from every assignment in the subtree.
+LIVE_ROLLUPS = f"""
+    WITH RECURSIVE subtree(root_id, task_id) AS (
+        SELECT id, id FROM {TASK_TABLE} {{roots}}
+        UNION
+        SELECT subtree.root_id, child.id
+        FROM {TASK_TABLE} child JOIN subtree ON child.parent_task_id = subtree.task_id
+    ), nodes AS (
+        SELECT root_id, task_id,
+               NOT EXISTS (
+                   SELECT 1 FROM {TASK_TABLE} child WHERE child.parent_task_id = subtree.task_id
+               ) AS is_leaf
+        FROM subtree
+    ), totals AS (
+        SELECT nodes.root_id,
+               COALESCE(SUM(assignment.effort_estimation) FILTER (WHERE nodes.is_leaf), 0) AS effort,
+               COALESCE(SUM(assignment.effort_estimation) FILTER (
+                   WHERE nodes.is_leaf AND assignment.actual_end_time IS NOT NULL), 0) AS completed,
+               MIN(assignment.planned_start_time) AS earliest,
+               MAX(assignment.planned_end_time) AS latest
+        FROM nodes LEFT JOIN {ASSIGNMENT_TABLE} assignment ON assignment.task_id = nodes.task_id
+        GROUP BY nodes.root_id
+    )
+    SELECT root_id, effort, completed, earliest, latest, ROUND(100 * completed / NULLIF(effort, 0), 2)
+    FROM totals"""
+
+# Rollups of the given tasks from their own assignments and the stored rollups of their children,
+# so children must be up to date first
+NODE_ROLLUPS = f"""
+    SELECT target.id, rollup.effort, rollup.completed, rollup.earliest, rollup.latest,
+           ROUND(100 * rollup.completed / NULLIF(rollup.effort, 0), 2)
+    FROM {TASK_TABLE} target
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS count,
+               SUM(child.subtree_effort_estimation) AS effort,
+               SUM(child.subtree_completed_effort) AS completed,
+               MIN(child.earliest_planned_start_time) AS earliest,
+               MAX(child.latest_planned_end_time) AS latest
+        FROM {TASK_TABLE} child WHERE child.parent_task_id = target.id
+    ) children
+    CROSS JOIN LATERAL (
+        SELECT COALESCE(SUM(effort_estimation), 0) AS effort,
+               COALESCE(SUM(effort_estimation) FILTER (WHERE actual_end_time IS NOT NULL), 0) AS completed,
+               MIN(planned_start_time) AS earliest,
+               MAX(planned_end_time) AS latest
+        FROM {ASSIGNMENT_TABLE} WHERE task_id = target.id
+    ) own
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN children.count > 0 THEN children.effort ELSE own.effort END AS effort,
+               CASE WHEN children.count > 0 THEN children.completed ELSE own.completed END AS completed,
+               LEAST(children.earliest, own.earliest) AS earliest,
+               GREATEST(children.latest, own.latest) AS latest
+    ) rollup
+    WHERE target.id = ANY(%s)"""
+
+UPDATE_ROLLUPS = f"""
+    UPDATE {TASK_TABLE} task SET
+        subtree_effort_estimation = rollup.effort,
+        subtree_completed_effort = rollup.completed,
+        earliest_planned_start_time = rollup.earliest,
+        latest_planned_end_time = rollup.latest,
+        percent_completed = rollup.percent
+    FROM ({{rollups}}) AS rollup(id, effort, completed, earliest, latest, percent)
+    WHERE task.id = rollup.id"""
+
+
+class TaskRollups:
+    """Maintains the denormalized subtree rollups stored on Task (see ROLLUP_FIELDS).
+
+    Changes are applied along the ancestor path of the changed tasks, one UPDATE per tree level, each node
+    combining its own assignments with its children's stored rollups; rebuild() recomputes every task from
+    scratch with the same formulas.
+    """
+
+    @staticmethod
+    def live(tasks=None):
+        """{task id: (effort, completed effort, earliest planned start, latest planned end, percent completed)}
+        computed from the assignments, for the given tasks or all of them, with one query.
+        """
+        sql, params = LIVE_ROLLUPS.format(roots=''), []
+        if tasks is not None:
+            sql, params = LIVE_ROLLUPS.format(roots='WHERE id = ANY(%s)'), [task_ids(tasks)]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return {row[0]: row[1:] for row in cursor.fetchall()}
+
+    @staticmethod
+    def stored(tasks=None):
+        queryset = Task.objects.all() if tasks is None else Task.objects.filter(pk__in=task_ids(tasks))
+        return {row[0]: row[1:] for row in queryset.values_list('pk', *ROLLUP_FIELDS)}
+
+    @staticmethod
+    def rebuild():
+        """Recompute the rollups of all tasks from scratch; returns the number of tasks updated."""
+        with connection.cursor() as cursor:
+            cursor.execute(UPDATE_ROLLUPS.format(rollups=LIVE_ROLLUPS.format(roots='')))
+            return cursor.rowcount
+
+    @staticmethod
+    def check():
+        """Ids of the tasks whose stored rollups differ from the ones computed from scratch."""
+        live, stored = TaskRollups.live(), TaskRollups.stored()
+        return sorted(task_id for task_id, rollups in live.items() if tuple(stored.get(task_id, ())) != rollups)
+
+    @staticmethod
+    def update_ancestor_paths(tasks):
+        """Refresh the rollups of the given tasks and all their ancestors, deepest level first."""
+        tasks = [task for task in task_ids(tasks) if task is not None]
+        if not tasks:
+            return
+
+        depths = {}
+        for task_id, ancestor_ids in TaskHierarchy.ancestor_ids(tasks).items():
+            for height, node_id in enumerate([task_id] + ancestor_ids):
+                depths[node_id] = max(depths.get(node_id, 0), len(ancestor_ids) - height)
+
+        with connection.cursor() as cursor:
+            for depth in sorted(set(depths.values()), reverse=True):
+                cursor.execute(UPDATE_ROLLUPS.format(rollups=NODE_ROLLUPS),
+                               [[node_id for node_id, node_depth in depths.items() if node_depth == depth]])
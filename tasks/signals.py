@@ -0,0 +1,117 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from tasks.models import Assignment, Holiday, Task, TaskPredecessor, WorkCalendar
+from tasks.services.scheduling_service import SCHEDULE_FIELDS, ScheduleService
+from tasks.services.task_rollups import TaskRollups
+
+
+def is_queued(assignment):
+    """Whether the assignment is planned by the scheduler (level-1, not started, estimated)."""
+    return (assignment.task.level == 1 and assignment.actual_start_time is None
+            and assignment.actual_end_time is None and assignment.effort_estimation is not None)
+
+
+@receiver(pre_save, sender=Assignment)
+@receiver(pre_save, sender=WorkCalendar)
+def remember_previous_team_member(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Remember the team member of an assignment or calendar entry, with its planned start or date, before it
+    is edited, to flag the previous member's queue too when it moves."""
+    fields = ['team_member', 'planned_start_time' if sender is Assignment else 'date']
+    instance._previous_schedule = None
+    if raw or instance.pk is None or update_fields is not None and not {'team_member', 'team_member_id',
+                                                                        'date'} & set(update_fields):
+        return
+    instance._previous_schedule = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+
+
+@receiver(post_save, sender=Assignment)
+def assignment_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Saves made by the scheduler itself only write the plan
+    if raw or update_fields is not None and set(update_fields) <= set(SCHEDULE_FIELDS):
+        return
+
+    if is_queued(instance):
+        ScheduleService.mark_for_update([instance.team_member_id], assignment_ids=[instance.pk])
+    else:
+        # Started or finished work moves the time the member is free, which affects the whole queue
+        ScheduleService.mark_for_update([instance.team_member_id])
+
+    previous = getattr(instance, '_previous_schedule', None)
+    if previous is not None and previous[0] != instance.team_member_id:
+        # The previous member's queue moves up from where the assignment was planned, or entirely
+        previous_team_member_id, previous_planned_start_time = previous
+        ScheduleService.mark_for_update([previous_team_member_id], from_date=previous_planned_start_time and
+                                        timezone.localtime(previous_planned_start_time).date())
+
+
+@receiver(post_delete, sender=Assignment)
+def assignment_deleted(sender, instance, **kwargs):
+    if instance.planned_start_time is not None and is_queued(instance):
+        ScheduleService.mark_for_update([instance.team_member_id],
+                                        from_date=timezone.localtime(instance.planned_start_time).date())
+    else:
+        ScheduleService.mark_for_update([instance.team_member_id])
+
+
+@receiver(post_save, sender=WorkCalendar)
+@receiver(post_delete, sender=WorkCalendar)
+def work_calendar_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    ScheduleService.mark_for_update([instance.team_member_id], from_date=instance.date)
+
+    previous = getattr(instance, '_previous_schedule', None)
+    if previous is not None and previous != (instance.team_member_id, instance.date):
+        # An entry moved to another day or member no longer applies to the old one
+        previous_team_member_id, previous_date = previous
+        ScheduleService.mark_for_update([previous_team_member_id], from_date=previous_date)
+
+
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+def holiday_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ScheduleService.mark_for_update(from_date=instance.date)
+
+
+@receiver(post_save, sender=TaskPredecessor)
+@receiver(post_delete, sender=TaskPredecessor)
+def task_predecessor_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        successor_assignments = Assignment.objects.filter(task_id=instance.from_task_id)
+        ScheduleService.mark_for_update(
+            set(successor_assignments.values_list('team_member_id', flat=True)),
+            assignment_ids=successor_assignments.values_list('pk', flat=True))
+
+
+@receiver(pre_save, sender=Assignment)
+@receiver(pre_save, sender=Task)
+def remember_previous_parent(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Remember the task of an assignment, or the parent of a task, before it moves, to refresh the old path."""
+    field = sender._meta.get_field('task' if sender is Assignment else 'parent_task')
+    instance._previous_parent_id = None
+    if raw or instance.pk is None or update_fields is not None and not {field.name, field.attname} & set(update_fields):
+        return
+    instance._previous_parent_id = sender.objects.filter(pk=instance.pk).values_list(field.attname, flat=True).first()
+
+
+@receiver(post_save, sender=Assignment)
+@receiver(post_delete, sender=Assignment)
+def assignment_rollups_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        TaskRollups.update_ancestor_paths({instance.task_id, getattr(instance, '_previous_parent_id', None)})
+
+
+@receiver(post_save, sender=Task)
+def task_saved(sender, instance, created, raw=False, **kwargs):
+    # save() writes the rollups the instance was loaded with, so they are recomputed along its path; a new
+    # sub-task or a task moved to another parent also changes the rollups of the previous parent's path
+    if not raw:
+        TaskRollups.update_ancestor_paths({instance.pk, getattr(instance, '_previous_parent_id', None)})
+
+
+@receiver(post_delete, sender=Task)
+def task_deleted(sender, instance, **kwargs):
+    TaskRollups.update_ancestor_paths([instance.parent_task_id])
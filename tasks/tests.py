@@ -1,3 +1,970 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from common_utils.db_code import compile_db_code
+from common_utils import db_code
+from tasks.models import Assignment, Holiday, RescheduleRequest, Task, TaskPredecessor, TeamMember, WorkCalendar
+from tasks.services.business_hours import BusinessHoursEngine
+from tasks.services.defect_ingest import (CSV_ENCODING, DEFECTS_TABLE, LOCK_NOT_AVAILABLE, SWAP_ATTEMPTS,
+                                          SwapTimeout, load_defects, quote_identifier)
+from tasks.services.scheduling_service import DependencyCycleError, ScheduleService
+from tasks.services.simulation import AddHoliday, AddLeave, ChangeEstimate, InvalidEdit, Reassign, ScheduleSnapshot
+
+# A Monday, far enough from today that the calendar fixtures don't depend on when the tests run
+MONDAY = date(2031, 3, 3)
+
+# The columns of the defect exports that all_veriii_defects was first created from
+DEFECT_COLUMNS = ['content', 'Executor', '问题类别', '系统名', '模块', 'Priority', 'Workflow Status', 'Creation Time',
+                  'complete time', 'Update Time', 'Start Date', 'Due Date']
+# The migrations that changed all_veriii_defects since
+DEFECT_MIGRATIONS = ['0018_auto_20250124_1442', '0023_defect_row_keys', '0024_defect_typed_columns']
+
+
+def create_team_member(username):
+    return TeamMember.objects.create(user=User.objects.create(username=username))
+
+
+def at(day, hour=9, minute=0):
+    return timezone.make_aware(datetime.combine(day, time(hour, minute)))
+
+
+class BusinessHoursEngineTest(TestCase):
+    """BusinessHoursEngine must answer exactly like WorkCalendar, which it replaces in the batch scheduler."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.team_member = create_team_member('alice')
+        cls.other_team_member = create_team_member('bob')
+        Holiday.objects.create(date=MONDAY + timedelta(days=2), name='Midweek holiday')
+        Holiday.objects.create(date=MONDAY + timedelta(days=14), name='Holiday worked as overtime')
+        for offset, status, hours_worked in [
+            (1, 'leave', None),  # Tuesday off
+            (5, 'overtime', Decimal('10')),  # Saturday with more hours than a normal day
+            (6, 'overtime', None),  # Sunday with the default hours
+            (8, 'overtime', Decimal('4.5')),  # a short weekday
+            (9, 'leave', Decimal('8')),  # leave, even with hours
+            (14, 'overtime', Decimal('6')),  # overrides the holiday
+            (20, 'overtime', Decimal('16')),  # long enough to carry the effort over midnight
+        ]:
+            WorkCalendar.objects.create(team_member=cls.team_member, date=MONDAY + timedelta(days=offset),
+                                        status=status, hours_worked=hours_worked)
+
+    def test_add_working_hours_matches_work_calendar(self):
+        engine = BusinessHoursEngine.load([self.team_member, self.other_team_member], MONDAY)
+        # A short horizon makes the engine grow its arrays on the way
+        engine.horizon = 10
+        questions = [(team_member, at(MONDAY + timedelta(days=offset), hour), hours)
+                     for team_member in [self.team_member, self.other_team_member]
+                     for offset in range(0, 28, 3)
+                     for hour in [0, 9, 13]
+                     for hours in [0, 2.25, 4, 8, 10, 12.5, 16, 40, 0.33 * 8, 18.4 * 8]]
+
+        team_members, start_dates, hours_to_add = zip(*questions)
+        end_dates = engine.add_working_hours(team_members, start_dates, hours_to_add)
+
+        for (team_member, start_date, hours), end_date in zip(questions, end_dates):
+            with self.subTest(team_member=team_member, start_date=start_date, hours=hours):
+                self.assertEqual(end_date, WorkCalendar.add_working_hours(team_member, start_date, hours))
+                self.assertEqual(engine.calendar(team_member).add_working_hours(start_date, hours), end_date)
+
+    def test_end_of_working_day(self):
+        engine = BusinessHoursEngine.load([self.team_member], MONDAY)
+        # A normal day ends at 17:00, an overtime day at 23:59
+        self.assertEqual(engine.add_working_hours([self.team_member], [at(MONDAY)], [8]), [at(MONDAY, 17)])
+        saturday = MONDAY + timedelta(days=5)
+        self.assertEqual(engine.add_working_hours([self.team_member], [at(saturday)], [9]), [at(saturday, 23, 59)])
+        # The Tuesday leave and the Wednesday holiday are skipped
+        self.assertEqual(engine.add_working_hours([self.team_member], [at(MONDAY)], [16]),
+                         [at(MONDAY + timedelta(days=3), 17)])
+
+    def test_get_next_available_workday_matches_work_calendar(self):
+        engine = BusinessHoursEngine.load([self.team_member, self.other_team_member], MONDAY)
+        for team_member in [self.team_member, self.other_team_member]:
+            for offset in range(28):
+                day = MONDAY + timedelta(days=offset)
+                with self.subTest(team_member=team_member, day=day):
+                    self.assertEqual(engine.get_next_available_workday(team_member, day),
+                                     WorkCalendar.get_next_available_workday(team_member, day))
+
+
+class BatchSchedulingTest(TestCase):
+    """reschedule_team_member_batch must plan exactly like the per-assignment reschedule_team_member."""
+
+    def setUp(self):
+        self.team_member = create_team_member('alice')
+        today = timezone.localdate()
+        Holiday.objects.create(date=today + timedelta(days=4), name='Holiday')
+        WorkCalendar.objects.create(team_member=self.team_member, date=today + timedelta(days=2), status='leave')
+        WorkCalendar.objects.create(team_member=self.team_member, date=today + timedelta(days=12),
+                                    status='overtime', hours_worked=Decimal('6'))
+
+        self.assignments = []
+        for number, (priority, effort_estimation) in enumerate(
+                [(3, '1.5'), (1, '0.5'), (2, '3'), (1, '2.25'), (5, None), (4, '0'), (2, '7')]):
+            task = Task.objects.create(task_name=f'Task {number}', priority=priority)
+            self.assignments.append(Assignment.objects.create(
+                task=task, team_member=self.team_member,
+                effort_estimation=None if effort_estimation is None else Decimal(effort_estimation)))
+
+        # Finished work that ends after today pushes the start of the queue back
+        finished_task = Task.objects.create(task_name='Finished task')
+        Assignment.objects.create(task=finished_task, team_member=self.team_member, effort_estimation=Decimal('1'),
+                                  actual_start_time=timezone.now() - timedelta(days=3),
+                                  actual_end_time=timezone.now() + timedelta(days=5))
+        # Sub-tasks are not planned by the scheduler
+        sub_task = Task.objects.create(task_name='Sub-task', level=2, parent_task=finished_task)
+        Assignment.objects.create(task=sub_task, team_member=self.team_member, effort_estimation=Decimal('1'))
+
+    def plans(self):
+        return {assignment.pk: (assignment.planned_start_time, assignment.planned_end_time, assignment.need_update)
+                for assignment in Assignment.objects.filter(team_member=self.team_member)}
+
+    def legacy_plans(self):
+        ScheduleService.reschedule_team_member(self.team_member)
+        plans = self.plans()
+        Assignment.objects.update(planned_start_time=None, planned_end_time=None, need_update=False)
+        return plans
+
+    def test_batch_matches_legacy(self):
+        expected = self.legacy_plans()
+        self.assertTrue(any(planned_end_time for _, planned_end_time, _ in expected.values()))
+
+        ScheduleService.reschedule_team_member_batch(self.team_member)
+
+        self.assertEqual(self.plans(), expected)
+
+    def test_incremental_matches_legacy(self):
+        ScheduleService.reschedule_team_member_batch(self.team_member)
+        # Saving through the ORM flags the tail of the queue from the changed assignment on (see tasks.signals)
+        changed = self.assignments[2]
+        changed.effort_estimation = Decimal('4.5')
+        changed.save()
+        self.assertTrue(Assignment.objects.filter(need_update=True, effort_estimation__isnull=False).exists())
+
+        ScheduleService.reschedule_team_member_batch(self.team_member, incremental=True)
+        incremental_plans = self.plans()
+
+        self.assertEqual(incremental_plans, self.legacy_plans())
+
+
+class ChangeEventTest(TestCase):
+    """Edits flag the queues they affect, so incremental rescheduling ends up with the full reschedule's plans."""
+
+    def setUp(self):
+        self.alice = create_team_member('alice')
+        self.bob = create_team_member('bob')
+        self.assignments = [
+            Assignment.objects.create(task=Task.objects.create(task_name=f'Task {number}', priority=number),
+                                      team_member=team_member, effort_estimation=Decimal('2'))
+            for number in range(4) for team_member in [self.alice, self.bob]]
+        ScheduleService.reschedule_team_members([self.alice, self.bob])
+
+    def plans(self):
+        return {assignment.pk: (assignment.planned_start_time, assignment.planned_end_time, assignment.need_update)
+                for assignment in Assignment.objects.all()}
+
+    def assert_incremental_matches_full(self):
+        ScheduleService.reschedule_team_members([self.alice, self.bob], incremental=True)
+        incremental_plans = self.plans()
+        ScheduleService.reschedule_team_members([self.alice, self.bob])
+        self.assertEqual(incremental_plans, self.plans())
+
+    def test_reassigned_assignment(self):
+        moved = self.assignments[0]
+        moved.team_member = self.bob
+        moved.save()
+
+        # The rest of alice's queue moves up
+        self.assertTrue(Assignment.objects.filter(team_member=self.alice, need_update=True).exists())
+        self.assert_incremental_matches_full()
+
+    def test_moved_work_calendar_entry(self):
+        planned_start = timezone.localtime(self.assignments[2].planned_start_time).date()
+        entry = WorkCalendar.objects.create(team_member=self.alice, date=planned_start, status='leave')
+        ScheduleService.reschedule_team_members([self.alice, self.bob], incremental=True)
+
+        entry.team_member = self.bob
+        entry.date = planned_start + timedelta(days=1)
+        entry.save()
+
+        # Alice gets her day back
+        self.assertTrue(Assignment.objects.filter(team_member=self.alice, need_update=True).exists())
+        self.assert_incremental_matches_full()
+
+    def test_admin_reassignment_reschedules_both_members(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        moved = self.assignments[0]
+        response = self.client.post(reverse('admin:tasks_assignment_change', args=[moved.pk]), {
+            'task': moved.task_id,
+            'team_member': self.bob.pk,
+            'effort_estimation': '2',
+            'notes': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(RescheduleRequest.objects.values_list('team_member', flat=True)),
+                         {self.alice.pk, self.bob.pk})
+
+        call_command('process_reschedule_queue', once=True, debounce=0)
+        drained_plans = self.plans()
+        ScheduleService.reschedule_team_members([self.alice, self.bob])
+
+        self.assertFalse(RescheduleRequest.objects.exists())
+        self.assertEqual(drained_plans, self.plans())
+
+
+class DependencySchedulingTest(TestCase):
+    """reschedule_with_dependencies starts work on a task only after the work on its predecessors."""
+
+    def setUp(self):
+        self.alice = create_team_member('alice')
+        self.bob = create_team_member('bob')
+        # The successors have the higher priority, so only the dependencies put them last
+        self.design = Task.objects.create(task_name='Design', priority=3)
+        self.build = Task.objects.create(task_name='Build', priority=1)
+        self.release = Task.objects.create(task_name='Release', priority=1)
+        self.depend(self.build, self.design)
+        self.depend(self.release, self.build)
+        self.assignments = {
+            task.task_name: Assignment.objects.create(task=task, team_member=team_member,
+                                                      effort_estimation=Decimal(effort_estimation))
+            for task, team_member, effort_estimation in [
+                (self.design, self.alice, '3'), (self.build, self.bob, '2'), (self.release, self.alice, '0.5')]}
+
+    @staticmethod
+    def depend(task, predecessor):
+        TaskPredecessor.objects.create(from_task=task, to_task=predecessor)
+
+    def planned(self, task_name):
+        assignment = Assignment.objects.get(pk=self.assignments[task_name].pk)
+        return timezone.localtime(assignment.planned_start_time), timezone.localtime(assignment.planned_end_time)
+
+    def test_successors_start_after_their_predecessors_end(self):
+        ScheduleService.reschedule_with_dependencies()
+
+        for task_name, predecessor_name in [('Build', 'Design'), ('Release', 'Build')]:
+            with self.subTest(task=task_name):
+                start, _ = self.planned(task_name)
+                _, predecessor_end = self.planned(predecessor_name)
+                # On the next working day at the earliest
+                self.assertGreater(start.date(), predecessor_end.date())
+        self.assertFalse(Assignment.objects.filter(need_update=True).exists())
+
+    def test_cycle_names_its_tasks(self):
+        self.depend(self.design, self.release)
+
+        with self.assertRaises(DependencyCycleError) as raised:
+            ScheduleService.reschedule_with_dependencies()
+
+        # The cycle may start at any of its tasks, and lists them in dependency order
+        cycle = raised.exception.tasks
+        start = cycle.index(self.design)
+        self.assertEqual(cycle[start:-1] + cycle[:start + 1], [self.design, self.build, self.release, self.design])
+        self.assertEqual(str(raised.exception),
+                         f'Cycle detected in task dependencies: {" -> ".join(task.task_name for task in cycle)}')
+        self.assertFalse(Assignment.objects.filter(planned_start_time__isnull=False).exists())
+
+
+class SimulationTest(TestCase):
+    """simulate() plans hypothetical edits in memory exactly as the scheduler would plan them once made."""
+
+    def setUp(self):
+        self.alice = create_team_member('alice')
+        self.bob = create_team_member('bob')
+        self.carol = create_team_member('carol')  # without queued work
+        self.assignments = [
+            Assignment.objects.create(task=Task.objects.create(task_name=f'Task {number}', priority=number),
+                                      team_member=team_member, effort_estimation=Decimal(effort_estimation))
+            for number, (team_member, effort_estimation) in enumerate(
+                [(self.alice, '2'), (self.bob, '3'), (self.alice, '1.5'), (self.alice, '1'), (self.bob, '0.5')])]
+        ScheduleService.reschedule_with_dependencies()
+
+    @staticmethod
+    def plans():
+        return {assignment.pk: (assignment.planned_start_time, assignment.planned_end_time)
+                for assignment in Assignment.objects.all()}
+
+    def planned_start_date(self, assignment):
+        return timezone.localtime(Assignment.objects.get(pk=assignment.pk).planned_start_time).date()
+
+    def assert_simulates(self, edit, make_edit):
+        """simulate([edit]) returns the plans that rescheduling moves once make_edit() made the edit."""
+        snapshot = ScheduleSnapshot()
+        before = self.plans()
+        self.assertEqual(snapshot.baseline, before)
+
+        with self.assertNumQueries(0):
+            changes = snapshot.simulate([edit])
+        self.assertEqual(self.plans(), before)
+
+        with transaction.atomic():
+            make_edit()
+            ScheduleService.reschedule_with_dependencies()
+            after = self.plans()
+            transaction.set_rollback(True)
+
+        self.assertTrue(changes)
+        self.assertEqual(
+            {change['assignment_id']: (change['planned_start_time_before'], change['planned_end_time_before'],
+                                       change['planned_start_time_after'], change['planned_end_time_after'])
+             for change in changes},
+            {assignment_id: (*before[assignment_id], *after[assignment_id]) for assignment_id in after
+             if after[assignment_id] != before[assignment_id]})
+
+    def test_change_estimate(self):
+        first = self.assignments[0]
+        self.assert_simulates(ChangeEstimate(first.pk, 4), lambda: Assignment.objects.filter(pk=first.pk).update(
+            effort_estimation=Decimal('4')))
+
+    def test_add_leave(self):
+        start = self.planned_start_date(self.assignments[2])
+        self.assert_simulates(AddLeave(self.alice.pk, start, start + timedelta(days=1)), lambda: [
+            WorkCalendar.objects.create(team_member=self.alice, date=start + timedelta(days=offset), status='leave')
+            for offset in range(2)])
+
+    def test_add_holiday(self):
+        day = self.planned_start_date(self.assignments[4])
+        self.assert_simulates(AddHoliday(day), lambda: Holiday.objects.create(date=day, name='Holiday'))
+
+    def test_reassign(self):
+        moved = self.assignments[0]
+        self.assert_simulates(Reassign(moved.pk, self.carol.pk), lambda: Assignment.objects.filter(
+            pk=moved.pk).update(team_member=self.carol))
+
+    def test_invalid_edits(self):
+        snapshot = ScheduleSnapshot()
+        unknown_team_member_id = self.carol.pk + 1
+        for edit, message in [
+            (lambda: Reassign(self.assignments[0].pk, unknown_team_member_id),
+             f'Team member {unknown_team_member_id} does not exist.'),
+            (lambda: AddLeave(unknown_team_member_id, MONDAY), f'Team member {unknown_team_member_id} does not exist.'),
+            (lambda: ChangeEstimate(0, 1), 'Assignment 0 is not queued with an effort estimation.'),
+            (lambda: ChangeEstimate(self.assignments[0].pk, -1), 'is negative'),
+            (lambda: AddLeave(self.alice.pk, MONDAY, MONDAY - timedelta(days=1)), 'before it starts'),
+        ]:
+            with self.subTest(message=message):
+                with self.assertRaisesMessage(InvalidEdit, message):
+                    snapshot.simulate([edit()])
+
+
+class TaskRollupsTest(TestCase):
+    """The rollups kept up to date by tasks.signals must equal the ones rebuilt from scratch."""
+
+    def setUp(self):
+        self.team_member = create_team_member('alice')
+        self.root = Task.objects.create(task_name='Root')
+        self.feature = Task.objects.create(task_name='Feature', level=2, parent_task=self.root)
+        self.backend = Task.objects.create(task_name='Backend', level=3, parent_task=self.feature)
+        self.frontend = Task.objects.create(task_name='Frontend', level=3, parent_task=self.feature)
+        self.docs = Task.objects.create(task_name='Docs', level=2, parent_task=self.root)
+        self.other_root = Task.objects.create(task_name='Other root')
+        self.assignments = {
+            task.task_name: Assignment.objects.create(
+                task=task, team_member=self.team_member, effort_estimation=Decimal(effort_estimation),
+                planned_start_time=at(MONDAY + timedelta(days=offset)),
+                planned_end_time=at(MONDAY + timedelta(days=offset + 2), 17))
+            for offset, (task, effort_estimation) in enumerate([
+                (self.backend, '3'), (self.frontend, '2.5'), (self.docs, '1'), (self.other_root, '4')])}
+
+    def assert_rollups_up_to_date(self):
+        call_command('rebuild_task_rollups', check=True)
+
+    def test_edits_keep_rollups_up_to_date(self):
+        self.assertEqual(Task.objects.get(pk=self.root.pk).subtree_effort_estimation, Decimal('6.5'))
+
+        backend = self.assignments['Backend']
+        backend.effort_estimation = Decimal('5')
+        backend.actual_start_time = at(MONDAY)
+        backend.actual_end_time = at(MONDAY + timedelta(days=1), 17)
+        backend.save()
+        self.assert_rollups_up_to_date()
+
+        # A leaf that gets a sub-task no longer counts its own assignments
+        Task.objects.create(task_name='Backend tests', level=4, parent_task=self.backend)
+        self.assert_rollups_up_to_date()
+
+        Assignment.objects.create(task=self.docs, team_member=self.team_member, effort_estimation=Decimal('2'))
+        self.assignments['Docs'].delete()
+        self.assert_rollups_up_to_date()
+
+        self.assertEqual(Task.objects.get(pk=self.root.pk).percent_completed, Decimal('0.00'))
+        self.frontend.delete()
+        self.assert_rollups_up_to_date()
+
+    def test_moves_keep_rollups_up_to_date(self):
+        # A subtree moved to another tree leaves the old path and joins the new one
+        self.feature.parent_task = self.other_root
+        self.feature.save()
+        self.assert_rollups_up_to_date()
+
+        other_root = self.assignments['Other root']
+        other_root.task = self.docs
+        other_root.save()
+        self.assert_rollups_up_to_date()
+
+        self.backend.parent_task = None
+        self.backend.save()
+        self.assert_rollups_up_to_date()
+
+    def test_scheduler_keeps_rollups_up_to_date(self):
+        # Only level-1 work is queued, so the scheduler plans the root's own assignment
+        queued = Assignment.objects.create(task=self.root, team_member=self.team_member,
+                                           effort_estimation=Decimal('40'))
+        ScheduleService.reschedule_team_member_batch(self.team_member)
+
+        queued.refresh_from_db()
+        self.assertEqual(Task.objects.get(pk=self.root.pk).latest_planned_end_time, queued.planned_end_time)
+        self.assert_rollups_up_to_date()
+
+
+def create_defects_table():
+    """Create all_veriii_defects as the first upload_defects did and apply the migrations that changed it."""
+    with connection.cursor() as cursor:
+        cursor.execute(f'CREATE TABLE {DEFECTS_TABLE} '
+                       f'({", ".join(f"{quote_identifier(column)} text" for column in DEFECT_COLUMNS)})')
+        for migration in DEFECT_MIGRATIONS:
+            for operation in import_module(f'tasks.migrations.{migration}').Migration.operations:
+                cursor.execute(operation.sql)
+
+
+def view_definitions():
+    """{name: definition} of the views and materialized views of the tasks db code and their live views."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT relname, pg_get_viewdef(oid) FROM pg_class
+            WHERE relnamespace = current_schema()::regnamespace AND relkind IN ('v', 'm')
+              AND (relname LIKE 'veriii%%' OR relname LIKE 'all_completion_work%%')""")
+        return dict(cursor.fetchall())
+
+
+class DefectsTestCase(TestCase):
+    """Loads defect exports written to a temporary directory into a fresh all_veriii_defects."""
+
+    def setUp(self):
+        create_defects_table()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write_export(self, name, rows, columns=DEFECT_COLUMNS):
+        """Write an export of `rows`, dicts of column values that default to empty, and return its path."""
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding=CSV_ENCODING, newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            writer.writerows([row.get(column, '') for column in columns] for row in rows)
+        return path
+
+    @staticmethod
+    def defect(content, **columns):
+        return {'content': content, 'Executor': 'alice', 'Priority': '普通', 'Workflow Status': '待部署生产环境',
+                'Creation Time': '2025-01-06 10:00:00', 'complete time': '2025-01-08', **columns}
+
+    @staticmethod
+    def loaded_contents():
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT content FROM {DEFECTS_TABLE} ORDER BY id')
+            return [content for content, in cursor.fetchall()]
+
+    @staticmethod
+    def defect_ids():
+        """{content: id} of the loaded defects."""
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT content, id FROM {DEFECTS_TABLE} ORDER BY id')
+            return dict(cursor.fetchall())
+
+
+class DbCodeTest(DefectsTestCase):
+    """compile_db and the defect table swap keep the views of tasks/db_code as one consistent graph."""
+
+    def setUp(self):
+        super().setUp()
+        team_member = create_team_member('alice')
+        Assignment.objects.create(task=Task.objects.create(task_name='Done'), team_member=team_member,
+                                  effort_estimation=Decimal('1'), actual_start_time=at(MONDAY),
+                                  actual_end_time=at(MONDAY, 17))
+        self.export = self.write_export('defects.csv', [self.defect('Closed defect'), self.defect(
+            'Open defect', **{'Workflow Status': 'Working On It[工作进行中]', 'complete time': ''})])
+
+    @staticmethod
+    def completion_work(view='all_completion_work'):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id, description FROM {view} ORDER BY id')
+            return cursor.fetchall()
+
+    @override_settings(MATERIALIZE_DB_VIEWS=True)
+    def test_swap_recompiles_views_reading_live_views(self):
+        call_command('compile_db', stdout=StringIO())
+        compiled = view_definitions()
+        # Each live view reads the live views of the views it selects from, never a materialized view
+        self.assertRegex(compiled['all_completion_work_live'], r'\bveriii_task_assignments_live\b')
+        self.assertNotRegex(compiled['all_completion_work_live'], r'\bveriii_task_assignments\b(?!_live)')
+
+        counts = load_defects([self.export], swap=True)
+
+        self.assertEqual(counts['refreshed'], ['veriii_task_assignments', 'all_completion_work'])
+        self.assertEqual(view_definitions(), compiled)
+        self.assertEqual(self.completion_work(),
+                         [('defect1', 'Closed defect'), (f'task{Assignment.objects.get().pk}', 'Done')])
+        self.assertEqual(self.completion_work(), self.completion_work('all_completion_work_live'))
+
+    def compiled_files(self):
+        return [file['name'] for file in compile_db_code([apps.get_app_config('tasks')])]
+
+    def test_changed_file_recompiles_its_dependents(self):
+        # A copy of the db code, so a file can be changed
+        app_config = apps.get_app_config('tasks')
+        shutil.copytree(os.path.join(app_config.path, 'db_code'), os.path.join(self.directory, 'db_code'))
+        with mock.patch.object(app_config, 'path', self.directory):
+            self.assertEqual(self.compiled_files(),
+                             ['001_veriii_defects.sql', '002_veriii_tasks.sql', '003_all_completion_work.sql'])
+            self.assertEqual(self.compiled_files(), [])
+
+            # all_completion_work reads veriii_defects and veriii_task_assignments, which read no other view
+            for changed, compiled in [
+                ('001_veriii_defects.sql', ['001_veriii_defects.sql', '003_all_completion_work.sql']),
+                ('002_veriii_tasks.sql', ['002_veriii_tasks.sql', '003_all_completion_work.sql']),
+                ('003_all_completion_work.sql', ['003_all_completion_work.sql']),
+            ]:
+                with self.subTest(changed=changed):
+                    with open(os.path.join(self.directory, 'db_code', changed), 'a') as file:
+                        file.write(f'\n-- {changed} changed\n')
+                    self.assertEqual(self.compiled_files(), compiled)
+
+            # Materializing views recompiles the files that create them, and their dependents
+            with override_settings(MATERIALIZE_DB_VIEWS=True):
+                self.assertEqual(self.compiled_files(), ['002_veriii_tasks.sql', '003_all_completion_work.sql'])
+                self.assertEqual(self.compiled_files(), [])
+
+    def test_plain_views_by_default(self):
+        with override_settings(MATERIALIZE_DB_VIEWS=True):
+            call_command('compile_db', stdout=StringIO())
+        call_command('compile_db', stdout=StringIO())
+
+        self.assertEqual(set(view_definitions()),
+                         {'veriii_defects', 'veriii_task_assignments', 'all_completion_work'})
+        self.assertEqual(load_defects([self.export], swap=True)['refreshed'], [])
+        self.assertEqual(len(self.completion_work()), 2)
+
+
+class IncrementalLoadTest(DefectsTestCase):
+    """An incremental load writes only the new, changed and missing rows, and keeps the ids of the others."""
+
+    def setUp(self):
+        super().setUp()
+        self.first = [self.defect('Login fails'), self.defect('Slow report', Priority='紧急'),
+                      self.defect('Typo'), self.defect('Typo'), self.defect('Crash on save')]
+
+    def load(self, rows, key_columns=None):
+        return load_defects([self.write_export('defects.csv', rows)], key_columns, incremental=True)
+
+    def test_rows_keyed_by_content(self):
+        self.assertEqual(self.load(self.first)['inserted'], 5)
+        ids = self.defect_ids()
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT MIN(id) FROM {DEFECTS_TABLE} WHERE content = 'Typo'")
+            first_typo, = cursor.fetchone()
+
+        # An edited row has another content key, so it is deleted and inserted again
+        second = [self.first[0], self.defect('Slow report', Priority='非常紧急'), self.first[2],
+                  self.defect('Export empty')]
+        counts = self.load(second)
+
+        self.assertEqual({kind: counts[kind] for kind in ['inserted', 'updated', 'deleted', 'unchanged']},
+                         {'inserted': 2, 'updated': 0, 'deleted': 3, 'unchanged': 2})
+        loaded = self.defect_ids()
+        self.assertEqual(set(loaded), {'Login fails', 'Slow report', 'Typo', 'Export empty'})
+        self.assertEqual(loaded['Login fails'], ids['Login fails'])
+        self.assertNotEqual(loaded['Slow report'], ids['Slow report'])
+        # Of two identical rows, the one loaded first is kept
+        self.assertEqual(loaded['Typo'], first_typo)
+
+    def test_rows_keyed_by_columns(self):
+        self.load(self.first[:3], ['content'])
+        ids = self.defect_ids()
+
+        second = [self.defect('Login fails', Executor='bob'), self.first[1], self.defect('Export empty')]
+        counts = self.load(second, ['content'])
+
+        self.assertEqual({kind: counts[kind] for kind in ['inserted', 'updated', 'deleted', 'unchanged']},
+                         {'inserted': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1})
+        loaded = self.defect_ids()
+        self.assertEqual(set(loaded), {'Login fails', 'Slow report', 'Export empty'})
+        # Updated rows are changed in place, with their typed columns
+        self.assertEqual(loaded['Login fails'], ids['Login fails'])
+        self.assertEqual(loaded['Slow report'], ids['Slow report'])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT "Executor" FROM {DEFECTS_TABLE} WHERE content = %s', ['Login fails'])
+            self.assertEqual(cursor.fetchone(), ('bob',))
+
+    def test_duplicate_keys_are_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'Several rows have the same content'):
+            self.load(self.first, ['content'])
+        with self.assertRaisesMessage(ValueError, 'Unknown all_veriii_defects columns: title'):
+            self.load(self.first, ['title'])
+        self.assertEqual(self.defect_ids(), {})
+
+
+class SwapLoadTest(DefectsTestCase):
+    """A swapped load puts the shadow table in place of the defects table under the defects table's names."""
+
+    def setUp(self):
+        super().setUp()
+        call_command('compile_db', stdout=StringIO())
+        load_defects([self.write_export('first.csv', [self.defect('Login fails'), self.defect('Typo')])])
+        self.second = self.write_export('second.csv', [self.defect('Slow report'), self.defect('Crash on save'),
+                                                       self.defect('Export empty')])
+
+    @staticmethod
+    def schema():
+        """The names of the defects table's indexes and of its id sequence."""
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s ORDER BY indexname',
+                           [DEFECTS_TABLE])
+            indexes = [index for index, in cursor.fetchall()]
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [DEFECTS_TABLE, 'id'])
+            sequence, = cursor.fetchone()
+        return indexes, sequence
+
+    @staticmethod
+    def count(relation):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {relation}')
+            return cursor.fetchone()[0]
+
+    def test_swap_keeps_names_and_views(self):
+        schema = self.schema()
+        self.assertIn('all_veriii_defects_row_key_uniq', schema[0])
+
+        self.assertEqual(load_defects([self.second], swap=True)['inserted'], 3)
+
+        self.assertEqual(self.schema(), schema)
+        self.assertEqual(self.count("pg_class WHERE relnamespace = current_schema()::regnamespace "
+                                    "AND relname LIKE '%%shadow%%'"), 0)
+        # The new table numbers its rows from 1, and goes on from there
+        self.assertEqual(self.defect_ids(), {'Slow report': 1, 'Crash on save': 2, 'Export empty': 3})
+        load_defects([self.write_export('third.csv', [self.defect('Slow report'), self.defect('Typo')])],
+                     incremental=True)
+        self.assertEqual(self.defect_ids(), {'Slow report': 1, 'Typo': 4})
+        # The views dropped with the old table read the new one
+        self.assertEqual(self.count('veriii_defects'), 2)
+        self.assertEqual(self.count('all_completion_work'), 2)
+
+    def test_swap_is_retried_when_locks_time_out(self):
+        timeout = OperationalError('canceling statement due to lock timeout')
+        timeout.__cause__ = Exception()
+        timeout.__cause__.pgcode = LOCK_NOT_AVAILABLE
+        compile_app = 'tasks.services.defect_ingest.compile_app'
+
+        # The first two attempts time out recreating the views, the third one recreates them
+        with mock.patch(compile_app, wraps=db_code.compile_app, side_effect=[timeout, timeout, mock.DEFAULT]), \
+                mock.patch('tasks.services.defect_ingest.time.sleep') as sleep, \
+                self.assertLogs('tasks', 'WARNING') as logs:
+            load_defects([self.second], swap=True)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(set(self.defect_ids()), {'Slow report', 'Crash on save', 'Export empty'})
+
+        with mock.patch(compile_app, side_effect=timeout) as always_times_out, \
+                mock.patch('tasks.services.defect_ingest.time.sleep'), self.assertLogs('tasks', 'WARNING'):
+            with self.assertRaises(SwapTimeout):
+                load_defects([self.second], swap=True)
+        self.assertEqual(always_times_out.call_count, SWAP_ATTEMPTS)
+        # The defects table is left as it was, and the new rows in the shadow table
+        self.assertEqual(set(self.defect_ids()), {'Slow report', 'Crash on save', 'Export empty'})
+        self.assertEqual(self.count('all_veriii_defects_shadow'), 3)
+        self.assertEqual(self.count('veriii_defects'), 3)
+
+
+class ChunkedLoadTest(DefectsTestCase):
+    """Exports are parsed and copied in chunks, which must load the same rows as one big chunk."""
+
+    def test_chunk_boundaries(self):
+        # A field with a line break and quotes, so rows and lines differ
+        contents = [f'Defect {number}' if number % 3 else f'Defect {number}, "quoted"\nsecond line'
+                    for number in range(7)]
+        export = self.write_export('defects.csv', [self.defect(content) for content in contents])
+
+        for chunk_size in [1, 3, 7, 8]:
+            with self.subTest(chunk_size=chunk_size):
+                progress = []
+                counts = load_defects([export], chunk_size=chunk_size, workers=2,
+                                      progress=lambda csv_file, rows: progress.append(rows))
+                self.assertEqual(self.loaded_contents(), contents)
+                self.assertEqual(counts['files'][0]['rows'], 7)
+                self.assertEqual(progress, [*range(chunk_size, 7, chunk_size), 7])
+
+        # Line numbers of bad rows count the lines of the earlier chunks: the header, then 7 rows on 10 lines
+        with open(export, 'a', encoding=CSV_ENCODING, newline='') as file:
+            file.write('too,few,fields\r\n')
+        for chunk_size in [3, 8]:
+            with self.subTest(chunk_size=chunk_size):
+                with self.assertRaisesMessage(ValueError, 'line 12: 3 fields, the header has 12'):
+                    load_defects([export], chunk_size=chunk_size)
+        self.assertEqual(self.loaded_contents(), contents)
+
+    def test_exports_with_different_columns(self):
+        first = self.write_export('first.csv', [self.defect(f'First {number}', Executor='alice')
+                                                 for number in range(5)])
+        # Another column order, and without the columns this system doesn't export
+        columns = ['Executor', 'Workflow Status', 'content', 'Priority', 'Creation Time', 'complete time']
+        second = self.write_export('second.csv', [self.defect(f'Second {number}', Executor='bob')
+                                                  for number in range(3)], columns)
+
+        call_command('upload_defects', first, second, chunk_size=2, workers=2)
+
+        self.assertEqual(self.loaded_contents(), [*(f'First {number}' for number in range(5)),
+                                                  *(f'Second {number}' for number in range(3))])
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT "Executor", COUNT(*), COUNT("问题类别"), COUNT(priority_no) '
+                           f'FROM {DEFECTS_TABLE} GROUP BY "Executor" ORDER BY "Executor"')
+            self.assertEqual(cursor.fetchall(), [('alice', 5, 0, 5), ('bob', 3, 0, 3)])
+
+    def test_bad_headers_are_rejected(self):
+        loaded = self.write_export('loaded.csv', [self.defect('Loaded')])
+        call_command('upload_defects', loaded)
+
+        rows = [self.defect('Not loaded')]
+        for columns, message in [
+            (['content', 'Title'], 'unknown or repeated all_veriii_defects columns in the header: Title'),
+            (['content', 'Executor', 'content'], 'unknown or repeated all_veriii_defects columns in the header: '
+                                                 'content, Executor, content'),
+            ([], 'has no header line'),  # a blank first line
+        ]:
+            with self.subTest(columns=columns):
+                bad = self.write_export('bad.csv', rows, columns)
+                with self.assertRaisesMessage(CommandError, message):
+                    call_command('upload_defects', loaded, bad, chunk_size=1)
+                self.assertEqual(self.loaded_contents(), ['Loaded'])
+
+
+class TypedColumnsTest(DefectsTestCase):
+    """The typed columns of loaded defects, computed from their exported text."""
+
+    def test_typed_values(self):
+        rows = [
+            # content: Priority, Workflow Status, Creation Time, complete time
+            ('Very urgent', '非常紧急', '待部署生产环境', '2025-01-06 10:00:00', '2025-01-08'),
+            ('Urgent', '紧急', 'Verified(生产问题则代表已发版)', '2025/1/6', '2025-01-08 18:30:00'),
+            ('Normal', '普通', 'Working On It[工作进行中]', '2025-01-06 25:00:00', ''),
+            ('Low', '较低', '', '2025-13-40', 'soon'),
+            ('Unknown priority', 'P1', '待部署生产环境', 'not a date', '2025-02-31'),
+            ('No priority', '', 'To Be Discussed(待讨论）', '', '08/01/2025'),
+        ]
+        load_defects([self.write_export('defects.csv', [
+            self.defect(content, Priority=priority, **{'Workflow Status': status, 'Creation Time': created,
+                                                       'complete time': completed})
+            for content, priority, status, created, completed in rows])])
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT content, priority_no, workflow_status, creation_date, creation_timestamp, '
+                           f'complete_date FROM {DEFECTS_TABLE} ORDER BY id')
+            typed = cursor.fetchall()
+
+        # Values that don't start with a valid date, or date and time, are NULL rather than failing the load
+        january_6 = datetime(2025, 1, 6, tzinfo=dt_timezone.utc)
+        self.assertEqual(typed, [
+            ('Very urgent', 1, 'Closed', date(2025, 1, 6), january_6.replace(hour=10), date(2025, 1, 8)),
+            ('Urgent', 2, 'Closed', date(2025, 1, 6), january_6, date(2025, 1, 8)),
+            ('Normal', 3, 'WIP', date(2025, 1, 6), None, None),
+            ('Low', 4, 'WIP', None, None, None),
+            ('Unknown priority', None, 'Closed', None, None, None),
+            ('No priority', None, 'WIP', None, None, None),
+        ])
+
+
+# Static files as in development, without collectstatic's manifest and directory
+@override_settings(STATIC_ROOT=None, STORAGES={**settings.STORAGES, 'staticfiles': {
+    'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+class GanttTestCase(TestCase):
+    """Assignments of two team members around today, for the Gantt page and its data endpoint."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = create_team_member('alice')
+        self.bob = create_team_member('bob')
+        today = timezone.localdate()
+        self.assignments = []
+        for number, (team_member, offset, actual) in enumerate(
+                [(self.alice, 0, True), (self.bob, 1, False), (self.alice, 3, False), (self.bob, 4, False),
+                 (self.alice, 6, False)]):
+            start = at(today + timedelta(days=offset))
+            self.assignments.append(Assignment.objects.create(
+                task=Task.objects.create(task_name=f'Task {number}'), team_member=team_member,
+                effort_estimation=Decimal('1'), planned_start_time=start, planned_end_time=start + timedelta(hours=8),
+                actual_start_time=start if actual else None,
+                actual_end_time=start + timedelta(hours=6) if actual else None))
+
+    def figure(self, response):
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        start = content.index('<script id="gantt-figure" type="application/json">')
+        return json.loads(content[content.index('>', start) + 1:content.index('</script>', start)])
+
+
+class GanttChartTest(GanttTestCase):
+
+    def test_one_trace_per_kind_and_member(self):
+        # The latest change of the assignments, tasks and team members, then the assignments
+        with self.assertNumQueries(4):
+            figure = self.figure(self.client.get(reverse('gantt_chart')))
+
+        traces = {trace['name']: trace['y'] for trace in figure['data']}
+        self.assertEqual(traces, {
+            'Planned (alice)': ['Task 0', 'Task 2', 'Task 4'],
+            'Actual (alice)': ['Task 0'],
+            'Planned (bob)': ['Task 1', 'Task 3'],
+        })
+        planned = next(trace for trace in figure['data'] if trace['name'] == 'Planned (alice)')
+        self.assertEqual(planned['x'], [8, 8, 8])
+        self.assertEqual(planned['base'][0], self.assignments[0].planned_start_time.timestamp() * 1000)
+
+    def test_conditional_requests(self):
+        url = reverse('gantt_chart')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # Unchanged: answered from the history lookups, or from the cached page without a conditional header
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(url).content, response.content)
+
+        # Other filters are another page
+        other = self.client.get(url, {'member': self.bob.pk}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(other.status_code, 200)
+        self.assertNotEqual(other['ETag'], etag)
+
+        # Any edit moves the ETag on
+        moved = self.assignments[2]
+        moved.planned_start_time += timedelta(days=1)
+        moved.planned_end_time += timedelta(days=1)
+        moved.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        planned = next(trace for trace in self.figure(response)['data'] if trace['name'] == 'Planned (alice)')
+        self.assertEqual(planned['base'][1], moved.planned_start_time.timestamp() * 1000)
+
+
+class GanttDataTest(GanttTestCase):
+
+    def get(self, status=200, **params):
+        response = self.client.get(reverse('gantt_data'), params)
+        self.assertEqual(response.status_code, status)
+        return response.json()
+
+    def test_pages(self):
+        pages = []
+        after = None
+        while True:
+            page = self.get(limit=2, **({'after': after} if after else {}))
+            pages.append(page['assignment_id'])
+            after = page['next_after']
+            if after is None:
+                break
+            self.assertEqual(after, page['assignment_id'][-1])
+
+        ids = [assignment.pk for assignment in self.assignments]
+        self.assertEqual(pages, [ids[:2], ids[2:4], ids[4:]])
+
+    def test_filters(self):
+        today = timezone.localdate()
+        page = self.get(start=str(today + timedelta(days=1)), end=str(today + timedelta(days=4)))
+        self.assertEqual(page['assignment_id'], [self.assignments[1].pk, self.assignments[2].pk])
+        self.assertEqual(page['planned_start_time'][0],
+                         round(self.assignments[1].planned_start_time.timestamp() * 1000))
+
+        page = self.get(member=self.bob.pk)
+        self.assertEqual(page['team_member'], ['bob', 'bob'])
+
+    def test_bad_filters(self):
+        for params in [{'start': 'tomorrow'}, {'end': '2025-02-31'}, {'member': 'alice'}, {'level': 'top'},
+                       {'after': 'last'}, {'limit': 'all'}]:
+            with self.subTest(params=params):
+                self.assertIn('error', self.get(status=400, **params))
+                if set(params) & {'start', 'end', 'member', 'level'}:
+                    response = self.client.get(reverse('gantt_chart'), params)
+                    self.assertEqual(response.status_code, 400)
+                    self.assertContains(response, 'Invalid', status_code=400)
+
+    def test_limit_is_clamped(self):
+        ids = [assignment.pk for assignment in self.assignments]
+        self.assertEqual(self.get(limit=0)['assignment_id'], ids[:1])
+        self.assertEqual(self.get(limit=-5)['assignment_id'], ids[:1])
+        with mock.patch('tasks.views.MAX_GANTT_PAGE_SIZE', 3):
+            page = self.get(limit=100)
+        self.assertEqual((page['assignment_id'], page['next_after']), (ids[:3], ids[2]))
+
+
+class ExportTest(DefectsTestCase):
+    """The reporting views stream as CSV or JSON lines, to staff members only."""
+
+    def setUp(self):
+        super().setUp()
+        self.team_member = create_team_member('alice')
+        finished = timezone.now() - timedelta(hours=1)
+        self.assignment = Assignment.objects.create(
+            task=Task.objects.create(task_name='Done, "quoted"', priority=2), team_member=self.team_member,
+            effort_estimation=Decimal('1'), actual_start_time=finished - timedelta(days=1), actual_end_time=finished)
+        load_defects([self.write_export('defects.csv', [self.defect('Closed defect')])])
+        call_command('compile_db', stdout=StringIO())
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+
+    def export(self, name, export_format, **params):
+        response = self.client.get(reverse('export', args=[name, export_format]), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{name}.{export_format}"')
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.reader(StringIO(self.export('task-assignments', 'csv'))))
+        self.assertEqual(rows[0], ['id', 'task_name', 'priority', 'username', 'planed_start_time', 'planed_end_time',
+                                   'planned_verification_time', 'effort_estimation_in_man_days',
+                                   'actual_start_time', 'actual_end_time'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][:4], [str(self.assignment.pk), 'Done, "quoted"', 'P2', 'alice'])
+
+    def test_jsonl(self):
+        lines = [json.loads(line) for line in self.export('completion-work', 'jsonl').splitlines()]
+        self.assertEqual({(line['id'], line['task_type'], line['description']) for line in lines},
+                         {('defect1', 'issues', 'Closed defect'), (f'task{self.assignment.pk}', 'tasks',
+                                                                   'Done, "quoted"')})
+
+        # The date ranges of the admin list filters
+        lines = self.export('completion-work', 'jsonl', range='past_7_days').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [f'task{self.assignment.pk}'])
+        response = self.client.get(reverse('export', args=['completion-work', 'jsonl']), {'range': 'someday'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_staff_only(self):
+        url = reverse('export', args=['completion-work', 'csv'])
+        self.assertEqual(self.client.get(reverse('export', args=['defects', 'csv'])).status_code, 404)
+
+        self.client.force_login(User.objects.create_user('member'))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.logout()
+        self.assertRedirects(self.client.get(url), f'{reverse("admin:login")}?next={url}',
+                             fetch_redirect_response=False)
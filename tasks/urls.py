@@ -3,4 +3,6 @@ from . import views
 
 urlpatterns = [
     path('gantt-chart/', views.gantt_chart_view, name='gantt_chart'),
-]
\ No newline at end of file
+    path('gantt-data/', views.gantt_data_view, name='gantt_data'),
+    path('export/<slug:name>.<slug:export_format>', views.export_view, name='export'),
+]
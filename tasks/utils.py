@@ -1,7 +1,54 @@
 # utils.py
+from datetime import date, timedelta
+
 from django.utils import timezone
 
+# Choices of the date range list filters (see filter_by_date_range)
+DATE_RANGE_CHOICES = (
+    ('last_month', 'Last month'),
+    ('this_month', 'This month'),
+    ('this_year', 'This year'),
+    ('past_7_days', 'Past 7 days'),
+    ('today', 'Today'),
+    ('any_date', 'Any date'),
+    ('no_date', 'No date'),
+)
+
 
 def get_today():
     """Return the current date in the local timezone."""
     return timezone.localdate()
+
+
+def filter_by_date_range(queryset, field, value):
+    """Filter a queryset on a date/datetime field with one of the DATE_RANGE_CHOICES values.
+
+    Unknown or empty values return None, like a list filter without a selection.
+    """
+    now = timezone.now()
+    if value == 'last_month':
+        # Calculate the start and end of last month
+        this_month_start = date(now.year, now.month, 1)
+        last_month_end = this_month_start - timedelta(days=1)
+        last_month_start = date(last_month_end.year, last_month_end.month, 1)
+        return queryset.filter(**{f'{field}__gte': last_month_start, f'{field}__lte': last_month_end})
+    elif value == 'this_month':
+        this_month_start = date(now.year, now.month, 1)
+        next_month = this_month_start.replace(day=28) + timedelta(days=4)  # this will never fail
+        this_month_end = next_month - timedelta(days=next_month.day)
+        return queryset.filter(**{f'{field}__gte': this_month_start, f'{field}__lte': this_month_end})
+    elif value == 'this_year':
+        this_year_start = date(now.year, 1, 1)
+        this_year_end = date(now.year, 12, 31)
+        return queryset.filter(**{f'{field}__gte': this_year_start, f'{field}__lte': this_year_end})
+    elif value == 'past_7_days':
+        seven_days_ago = now - timedelta(days=7)
+        return queryset.filter(**{f'{field}__gte': seven_days_ago})
+    elif value == 'today':
+        today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+        return queryset.filter(**{f'{field}__gte': today_start, f'{field}__lte': today_end})
+    elif value == 'any_date':
+        return queryset.exclude(**{f'{field}__isnull': True})
+    elif value == 'no_date':
+        return queryset.filter(**{f'{field}__isnull': True})
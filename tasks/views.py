@@ -1,40 +1,170 @@
+import hashlib
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db.models import Max
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
-import plotly.graph_objs as go
-from .models import Assignment
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.safestring import mark_safe
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .models import Assignment, Task, TeamMember
+from .services.export import EXPORT_FORMATS, EXPORTS, export_lines
+from .services.gantt import filter_gantt_assignments, gantt_figure, gantt_payload, load_gantt_columns, load_gantt_page
+
+# Window shown when the page is opened without start/end, the rest is fetched while scrolling
+DEFAULT_WINDOW_BEFORE = timedelta(days=30)
+DEFAULT_WINDOW_AFTER = timedelta(days=90)
+GANTT_PAGE_SIZE = 5000
+# Cached pages are keyed by the latest history change, so the timeout only bounds the memory they use
+GANTT_CACHE_TIMEOUT = 24 * 60 * 60
+# Same escaping as the json_script filter, for JSON that is already serialized
+JSON_SCRIPT_ESCAPES = {ord('>'): '\\u003E', ord('<'): '\\u003C', ord('&'): '\\u0026'}
+MAX_GANTT_PAGE_SIZE = 20000
+
+
+def parse_time(value):
+    """Parse an ISO date or datetime from the query string; naive values are in the current time zone."""
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed_date = parse_date(value)
+        if parsed_date is None:
+            raise ValueError(f'Invalid date or datetime: {value!r}')
+        parsed = datetime.combine(parsed_date, time.min)
+    return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+
+def parse_gantt_filters(request):
+    """Read the start/end window, member ids, department and task level from the query string."""
+    try:
+        return {
+            'start': parse_time(request.GET['start']) if request.GET.get('start') else None,
+            'end': parse_time(request.GET['end']) if request.GET.get('end') else None,
+            'team_member_ids': [int(member) for member in request.GET.getlist('member') if member],
+            'department': request.GET.get('department') or None,
+            'level': int(request.GET['level']) if request.GET.get('level') else None,
+        }
+    except (TypeError, ValueError) as error:
+        raise ValueError(f'Invalid Gantt filter: {error}')
+
+
+def gantt_window(request):
+    """Filters of the Gantt page, with the default window filled in.
+
+    The default window runs from midnight to midnight, so it stays the same (and cacheable) for a whole day.
+    """
+    filters = parse_gantt_filters(request)
+    today = timezone.localdate()
+    filters['start'] = filters['start'] or timezone.make_aware(datetime.combine(today - DEFAULT_WINDOW_BEFORE, time.min))
+    filters['end'] = filters['end'] or timezone.make_aware(datetime.combine(today + DEFAULT_WINDOW_AFTER, time.min))
+    return filters
+
+
+def gantt_changed_at(request):
+    """Latest change to the assignments, tasks or team members on the chart, read from their history tables.
+
+    Every save and delete (including the scheduler's bulk updates) adds a history row, so this moves on
+    with any edit. Looked up once per request, as the ETag, Last-Modified and cache key all use it.
+    """
+    if not hasattr(request, '_gantt_changed_at'):
+        request._gantt_changed_at = max(
+            [changed_at for changed_at in [model.history.aggregate(changed_at=Max('history_date'))['changed_at']
+                                           for model in (Assignment, Task, TeamMember)] if changed_at is not None],
+            default=None)
+    return request._gantt_changed_at
+
+
+def gantt_chart_etag(request):
+    try:
+        filters = gantt_window(request)
+    except ValueError:
+        return None
+    key = repr((gantt_changed_at(request), sorted(filters.items())))
+    return hashlib.sha1(key.encode()).hexdigest()
 
 
+def gantt_chart_last_modified(request):
+    changed_at = gantt_changed_at(request)
+    if not request.GET.get('start') or not request.GET.get('end'):
+        # The default window moves on at midnight even without any edit
+        midnight = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+        changed_at = max(changed_at, midnight) if changed_at else midnight
+    return changed_at
+
+
+@cache_control(no_cache=True)
+@condition(etag_func=gantt_chart_etag, last_modified_func=gantt_chart_last_modified)
 def gantt_chart_view(request):
-    assignments = Assignment.objects.all()
-
-    fig = go.Figure()
-
-    for assignment in assignments:
-        fig.add_trace(go.Bar(
-            x=[(
-                       assignment.planned_end_time - assignment.planned_start_time).total_seconds() / 3600 if assignment.planned_start_time and assignment.planned_end_time else None],
-            y=[assignment.task.task_name],
-            base=[assignment.planned_start_time.timestamp() * 1000 if assignment.planned_start_time else None],
-            orientation='h',
-            name=f"Planned ({assignment.team_member})"
-        ))
-
-        if assignment.actual_start_time and assignment.actual_end_time:
-            fig.add_trace(go.Bar(
-                x=[(assignment.actual_end_time - assignment.actual_start_time).total_seconds() / 3600],
-                y=[assignment.task.task_name],
-                base=[assignment.actual_start_time.timestamp() * 1000],
-                orientation='h',
-                name=f"Actual ({assignment.team_member})",
-                opacity=0.6
-            ))
-
-    fig.update_layout(
-        title='Task Assignments Gantt Chart',
-        barmode='overlay',
-        xaxis_title="Time (Hours)",
-        yaxis_title="Tasks"
-    )
-
-    chart_html = fig.to_html(full_html=False)
-
-    return render(request, 'gantt_chart.html', {'chart_html': chart_html})
+    try:
+        filters = gantt_window(request)
+    except ValueError as error:
+        return render(request, 'gantt_chart.html', {'error': str(error)}, status=400)
+
+    # 图表按历史表最新修改时间缓存，任何修改都会生成新的缓存键
+    cache_key = f'gantt_page:{gantt_chart_etag(request)}'
+    content = cache.get(cache_key)
+    if content is None:
+        # 只渲染可见时间窗口，其余数据在滚动时通过 gantt_data_view 获取
+        columns = load_gantt_columns(filter_gantt_assignments(Assignment.objects.order_by('pk'), **filters))
+        fig = gantt_figure(columns)
+
+        # 只输出图表 JSON，plotly.js 作为静态文件单独加载和缓存
+        figure_json = mark_safe(fig.to_json().translate(JSON_SCRIPT_ESCAPES))
+
+        content = render_to_string('gantt_chart.html', {
+            'figure_json': figure_json,
+            'assignment_ids': columns['assignment_id'],
+            'data_url': reverse('gantt_data'),
+            'window_start': round(filters['start'].timestamp() * 1000),
+            'window_end': round(filters['end'].timestamp() * 1000),
+        }, request)
+        cache.set(cache_key, content, GANTT_CACHE_TIMEOUT)
+
+    return HttpResponse(content)
+
+
+def gantt_data_view(request):
+    """Gantt bars of a time window as parallel arrays, one page of at most `limit` assignments per request.
+
+    Query parameters: start/end (ISO dates or datetimes), member (repeatable team member id), department,
+    level, and after/limit for paging; `next_after` in the response is the `after` of the next page.
+    """
+    try:
+        filters = parse_gantt_filters(request)
+        after = int(request.GET['after']) if request.GET.get('after') else None
+        limit = min(int(request.GET.get('limit') or GANTT_PAGE_SIZE), MAX_GANTT_PAGE_SIZE)
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    columns, next_after = load_gantt_page(filter_gantt_assignments(Assignment.objects.all(), **filters),
+                                          after=after, limit=max(limit, 1))
+    return JsonResponse(gantt_payload(columns, next_after))
+
+
+@login_required(login_url='admin:login')
+def export_view(request, name, export_format):
+    """Stream a whole reporting view as CSV or JSON lines, optionally limited to a date range.
+
+    The `range` query parameter takes the values of the admin date list filters (last_month, this_month, ...).
+    Anonymous users are sent to the admin login, users who aren't staff get a 403.
+    """
+    if not request.user.is_staff:
+        raise PermissionDenied
+    if name not in EXPORTS or export_format not in EXPORT_FORMATS:
+        raise Http404(f'No export {name}.{export_format}')
+    try:
+        lines = export_lines(name, export_format, request.GET.get('range'))
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+
+    content_type = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(lines, content_type=f'{content_type}; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{name}.{export_format}"'
+    return response